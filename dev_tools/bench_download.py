@@ -0,0 +1,76 @@
+"""
+Microbenchmark of the download_in_chunks copy loop against a local HTTP server
+
+Compares the previous loop (fresh 8 KiB bytes object per read and a progress
+update per block) with copy_stream (readinto on a reusable buffer with adaptive
+chunk size and time-throttled progress)
+
+Usage: python dev_tools/bench_download.py [size in MiB] [rounds]
+"""
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+# for the LocalHTTPServer test helper
+sys.path.insert(0, os.path.join(ROOT_DIR, "tests"))
+
+from gwaripper import http_session  # noqa: E402
+from gwaripper.download import copy_stream, ThrottledProgress  # noqa: E402
+from utils import LocalHTTPServer  # noqa: E402
+
+
+def progress_callback(size_dl):
+    # stand-in for prog_bar_dl without actually writing to stdout
+    "\rDownloading: {:4.2f} MB".format(size_dl / 1024**2)
+
+
+def old_loop(response, dst):
+    size_dl = 0
+    while True:
+        chunk = response.read(8192)
+        if not chunk:
+            break
+        size_dl += len(chunk)
+        dst.write(chunk)
+        progress_callback(size_dl)
+    return size_dl
+
+
+def new_loop(response, dst):
+    return copy_stream(response, dst, progress=ThrottledProgress(progress_callback))
+
+
+def bench(server, dest, loop, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        with http_session.urlopen(server.url("/file")) as response, open(dest, "wb") as f:
+            size = loop(response, f)
+        best = min(best, time.perf_counter() - started)
+    return size / 1024**2 / best
+
+
+def main():
+    size_mib = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with contextlib.ExitStack() as stack:
+        server = stack.enter_context(LocalHTTPServer())
+        tmpdir = stack.enter_context(tempfile.TemporaryDirectory())
+        server.files["/file"] = os.urandom(size_mib * 1024**2)
+        dest = os.path.join(tmpdir, "file")
+
+        old = bench(server, dest, old_loop, rounds)
+        new = bench(server, dest, new_loop, rounds)
+
+    print(f"{size_mib} MiB, best of {rounds}")
+    print(f"read(8192) + progress per block: {old:8.1f} MB/s")
+    print(f"readinto + adaptive chunks:      {new:8.1f} MB/s ({new / old:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of classifying a batch of urls into supported/unsupported/unknown
+
+Compares the previous linear scan (is_compatible of every extractor in order,
+then every FILTER_URLS_RE pattern) with the hostname dispatch index of
+find_extractor and the combined unsupported-audio regex
+
+Usage: python dev_tools/bench_find_extractor.py [nr of urls] [rounds]
+"""
+import os
+import sys
+import time
+import random
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from gwaripper.extractors import find_extractor, AVAILABLE_EXTRACTORS  # noqa: E402
+from gwaripper.extractors.base import BaseExtractor  # noqa: E402
+
+# roughly the mix of links found in selftexts: mostly audio hosts, but also
+# a lot of links to unsupported and unrelated sites
+URL_TEMPLATES = [
+    "https://soundgasm.net/u/user{i}/title-{i}",
+    "https://soundgasm.net/u/user{i}",
+    "https://www.reddit.com/r/gonewildaudio/comments/{i}/title/",
+    "https://whyp.it/tracks/{i}/title?token=abc",
+    "https://erocast.me/track/{i}/title",
+    "https://i.imgur.com/abcde{i}.png",
+    "https://imgur.com/a/abc{i}",
+    "https://skittykat.cc/category/title-{i}/",
+    "https://soundcloud.com/user/track-{i}",
+    "https://www.youtube.com/watch?v={i}",
+    "https://www.patreon.com/posts/{i}",
+    "https://example.com/page/{i}",
+    "https://www.reddit.com/user/user{i}/",
+    "https://ko-fi.com/user{i}",
+]
+
+
+def linear_classify(url):
+    for extractor in AVAILABLE_EXTRACTORS:
+        if extractor.is_compatible(url):
+            return extractor
+    return any(filtered_re.match(url) for filtered_re in BaseExtractor.FILTER_URLS_RE)
+
+
+def indexed_classify(url):
+    extractor = find_extractor(url)
+    if extractor is not None:
+        return extractor
+    return BaseExtractor.is_unsupported_audio_url(url)
+
+
+def bench(urls, classify, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = [classify(url) for url in urls]
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    nr_urls = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    rnd = random.Random(0)
+    urls = [rnd.choice(URL_TEMPLATES).format(i=i) for i in range(nr_urls)]
+
+    old, old_result = bench(urls, linear_classify, rounds)
+    new, new_result = bench(urls, indexed_classify, rounds)
+    assert old_result == new_result
+
+    print(f"{nr_urls} urls, best of {rounds}")
+    print(f"linear scan:    {old:6.2f}s ({nr_urls / old / 1000:7.1f}k urls/s)")
+    print(f"dispatch index: {new:6.2f}s ({nr_urls / new / 1000:7.1f}k urls/s, {old / new:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Offline benchmark of the html parsing of the extractors using the pages in
+tests/all_test_files/html
+
+Times the previous bs4 + html.parser version, bs4 with the fastest installed
+tree builder (make_soup) and the regex fast path for each extractor
+
+Pages saved from the live sites using `record` are stored in the recorded
+sub-directory and take precedence over the hand-written pages, which only
+mirror the markup the selectors expect
+
+Usage: python dev_tools/bench_html_parse.py [rounds]
+       python dev_tools/bench_html_parse.py record
+"""
+import os
+import sys
+import timeit
+import urllib.request
+
+import bs4
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from gwaripper.html_parse import make_soup, find_links, get_parser, LXML_AVAILABLE  # noqa: E402
+from gwaripper.extractors.soundgasm import (  # noqa: E402
+    SoundgasmExtractor, SoundgasmUserExtractor
+)
+
+HTML_DIR = os.path.join(ROOT_DIR, "tests", "all_test_files", "html")
+RECORDED_DIR = os.path.join(HTML_DIR, "recorded")
+# pages of the online tests in tests/test_extractors.py
+RECORD_URLS = {
+    "soundgasm_file.html": (
+        "https://soundgasm.net/u/kinkyshibby/F4M-Queen-of-the-Black-Coast-Pirate-Queen-"
+        "Barbarian-Warrior-Seduction-Erotic-Dance-Sultry-Seriously-Extremely-Sultry-"
+        "Exhibitionism-Mild-Fdom-Creampie-Script-Fill"),
+    "soundgasm_user.html": "https://soundgasm.net/u/DDCherryB",
+}
+
+
+def sgasm_file_soup(page, parser):
+    soup = bs4.BeautifulSoup(page, parser)
+    return (soup.select_one("div.jp-title").text,
+            soup.select_one("div.jp-description > p").text)
+
+
+def sgasm_user_soup(page, parser):
+    soup = bs4.BeautifulSoup(page, parser)
+    return [a["href"] for a in soup.select("div.sound-details > a")]
+
+
+def selftext_soup(page, parser):
+    soup = bs4.BeautifulSoup(page, parser)
+    return [(a["href"], a.text) for a in soup.select("a[href]")]
+
+
+# name: (fixture page, bs4 version, fast path)
+CASES = {
+    "Soundgasm": ("soundgasm_file.html", sgasm_file_soup,
+                  SoundgasmExtractor.parse_title_descr_fast),
+    "SoundgasmUser": ("soundgasm_user.html", sgasm_user_soup,
+                      SoundgasmUserExtractor.parse_user_files_fast),
+    "Reddit (selftext)": ("reddit_selftext.html", selftext_soup, find_links),
+}
+
+
+def best_ms(func, rounds):
+    number = 10
+    return min(timeit.repeat(func, number=number, repeat=rounds)) / number * 1000
+
+
+def record():
+    os.makedirs(RECORDED_DIR, exist_ok=True)
+    for fn, url in RECORD_URLS.items():
+        with urllib.request.urlopen(url) as resp:
+            page = resp.read()
+        with open(os.path.join(RECORDED_DIR, fn), "wb") as f:
+            f.write(page)
+        print(f"Saved {url} to {fn}")
+
+
+def page_path(fn):
+    recorded = os.path.join(RECORDED_DIR, fn)
+    return recorded if os.path.isfile(recorded) else os.path.join(HTML_DIR, fn)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "record":
+        record()
+        return
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    parser = get_parser()
+    print(f"lxml installed: {LXML_AVAILABLE}, make_soup uses: {parser}, best of {rounds}")
+    print(f"{'extractor':<20}{'html.parser':>14}{'make_soup':>14}{'fast path':>14}")
+    for name, (fn, soup_version, fast_path) in CASES.items():
+        path = page_path(fn)
+        if not path.startswith(RECORDED_DIR):
+            print(f"NOTE: {fn} was not recorded, using the hand-written page")
+        with open(path, "r", encoding="utf-8") as f:
+            page = f.read()
+        # make sure we're comparing equal results
+        assert soup_version(page, "html.parser") == fast_path(page)
+        assert make_soup(page) is not None
+
+        old = best_ms(lambda: soup_version(page, "html.parser"), rounds)
+        soup = best_ms(lambda: soup_version(page, parser), rounds)
+        fast = best_ms(lambda: fast_path(page), rounds)
+        print(f"{name:<20}{old:>11.2f} ms{soup:>11.2f} ms{fast:>11.3f} ms "
+              f"({old / fast:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of the known URL index for a library of N (default 1M) audio files
+
+Creates a temporary DB with N AudioFile rows and reports the load time and
+memory usage of KnownUrlIndex compared to a set of the url strings, as well as
+the time per already_downloaded-style check for urls that are not in the DB,
+with and without the index
+
+Usage: python dev_tools/bench_known_urls.py [nr_rows]
+"""
+import os
+import sys
+import time
+import timeit
+import tempfile
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from gwaripper.db import load_or_create_sql_db  # noqa: E402
+from gwaripper.known_urls import KnownUrlIndex  # noqa: E402
+from gwaripper.extractors import canonical_url  # noqa: E402
+
+
+def url(i):
+    return f"https://soundgasm.net/u/user{i % 5000}/Some-Audio-Title-F4M-{i}"
+
+
+def main():
+    nr_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_con, _ = load_or_create_sql_db(os.path.join(tmpdir, "gwarip_db.sqlite"))
+        # NOTE: fts triggers would dominate the time it takes to create the DB
+        for (trigger,) in db_con.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+            db_con.execute(f"DROP TRIGGER {trigger}")
+        with db_con:
+            db_con.execute("INSERT INTO Alias(name) VALUES ('user')")
+            db_con.executemany(
+                "INSERT INTO AudioFile(date, filename, url, url_key, alias_id) "
+                "VALUES ('2020-01-01', 'file.m4a', ?, ?, 1)",
+                ((url(i), canonical_url(url(i))) for i in range(nr_rows)))
+
+        # NOTE: tracemalloc slows down allocations a lot, so time and memory are
+        # measured separately
+        started = time.perf_counter()
+        index = KnownUrlIndex.load(db_con)
+        index_time = time.perf_counter() - started
+        tracemalloc.start()
+        KnownUrlIndex.load(db_con)
+        _, index_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        started = time.perf_counter()
+        url_set = {row[0] for row in db_con.execute("SELECT url_key FROM AudioFile")}
+        set_time = time.perf_counter() - started
+        del url_set
+        tracemalloc.start()
+        url_set = {row[0] for row in db_con.execute("SELECT url_key FROM AudioFile")}
+        set_size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{nr_rows} rows")
+        print(f"KnownUrlIndex: loaded in {index_time:.2f}s, {index.memory_usage / 2**20:.1f} MiB "
+              f"(peak while loading {index_peak / 2**20:.1f} MiB)")
+        print(f"set of str:    loaded in {set_time:.2f}s, {set_size / 2**20:.1f} MiB")
+        del url_set
+
+        missing = [canonical_url(url(i)) for i in range(nr_rows, nr_rows + 1000)]
+
+        def query():
+            for u in missing:
+                db_con.execute("SELECT id, collection_id FROM AudioFile WHERE url_key = ? "
+                               "OR url_key = ?", (u, u + ".m4a")).fetchone()
+
+        def indexed():
+            for u in missing:
+                index.might_contain(u) or index.might_contain(u + ".m4a")
+
+        for name, func in (("query", query), ("index", indexed)):
+            best = min(timeit.repeat(func, number=1, repeat=5))
+            print(f"check of a new url using {name}: {best / len(missing) * 1e6:.1f} µs")
+        db_con.close()
+
+
+if __name__ == "__main__":
+    main()
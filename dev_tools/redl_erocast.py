@@ -75,7 +75,7 @@ for row in rows:
     redl_rel_path = os.path.join(dirpath, redl_fn)
     redl_full_path = os.path.join(root, redl_rel_path)
 
-    info, extr_report = ErocastExtractor(entry.url)._extract()
+    info, extr_report = ErocastExtractor.extract(entry.url)
     if info is None or extr_report.err_code != ExtractorErrorCode.NO_ERRORS:
         print("EXTRACTOR ERROR:", extr_report.err_code)
         continue
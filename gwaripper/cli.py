@@ -4,17 +4,23 @@ import os
 import sys
 import time
 import logging
+import itertools
 
 import praw
 import certifi
 
-from typing import List, Optional
+from typing import List, Optional, Iterable
 
 from . import utils
 from . import clipwatcher_single
 from gwaripper import config
 from .gwaripper import GWARipper
+from .db import load_or_create_sql_db, backfill_content_hashes
+from .jobs import get_resumable_urls, count_jobs, JobState
 from .reddit import reddit_praw, parse_subreddit, search_subreddit
+from .sync import (
+    ListingSync, get_watermark, subreddit_source, redditor_source, search_source
+)
 from .logging_setup import configure_logging
 
 
@@ -127,6 +133,17 @@ def main():
         help="Value for time filter (default: all; choices: all, day, hour, month, week, year)",
         default="all", choices=("all", "day", "hour", "month", "week", "year"),
         metavar='TIME_FRAME')
+    # nargs=? One argument will be consumed from the command line if possible
+    # no command-line argument -> default
+    # optional arguments -> option string is present but not followed by a
+    # command-line argument -> value from const
+    parent_parser.add_argument(
+        "-on", "--only-newer", nargs="?", const=True, default=False, type=float,
+        metavar="UTC_TIMESTAMP",
+        help="Only process submissions that were created after the provided utc timestamp "
+             "or after the newest submission of the last run with sort new if none is "
+             "provided. Listings sorted by new stop there, so no further pages are "
+             "requested (default: False)")
 
     #
     # RIP REDDITORS
@@ -147,15 +164,6 @@ def main():
         parents=[parent_parser],
         help='Process {POST_LIMIT} of reddit submissions sorted by {SORTBY} from the specified subreddit')
     parser_sub.add_argument("sub", help="Name of subreddit", metavar='SUBREDDIT')
-    # nargs=? One argument will be consumed from the command line if possible
-    # no command-line argument -> default
-    # optional arguments -> option string is present but not followed by a
-    # command-line argument -> value from const
-    # TODO add back
-    # parser_sub.add_argument(
-    #         "-on", "--only-newer", nargs="?", const=True, default=False, type=float,
-    #         help="Only download submission if creation time is newer than provided utc"
-    #              "timestamp or last_dl_time from config if none provided (default: None)")
     parser_sub.set_defaults(func=_cl_sub)
 
     #
@@ -174,6 +182,21 @@ def main():
                            metavar="LUCENE_SEARCH_STRING")
     parser_se.set_defaults(func=_cl_search)
 
+    parser_resume = subparsers.add_parser(
+            'resume',
+            help='Continue the URLs/submissions of previous runs that were interrupted '
+                 'before they were finished')
+    parser_resume.add_argument("--retry-failed", action="store_true",
+                               help="Also process URLs that failed to extract or download")
+    parser_resume.set_defaults(func=_cl_resume)
+
+    parser_hash = subparsers.add_parser(
+            'backfill-hashes',
+            help='Compute the SHA-256 and size of already downloaded audio files that '
+                 'were added to the DB before content hashes were stored, so later '
+                 'downloads with the same content are recognized as duplicates')
+    parser_hash.set_defaults(func=_cl_backfill_hashes)
+
     parser_cfg = subparsers.add_parser("config",
         help="Configure GWARipper: save location etc.",
         epilog="Calling config without any argument will output all current settings!")
@@ -213,6 +236,20 @@ def main():
     parser_cfg.add_argument("--host-priority", action="store_true",
                             help="Set the host priority list that determines which hosts are chosen in "
                                  "what order when only_one_mirror is activated.")
+    parser_cfg.add_argument("--max-workers", metavar="N", type=int,
+                            help="Set the number of workers that download files concurrently "
+                                 "(1 means everything is processed sequentially)")
+    parser_cfg.add_argument("--max-workers-per-host", metavar="N", type=int,
+                            help="Set the max. number of concurrent downloads from the same "
+                                 "audio host (e.g. soundgasm) when using more than one worker")
+    parser_cfg.add_argument("--extract-workers", metavar="N", type=int,
+                            help="Set the number of workers that extract URLs concurrently "
+                                 "while the download workers are busy")
+    parser_cfg.add_argument("--timeouts", nargs=3, metavar=("CONNECT", "READ", "DEADLINE"),
+                            type=float,
+                            help="Set the connect and read timeout as well as the max. total "
+                                 "time that may be spent on a single URL in seconds "
+                                 "(a DEADLINE of 0 disables it)")
     parser_cfg.set_defaults(func=_cl_config)
 
     parser.add_argument("-te", "--test", action="store_true", help=argparse.SUPPRESS)
@@ -323,7 +360,12 @@ def download_all_links(urls: List[str], args: argparse.Namespace) -> None:
             skip_non_audio=args.skip_non_audio,
             dont_write_selftext=args.dont_write_selftext,
             only_one_mirror=config.config.getboolean("Settings", "only_one_mirror", fallback=False),
-            host_priority=config.get_host_priorities()) as gw:
+            host_priority=config.get_host_priorities(),
+            max_workers=config.config.getint("Settings", "max_workers", fallback=1),
+            max_workers_per_host=config.config.getint(
+                "Settings", "max_workers_per_host", fallback=2),
+            extract_workers=config.config.getint(
+                "Settings", "extract_workers", fallback=1)) as gw:
         gw.set_urls(urls)
         gw.download_all()
 
@@ -347,14 +389,43 @@ def _cl_watch(args):
     download_all_links(found, args)
 
 
-def download_all_subs(sublist: List[praw.models.Submission], args: argparse.Namespace) -> None:
+def download_all_subs(sublist: Iterable[praw.models.Submission],
+                      args: argparse.Namespace, sync: Optional[ListingSync] = None) -> None:
     with GWARipper(
             download_duplicates=args.download_duplicates,
             skip_non_audio=args.skip_non_audio,
             dont_write_selftext=args.dont_write_selftext,
             only_one_mirror=config.config.getboolean("Settings", "only_one_mirror", fallback=False),
-            host_priority=config.get_host_priorities()) as gw:
+            host_priority=config.get_host_priorities(),
+            max_workers=config.config.getint("Settings", "max_workers", fallback=1),
+            max_workers_per_host=config.config.getint(
+                "Settings", "max_workers_per_host", fallback=2),
+            extract_workers=config.config.getint(
+                "Settings", "extract_workers", fallback=1)) as gw:
         gw.download_all(sublist)
+        # NOTE: only after all submissions were processed, failed ones are kept in
+        # the job journal and can be retried using resume --retry-failed
+        if sync is not None:
+            sync.save(gw.db_con)
+
+
+def create_listing_sync(args: argparse.Namespace, source: str) -> ListingSync:
+    """Creates the ListingSync for source using its stored watermark and --only-newer"""
+    db_con, _ = load_or_create_sql_db(os.path.join(config.get_root(), "gwarip_db.sqlite"))
+    try:
+        watermark = get_watermark(db_con, source)
+    finally:
+        db_con.close()
+
+    after: Optional[float] = None
+    if args.only_newer is True:
+        if watermark is None:
+            logger.info("No submissions of %s were seen yet, processing all of them", source)
+        after = watermark
+    elif args.only_newer is not False:
+        after = args.only_newer
+    return ListingSync(source, watermark, chronological=args.sort == "new",
+                       limit=args.limit, after=after)
 
 
 def _cl_redditor(args):
@@ -368,27 +439,32 @@ def _cl_redditor(args):
             sublist = redditor.submissions.top(limit=limit, time_filter=time_filter)
         else:  # just get new posts if input doesnt match hot or top
             sublist = redditor.submissions.new(limit=limit)
-        # to get actual subs sinc praw uses lazy loading
-        sublist = list(sublist)
-        if not sublist:
+        sync = create_listing_sync(args, redditor_source(usr))
+        # NOTE: praw uses lazy loading, so only the first page gets requested here
+        # the rest of the listing is streamed into the download pipeline
+        sublist = sync.filter(sublist)
+        first = next(sublist, None)
+        if first is None:
             logger.info("No subs recieved from user %s with time_filter %s", usr, args.timefilter)
-            return
+            continue
 
-        download_all_subs(sublist, args)
+        download_all_subs(itertools.chain((first,), sublist), args, sync)
 
 
 def _cl_sub(args):
     sort = args.sort
     limit = args.limit
     time_filter = args.timefilter
-    sublist = None
+    sync = create_listing_sync(args, subreddit_source(args.sub))
     if sort == "top":
-        sublist = list(parse_subreddit(args.sub, sort, limit, time_filter=time_filter))
+        sublist = parse_subreddit(args.sub, sort, limit, time_filter=time_filter, sync=sync)
     else:
         # new and hot dont use time_filter
-        sublist = list(parse_subreddit(args.sub, sort, limit))
+        sublist = parse_subreddit(args.sub, sort, limit, sync=sync)
+    if sublist is None:
+        return
 
-    download_all_subs(sublist, args)
+    download_all_subs(sublist, args, sync)
 
 
 def _cl_search(args):
@@ -396,9 +472,46 @@ def _cl_search(args):
     limit = args.limit
     time_filter = args.timefilter
 
+    sync = create_listing_sync(args, search_source(args.subname, args.sstr))
     found_subs = search_subreddit(args.subname, args.sstr, limit=limit, time_filter=time_filter,
-                                  sort=sort)
-    download_all_subs(found_subs, args)
+                                  sort=sort, sync=sync)
+    download_all_subs(found_subs, args, sync)
+
+
+def _cl_resume(args) -> None:
+    db_con, _ = load_or_create_sql_db(os.path.join(config.get_root(), "gwarip_db.sqlite"))
+    try:
+        counts = count_jobs(db_con)
+        urls = get_resumable_urls(db_con, include_failed=args.retry_failed)
+    finally:
+        db_con.close()
+
+    if not urls:
+        print("Nothing to resume!" + (
+            f" Use --retry-failed to retry {counts[JobState.FAILED]} failed URLs"
+            if counts[JobState.FAILED] and not args.retry_failed else ""))
+        return
+
+    logger.info("Resuming %d URLs (%s)", len(urls), ", ".join(
+        f"{counts[state]} {state.value}" for state in JobState if counts[state]))
+    download_all_links(urls, args)
+
+
+def _cl_backfill_hashes(args) -> None:
+    db_con, _ = load_or_create_sql_db(os.path.join(config.get_root(), "gwarip_db.sqlite"))
+    try:
+        hashed, missing = backfill_content_hashes(db_con, config.get_root())
+        nr_duplicates = db_con.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM AudioFile WHERE sha256 IS NOT NULL
+                GROUP BY sha256, file_size HAVING COUNT(*) > 1
+            )""").fetchone()[0]
+    finally:
+        db_con.close()
+
+    print(f"Hashed {hashed} files, {missing} files could not be found on disk")
+    if nr_duplicates:
+        print(f"Found {nr_duplicates} files that were downloaded more than once")
 
 
 def _cl_config(args) -> None:
@@ -507,6 +620,36 @@ def _cl_config(args) -> None:
         changed = True
         hosts = ",".join(x.name for x in config.get_host_priorities())
         print("Successfully set host_priority to", hosts)
+    if args.max_workers:
+        try:
+            config.config["Settings"]["max_workers"] = str(args.max_workers)
+        except KeyError:
+            config.config["Settings"] = {"max_workers": str(args.max_workers)}
+        changed = True
+        print("Successfully set max_workers to", args.max_workers)
+    if args.max_workers_per_host:
+        try:
+            config.config["Settings"]["max_workers_per_host"] = str(args.max_workers_per_host)
+        except KeyError:
+            config.config["Settings"] = {"max_workers_per_host": str(args.max_workers_per_host)}
+        changed = True
+        print("Successfully set max_workers_per_host to", args.max_workers_per_host)
+    if args.extract_workers:
+        try:
+            config.config["Settings"]["extract_workers"] = str(args.extract_workers)
+        except KeyError:
+            config.config["Settings"] = {"extract_workers": str(args.extract_workers)}
+        changed = True
+        print("Successfully set extract_workers to", args.extract_workers)
+    if args.timeouts:
+        if "Settings" not in config.config:
+            config.config["Settings"] = {}
+        for name, value in zip(("timeout_connect", "timeout_read", "timeout_deadline"),
+                               args.timeouts):
+            config.config["Settings"][name] = str(value)
+        changed = True
+        print("Successfully set connect/read timeouts and deadline to",
+              *args.timeouts)
     if not changed:
         # print current cfg
         for sec in config.config.sections():
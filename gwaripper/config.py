@@ -5,7 +5,7 @@ import os.path
 import time
 import configparser
 
-from typing import cast, List, Optional, Tuple, TYPE_CHECKING
+from typing import cast, List, Optional, Tuple, Dict, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from gwaripper import extractors
@@ -75,6 +75,43 @@ if not config.sections():
             "only_one_mirror": "False",
             "host_priority": "0,5,4",
             "set_ssl_cert_file": "True",
+            "max_workers": "1",
+            "max_workers_per_host": "2",
+            # extraction runs concurrently to the downloads if this is > 1
+            "extract_workers": "1",
+            # cache html pages and API responses of extractors in <root>/_cache
+            "http_cache": "False",
+            "http_cache_max_size_mb": "256",
+            # max. number of extracted files that are kept during a run, so files
+            # that are linked in multiple posts are only extracted once; 0 disables it
+            "extraction_memo_size": "1000",
+            # urls that returned 404/410 are skipped till they're checked again after
+            # this many hours, the interval doubles after every failed check
+            "dead_url_recheck_hours": "24",
+            # bs4 tree builder: auto (lxml if installed), lxml or html.parser
+            "html_parser": "auto",
+            "timeout_connect": "10",
+            "timeout_read": "60",
+            "timeout_deadline": "3600",
+            "retry_max_attempts": "3",
+            # only files at least this big will use segmented downloads
+            "segmented_min_size_mb": "16",
+            "retry_on": "HTTP_ERR_TOO_MANY_REQUESTS,HTTP_ERR_BAD_GATEWAY,"
+                        "HTTP_ERR_SERVICE_UNAVAILABLE",
+            # what to do with a downloaded audio file whose content is already
+            # in the DB: hardlink (to the existing file), skip (delete it again)
+            # or keep (the copy)
+            "content_duplicates": "hardlink",
+        },
+        # max. requests per second by host (BASE_URL of the extractor)
+        # 0 means unlimited
+        "RateLimits": {
+            "default": "4",
+        },
+        # number of parallel connections to use for downloading a single file
+        # by host (BASE_URL of the extractor), 1 means no segmented downloads
+        "SegmentedDownloads": {
+            "default": "1",
         },
         "Time": {
             "last_db_bu": str(time.time()),
@@ -160,3 +197,61 @@ def set_host_priorities(host_priority_str: str):
     except KeyError:
         config["Settings"] = {"host_priority": host_priority_str}
 
+
+
+def get_rate_limits() -> Tuple[float, Dict[str, float]]:
+    """
+    :return: Default rate and rates by host in requests per second from the
+             RateLimits section
+    """
+    default_rate = 4.0
+    rates: Dict[str, float] = {}
+    if config.has_section("RateLimits"):
+        for host, value in config["RateLimits"].items():
+            try:
+                rate = float(value)
+            except ValueError:
+                print(f"WARNING: Malformed rate limit for {host}: {value}")
+                continue
+            if host == "default":
+                default_rate = rate
+            else:
+                rates[host] = rate
+
+    return default_rate, rates
+
+
+def get_cache_ttl(extractor_name: str, default: Optional[float],
+                  section: str = "CacheTTL") -> Optional[float]:
+    """
+    :return: Seconds the responses of the extractor stay fresh in the HTTP cache
+             from the CacheTTL section, None means they're not cached at all
+             The ExtractionCacheTTL section can be passed as section for the
+             TTLs of the extraction cache
+    """
+    name = extractor_name.lower()
+    if not config.has_option(section, name):
+        return default
+    value = config.get(section, name).strip()
+    if value.lower() == "none":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        print(f"WARNING: Malformed {section} setting for {extractor_name}: {value}")
+        return default
+
+
+def get_segmented_connections(host: Optional[str]) -> int:
+    """
+    :return: Number of parallel connections to use for downloading a single file
+             from host based on the SegmentedDownloads section
+    """
+    section = "SegmentedDownloads"
+    try:
+        if host is not None and config.has_option(section, host):
+            return config.getint(section, host)
+        return config.getint(section, "default", fallback=1)
+    except ValueError:
+        print(f"WARNING: Malformed {section} setting for {host}!")
+        return 1
@@ -13,6 +13,7 @@ from typing import Tuple, Optional, Set, Dict, Sequence, List
 from .config import config, write_config_module
 from . import migrate
 from .info import DELETED_USR_FOLDER, UNKNOWN_USR_FOLDER
+from .download import hash_file
 from .exceptions import GWARipperError
 
 logger = logging.getLogger(__name__)
@@ -21,12 +22,16 @@ logger = logging.getLogger(__name__)
 # E. Langloise: PEP 519 recommends using typing.Union[str, bytes, os.PathLike]
 # for filenames
 # only use str for now
-def load_or_create_sql_db(filename: str) -> Tuple[sqlite3.Connection, sqlite3.Cursor]:
+def load_or_create_sql_db(filename: str, check_same_thread: bool = True) -> Tuple[
+        sqlite3.Connection, sqlite3.Cursor]:
     """
     Creates connection to sqlite3 db and a cursor object.
     Creates file and tables if it doesn't exist!
 
     :param filename: Filename string/path to file
+    :param check_same_thread: Passed to sqlite3.connect; if False the connection
+                              can be shared between threads, but the caller
+                              has to serialize access to it
     :return: connection to sqlite3 db and cursor instance
     """
     create_new = not os.path.isfile(filename)
@@ -36,7 +41,8 @@ def load_or_create_sql_db(filename: str) -> Tuple[sqlite3.Connection, sqlite3.Cu
     conn: sqlite3.Connection
     if create_new:
         conn = sqlite3.connect(
-            filename, detect_types=sqlite3.PARSE_DECLTYPES)
+            filename, detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=check_same_thread)
         # context mangaer auto-commits changes or does rollback on exception
         with conn:
             conn.executescript(f"""
@@ -54,6 +60,11 @@ def load_or_create_sql_db(filename: str) -> Tuple[sqlite3.Connection, sqlite3.Cu
                     alias_id INTEGER NOT NULL,
                     rating REAL,
                     favorite INTEGER NOT NULL DEFAULT 0,
+                    -- hex digest and size in bytes of the downloaded file
+                    sha256 TEXT,
+                    file_size INTEGER,
+                    -- normalized url for finding duplicates, see extractors.canonical_url
+                    url_key TEXT,
                     FOREIGN KEY (collection_id) REFERENCES FileCollection(id)
                       -- can't delete a FileCollection if there are still rows with
                       -- it's id as collection_id here
@@ -66,6 +77,8 @@ def load_or_create_sql_db(filename: str) -> Tuple[sqlite3.Connection, sqlite3.Cu
                 -- and UNIQUE statements
                 CREATE INDEX audio_file_collection_id_idx ON AudioFile(collection_id);
                 CREATE INDEX audio_file_alias_id_idx ON AudioFile(alias_id);
+                CREATE INDEX audio_file_sha256_idx ON AudioFile(sha256);
+                CREATE INDEX audio_file_url_key_idx ON AudioFile(url_key);
 
                 -- so we can match aliases to an artist and use the artist name for displaying
                 -- all the files of it's aliases
@@ -102,6 +115,7 @@ def load_or_create_sql_db(filename: str) -> Tuple[sqlite3.Connection, sqlite3.Cu
                     reddit_info_id INTEGER,
                     parent_id INTEGER,
                     alias_id INTEGER NOT NULL,
+                    url_key TEXT,
                     FOREIGN KEY (reddit_info_id) REFERENCES RedditInfo(id)
                       ON DELETE RESTRICT,
                     FOREIGN KEY (parent_id) REFERENCES FileCollection(id)
@@ -110,6 +124,8 @@ def load_or_create_sql_db(filename: str) -> Tuple[sqlite3.Connection, sqlite3.Cu
                       ON DELETE RESTRICT
                 );
 
+                CREATE INDEX file_collection_url_key_idx ON FileCollection(url_key);
+
                 CREATE TABLE RedditInfo(
                     id INTEGER PRIMARY KEY ASC,
                     created_utc REAL,
@@ -132,6 +148,51 @@ def load_or_create_sql_db(filename: str) -> Tuple[sqlite3.Connection, sqlite3.Cu
                     ON DELETE CASCADE
                 );
 
+                -- state of the URLs of a run, so an interrupted run can be resumed
+                CREATE TABLE Job(
+                    id INTEGER PRIMARY KEY ASC,
+                    url TEXT UNIQUE NOT NULL,
+                    -- one of: queued, extracting, extracted, downloading, done, failed
+                    state TEXT NOT NULL,
+                    -- unix timestamp of the last state change
+                    updated REAL NOT NULL
+                );
+                CREATE INDEX job_state_idx ON Job(state);
+
+                CREATE TABLE SyncWatermark(
+                    id INTEGER PRIMARY KEY ASC,
+                    -- e.g. subreddit:gonewildaudio, redditor:name or search:subreddit:query
+                    source TEXT UNIQUE NOT NULL,
+                    -- created_utc and id of the newest submission that was seen
+                    created_utc REAL NOT NULL,
+                    reddit_id TEXT,
+                    -- unix timestamp of the run that set the watermark
+                    updated REAL NOT NULL
+                );
+
+                CREATE TABLE ExtractionCache(
+                    id INTEGER PRIMARY KEY ASC,
+                    -- canonical url, see extractors.canonical_url
+                    url_key TEXT UNIQUE NOT NULL,
+                    -- JSON of the fields of the extracted FileInfo
+                    data TEXT NOT NULL,
+                    -- unix timestamp of when the url was extracted
+                    stored REAL NOT NULL
+                );
+
+                CREATE TABLE DeadUrl(
+                    id INTEGER PRIMARY KEY ASC,
+                    -- canonical url, see extractors.canonical_url
+                    url_key TEXT UNIQUE NOT NULL,
+                    -- status code of the last check, e.g. 404 or 410
+                    http_code INTEGER NOT NULL,
+                    -- unix timestamps
+                    first_seen REAL NOT NULL,
+                    last_checked REAL NOT NULL,
+                    -- failed checks so far, the interval between re-checks doubles every time
+                    nr_checks INTEGER NOT NULL DEFAULT 1
+                );
+
                 CREATE VIEW v_audio_and_collection_combined
                 AS
                 SELECT
@@ -270,7 +331,8 @@ def load_or_create_sql_db(filename: str) -> Tuple[sqlite3.Connection, sqlite3.Cu
                                  "github.com/nilfoer/gwaripper")
 
         conn = sqlite3.connect(
-            filename, detect_types=sqlite3.PARSE_DECLTYPES)
+            filename, detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=check_same_thread)
 
     # Row provides both index-based and case-insensitive name-based access
     # to columns with almost no memory overhead
@@ -580,6 +642,72 @@ def remove_entry(db_con: sqlite3.Connection, _id: int, root_dir: str):
                 pass
 
 
+def audio_file_path(root_dir: str, entry: sqlite3.Row) -> str:
+    """
+    Returns the path of the audio file of a row of v_audio_and_collection_combined
+    """
+    if entry["collection_id"] is not None:
+        return os.path.join(root_dir, entry["fcol_alias_name"], entry["fcol_subpath"],
+                            entry["filename"])
+    else:
+        return os.path.join(root_dir, entry["alias_name"], entry["filename"])
+
+
+def find_content_duplicates(db_con: sqlite3.Connection, sha256: str,
+                            file_size: int) -> List[sqlite3.Row]:
+    """
+    Returns rows of v_audio_and_collection_combined whose file has the passed
+    SHA-256 and size
+    """
+    return db_con.execute("""
+        SELECT * FROM v_audio_and_collection_combined
+        WHERE id IN (SELECT id FROM AudioFile WHERE sha256 = ? AND file_size = ?)
+        ORDER BY id""", (sha256, file_size)).fetchall()
+
+
+def backfill_content_hashes(db_con: sqlite3.Connection, root_dir: str,
+                            batch_size: int = 100) -> Tuple[int, int]:
+    """
+    Computes the SHA-256 and size of all audio files in the DB that don't have
+    them yet, committing after every batch_size files
+
+    :return: Number of files that were hashed and number of files that are missing
+             on disk
+    """
+    rows = db_con.execute("""
+        SELECT * FROM v_audio_and_collection_combined
+        WHERE id IN (SELECT id FROM AudioFile WHERE sha256 IS NULL)
+        ORDER BY id""").fetchall()
+
+    hashed = 0
+    missing = 0
+    batch: List[Tuple[str, int, int]] = []
+    for row in rows:
+        path = audio_file_path(root_dir, row)
+        try:
+            digest = hash_file(path)
+        except FileNotFoundError:
+            logger.debug("Can't hash missing file %s", path)
+            missing += 1
+            continue
+        batch.append((digest.hexdigest(), digest.size, row["id"]))
+        hashed += 1
+
+        if len(batch) >= batch_size:
+            with db_con:
+                db_con.executemany(
+                    "UPDATE AudioFile SET sha256 = ?, file_size = ? WHERE id = ?", batch)
+            batch.clear()
+            logger.info("Hashed %d of %d files", hashed + missing, len(rows))
+
+    if batch:
+        with db_con:
+            db_con.executemany(
+                "UPDATE AudioFile SET sha256 = ?, file_size = ? WHERE id = ?", batch)
+
+    return hashed, missing
+
+
 # helper class to turn attribute-based acces into dict-like acces on sqlite3.Row
 class RowData:
     def __init__(self, row: sqlite3.Row):
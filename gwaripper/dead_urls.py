@@ -0,0 +1,87 @@
+import time
+import logging
+import sqlite3
+import threading
+
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# status codes that mean the resource was deleted and will most likely never come back
+DEAD_HTTP_CODES = (404, 410)
+# upper bound for the time between re-checks of a dead url
+MAX_RECHECK_INTERVAL = 90 * 24 * 3600
+
+
+class DeadUrlCache:
+    """
+    Persisted negative cache of urls whose pages returned 404/410 in the DeadUrl
+    table keyed by their canonical url, so e.g. deleted soundgasm files that are
+    linked in old posts don't cost a request every time a subreddit is synced
+
+    Dead urls are still re-checked in case they come back, with the interval
+    doubling after every check that still fails: recheck_interval, 2 *
+    recheck_interval, 4 * recheck_interval, ... up to MAX_RECHECK_INTERVAL
+
+    :param db_lock: Lock that needs to be held while using db_con
+    :param recheck_interval: Seconds after which a dead url is checked again the first time
+    """
+
+    def __init__(self, db_con: sqlite3.Connection, db_lock: threading.RLock,
+                 recheck_interval: float = 24 * 3600):
+        self.db_con = db_con
+        self.db_lock = db_lock
+        self.recheck_interval = recheck_interval
+        # keys of dead urls that were due for a re-check during this run
+        self._rechecking: Set[str] = set()
+        self.stats: Dict[str, int] = {"skipped": 0, "rechecked": 0, "recorded": 0}
+
+    def next_check(self, last_checked: float, nr_checks: int) -> float:
+        """:return: Unix timestamp after which a dead url should be checked again"""
+        # NOTE: limit the exponent, since the interval is capped anyway
+        interval = self.recheck_interval * 2**min(max(nr_checks - 1, 0), 32)
+        return last_checked + min(interval, MAX_RECHECK_INTERVAL)
+
+    def check(self, key: str) -> Optional[int]:
+        """
+        :return: HTTP status code the url returned if it's known to be dead and
+                 not due for a re-check yet, otherwise None
+        """
+        # NOTE: stats are also guarded by db_lock
+        with self.db_lock:
+            row = self.db_con.execute(
+                "SELECT http_code, last_checked, nr_checks FROM DeadUrl WHERE url_key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            http_code, last_checked, nr_checks = row[0], row[1], row[2]
+            if time.time() < self.next_check(last_checked, nr_checks):
+                self.stats["skipped"] += 1
+                return http_code
+            self._rechecking.add(key)
+            self.stats["rechecked"] += 1
+        return None
+
+    def record(self, key: str, http_code: int) -> None:
+        """Adds the url as dead or updates it if it was re-checked"""
+        now = time.time()
+        with self.db_lock, self.db_con:
+            self._rechecking.discard(key)
+            self.db_con.execute("""
+                INSERT INTO DeadUrl(url_key, http_code, first_seen, last_checked, nr_checks)
+                VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT(url_key) DO UPDATE SET
+                    http_code = excluded.http_code,
+                    last_checked = excluded.last_checked,
+                    nr_checks = nr_checks + 1""", (key, http_code, now, now))
+            self.stats["recorded"] += 1
+
+    def forget(self, key: str) -> None:
+        """Removes the url if it was dead but worked again when it was re-checked"""
+        with self.db_lock:
+            if key not in self._rechecking:
+                return
+            self._rechecking.discard(key)
+            with self.db_con:
+                self.db_con.execute("DELETE FROM DeadUrl WHERE url_key = ?", (key,))
+        logger.info("URL that was dead before is available again: %s", key)
@@ -2,17 +2,33 @@ import sys
 import os
 import urllib.request
 import urllib.error
+import http.client
 import logging
 import subprocess
 import re
 import time
+import socket
+import random
+import datetime
+import functools
+import email.utils
 import shutil
+import tempfile
+import threading
+import hashlib
 
-from typing import Optional, Dict, Tuple
+from typing import (
+    Optional, Dict, Tuple, List, Iterator, Any, Deque, Iterable, Callable, TypeVar, ClassVar,
+    FrozenSet, cast
+)
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 from enum import Enum, auto, unique
 from urllib.error import ContentTooShortError
 
 from . import config
+from . import http_session
+from . import http_cache
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +45,8 @@ class DownloadErrorCode(Enum):
     SKIPPED_DUPLICATE = auto()
     # ffmpeg etc.
     EXTERNAL_ERROR = auto()
+    # connect/read timeout or the deadline for the URL was exceeded
+    TIMED_OUT = auto()
 
     HTTP_ERR_UNAUTHORIZED = auto()
     HTTP_ERR_FORBIDDEN = auto()
@@ -83,6 +101,198 @@ HTTP_ERR_TO_DL_ERR: Dict[int, DownloadErrorCode] = {
 }
 
 
+class DeadlineExceeded(socket.timeout):
+    pass
+
+
+class Deadline:
+    """
+    Time budget for all requests that are made for one URL, so a host that sends
+    data slower than the read timeout can't stall a download forever
+
+    Connect and read timeouts as well as the default deadline (in seconds) are
+    read from the config, a deadline of 0 disables it
+
+    :param seconds: Overrides the deadline from the config
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        if seconds is None:
+            seconds = config.config.getfloat("Settings", "timeout_deadline", fallback=3600)
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds > 0 else None
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def check(self, url: str) -> None:
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Exceeded the deadline of {self.seconds:.0f}s for {url}")
+
+    def timeout(self, url: str) -> Tuple[float, float]:
+        """
+        :return: Connect and read timeout for the next request, capped by the
+                 remaining time
+        """
+        self.check(url)
+        connect = config.config.getfloat("Settings", "timeout_connect", fallback=10)
+        read = config.config.getfloat("Settings", "timeout_read", fallback=60)
+        remaining = self.remaining()
+        if remaining is not None:
+            connect = min(connect, remaining)
+            read = min(read, remaining)
+        return connect, read
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses the value of a `Retry-After` header, which is either a number of seconds
+    or a HTTP-date
+
+    :return: Seconds to wait or None if value is missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_at is None:
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def error_to_dl_err(exc: BaseException) -> Optional[DownloadErrorCode]:
+    """
+    :return: DownloadErrorCode matching the exception or None if it's not a
+             network related error
+    """
+    if isinstance(exc, urllib.error.HTTPError):
+        return HTTP_ERR_TO_DL_ERR.get(exc.code, DownloadErrorCode.HTTP_ERROR_OTHER)
+    elif isinstance(exc, socket.timeout):
+        return DownloadErrorCode.TIMED_OUT
+    elif isinstance(exc, urllib.error.URLError):
+        if isinstance(exc.reason, socket.timeout):
+            return DownloadErrorCode.TIMED_OUT
+        return DownloadErrorCode.HTTP_ERROR_OTHER
+    return None
+
+
+T = TypeVar('T')
+
+
+class RetryPolicy:
+    """
+    Retries requests that failed with a transient error using exponential backoff
+    with jitter, a `Retry-After` header sent by the server takes precedence
+
+    :param max_attempts: Max number of attempts including the first one
+    :param backoff_factor: Delay in seconds before the first retry, doubles
+                           with every attempt
+    :param max_backoff: Max delay in seconds between attempts
+    :param jitter: Fraction (0-1) by which the delay is randomly reduced, so
+                   concurrent workers don't retry in lockstep
+    :param retryable: DownloadErrorCodes that will be retried
+    :param max_retry_after: Give up if the server asks us to wait longer than
+                            this many seconds
+    """
+
+    DEFAULT_RETRYABLE: ClassVar[FrozenSet[DownloadErrorCode]] = frozenset({
+        DownloadErrorCode.HTTP_ERR_TOO_MANY_REQUESTS,
+        DownloadErrorCode.HTTP_ERR_BAD_GATEWAY,
+        DownloadErrorCode.HTTP_ERR_SERVICE_UNAVAILABLE,
+    })
+
+    def __init__(self, max_attempts: int = 3, backoff_factor: float = 1,
+                 max_backoff: float = 30, jitter: float = 0.5,
+                 retryable: Optional[Iterable[DownloadErrorCode]] = None,
+                 max_retry_after: float = 120):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = min(1.0, max(0.0, jitter))
+        self.retryable = (frozenset(retryable) if retryable is not None
+                          else self.DEFAULT_RETRYABLE)
+        self.max_retry_after = max_retry_after
+
+    @classmethod
+    def from_config(cls) -> 'RetryPolicy':
+        retryable: Optional[List[DownloadErrorCode]] = None
+        retry_on = config.config.get("Settings", "retry_on", fallback=None)
+        if retry_on is not None:
+            retryable = []
+            for name in retry_on.split(","):
+                name = name.strip().upper()
+                if not name:
+                    continue
+                try:
+                    retryable.append(DownloadErrorCode[name])
+                except KeyError:
+                    logger.warning("Unknown DownloadErrorCode '%s' in setting retry_on", name)
+        return cls(
+            max_attempts=config.config.getint("Settings", "retry_max_attempts", fallback=3),
+            backoff_factor=config.config.getfloat(
+                "Settings", "retry_backoff_factor", fallback=1),
+            max_backoff=config.config.getfloat("Settings", "retry_max_backoff", fallback=30),
+            retryable=retryable)
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        return error_to_dl_err(exc) in self.retryable
+
+    def delay(self, attempt: int, exc: Optional[BaseException] = None) -> Optional[float]:
+        """
+        :param attempt: Number of the attempt that just failed starting at 1
+        :return: Seconds to wait before the next attempt or None if the server
+                 asked us to wait longer than max_retry_after
+        """
+        if isinstance(exc, urllib.error.HTTPError) and exc.headers is not None:
+            retry_after = parse_retry_after(exc.headers.get("Retry-After"))
+            if retry_after is not None:
+                return retry_after if retry_after <= self.max_retry_after else None
+
+        delay = min(self.max_backoff, self.backoff_factor * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def call(self, func: Callable[[], T], url: str = "",
+             deadline: Optional[Deadline] = None) -> T:
+        """
+        Calls func until it succeeds, raises an exception that is not retryable
+        or max_attempts is reached, in which case the last exception is re-raised
+
+        :param url: Only used for logging
+        :param deadline: Don't retry if waiting would exceed the deadline
+        """
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except Exception as exc:
+                if attempt >= self.max_attempts or not self.is_retryable(exc):
+                    raise
+                delay = self.delay(attempt, exc)
+                remaining = deadline.remaining() if deadline is not None else None
+                if delay is None or (remaining is not None and delay >= remaining):
+                    raise
+
+                logger.info("%s: Retrying %s in %.1fs (attempt %d of %d)",
+                            cast(DownloadErrorCode, error_to_dl_err(exc)).name, url,
+                            delay, attempt + 1, self.max_attempts)
+                if isinstance(exc, urllib.error.HTTPError):
+                    # so the connection can be re-used
+                    exc.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+
 def download(url: str, dl_path: str):
     """
     Will download the file to dl_path, return True on success
@@ -111,43 +321,186 @@ def download(url: str, dl_path: str):
         return True, headers
 
 
+class ContentDigest:
+    """
+    SHA-256 and size of a file that get updated while its bytes are being
+    written to disk, so the file doesn't have to be read again afterwards
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def update(self, data) -> None:
+        self._hash.update(data)
+        self.size += len(data)
+
+    def update_from_file(self, filename: str, limit: Optional[int] = None) -> None:
+        """Feeds the (first limit bytes of the) file's content to the digest"""
+        buf = bytearray(MAX_CHUNK_SIZE)
+        view = memoryview(buf)
+        remaining = limit
+        with open(filename, "rb") as f:
+            while remaining is None or remaining > 0:
+                nr_read = f.readinto(view if remaining is None else view[:remaining])
+                if not nr_read:
+                    break
+                self.update(view[:nr_read])
+                if remaining is not None:
+                    remaining -= nr_read
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+def hash_file(filename: str) -> ContentDigest:
+    digest = ContentDigest()
+    digest.update_from_file(filename)
+    return digest
+
+
+PART_FILE_EXT = ".part"
+CONTENT_RANGE_RE = re.compile(r"bytes\s+(?:(\d+)-(\d+)|\*)/(\d+|\*)", re.IGNORECASE)
+
+
+def parse_content_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Parses a Content-Range header value like 'bytes 100-199/1000' or 'bytes */1000'
+
+    :return: Tuple of the first byte position and the complete length of the
+             resource; either of them is None if it's not available
+    """
+    if not value:
+        return None, None
+    match = CONTENT_RANGE_RE.match(value.strip())
+    if not match:
+        return None, None
+    first = int(match.group(1)) if match.group(1) is not None else None
+    total = int(match.group(3)) if match.group(3) != "*" else None
+    return first, total
+
+
 def download_in_chunks(url: str, filename: str,
                        headers: Optional[Dict[str, str]] = None,
-                       prog_bar: bool = False) -> int:
+                       prog_bar: bool = False,
+                       deadline: Optional[Deadline] = None,
+                       retry_policy: Optional[RetryPolicy] = None,
+                       digest: Optional[ContentDigest] = None,
+                       before_request: Optional[Callable[[], Any]] = None) -> int:
+    """
+    Streams the file at url into a `filename.part` sidecar file that gets renamed
+    to filename once the download is complete
+
+    If a sidecar from a previous (interrupted) download exists, the download is
+    resumed using a `Range` request if the server supports it, otherwise it
+    starts from scratch
+
+    Raises ContentTooShortError if less data than the reported size was received,
+    the sidecar file is kept in that case so the download can be resumed later
+    Raises socket.timeout if the connection stalls or DeadlineExceeded (a
+    subclass of it) if the download takes too long, keeping the sidecar as well
+
+    Transient errors are retried according to retry_policy, which is read from
+    the config by default
+
+    :param digest: Gets reset and fed the complete content of the file
+    :param before_request: Called before every request that is sent (including
+                           retries), e.g. for rate limiting
+    :return: Size of the downloaded file in bytes
+    """
+    if deadline is None:
+        deadline = Deadline()
+    if retry_policy is None:
+        retry_policy = RetryPolicy.from_config()
+
+    return retry_policy.call(
+        functools.partial(_download_in_chunks, url, filename, headers, prog_bar, deadline,
+                          digest, before_request),
+        url=url, deadline=deadline)
+
+
+def _download_in_chunks(url: str, filename: str, headers: Optional[Dict[str, str]],
+                        prog_bar: bool, deadline: Deadline,
+                        digest: Optional[ContentDigest] = None,
+                        before_request: Optional[Callable[[], Any]] = None) -> int:
     # get head (everythin b4 last part of path ("/" last -> tail empty,
     # filename or dir(without /) -> tail)) of path; no slash in path -> head empty
     dirpath, fn = os.path.split(filename)
     if dirpath:
         os.makedirs(dirpath, exist_ok=True)
 
+    part_filename = f"{filename}{PART_FILE_EXT}"
+    try:
+        offset = os.path.getsize(part_filename)
+    except OSError:
+        offset = 0
+
     # merge headers
-    headers = {**DEFAULT_HEADERS, **headers} if headers else DEFAULT_HEADERS
-    req = urllib.request.Request(url, headers=headers)
+    req_headers = {**DEFAULT_HEADERS, **headers} if headers else DEFAULT_HEADERS
+    if offset:
+        req_headers = {**req_headers, "Range": f"bytes={offset}-"}
+    req = urllib.request.Request(url, headers=req_headers)
+
+    if before_request is not None:
+        before_request()
+    try:
+        response = http_session.urlopen(req, timeout=deadline.timeout(url))
+    except urllib.error.HTTPError as err:
+        # 416 Range Not Satisfiable -> our sidecar is either already complete
+        # or it's bigger than the file on the server
+        if err.code != 416 or not offset:
+            raise
+        _, total = parse_content_range(err.headers.get("Content-Range"))
+        err.close()
+        if total is not None and total == offset:
+            logger.debug("Sidecar file of %s is already complete", url)
+            os.replace(part_filename, filename)
+            if digest is not None:
+                digest.reset()
+                digest.update_from_file(filename)
+            return offset
+        logger.info("Removing invalid partial download of %s and starting over", url)
+        os.remove(part_filename)
+        return _download_in_chunks(url, filename, headers, prog_bar, deadline, digest,
+                                   before_request)
+
     # urlretrieve uses block-size of 8192
     # Before response.read() is called, the contents are not downloaded.
-    with urllib.request.urlopen(req) as response:
+    with response:
         meta = response.info()
-        reported_file_size = int(meta["Content-Length"])
-        # by Alex Martelli
-        # Experiment a bit with various CHUNK sizes to find the "sweet spot" for your requirements
-        # CHUNK = 16 * 1024
-        file_size_dl = 0
-        chunk_size = 8192
-        block_num = 0
-        with open(filename, 'wb') as w:
-            while True:
-                chunk = response.read(chunk_size)
-
-                if not chunk:
-                    break
+        content_length = meta["Content-Length"]
+        reported_file_size = int(content_length) if content_length is not None else -1
 
-                # not chunk_size since the last chunk will probably not be of size chunk_size
-                file_size_dl += len(chunk)
-                w.write(chunk)
-                block_num += 1
-                # copy behaviour of urlretrieve reporthook
-                if prog_bar:
-                    prog_bar_dl(block_num, chunk_size, reported_file_size)
+        # getcode is None for non-http urls e.g. file://
+        resumed = False
+        if offset and response.getcode() == 206:
+            first, total = parse_content_range(meta["Content-Range"])
+            if first == offset:
+                resumed = True
+                logger.info("Resuming download at %.2f MB", offset / 1024**2)
+                if total is not None:
+                    reported_file_size = total
+                elif reported_file_size >= 0:
+                    reported_file_size += offset
+        if not resumed:
+            # server ignored the range request -> full response
+            offset = 0
+        if digest is not None:
+            digest.reset()
+            if resumed:
+                # bytes from the previous attempt(s) have to be hashed as well
+                digest.update_from_file(part_filename, offset)
+
+        # copy behaviour of urlretrieve reporthook
+        progress = (ThrottledProgress(
+            lambda size_dl: prog_bar_dl(1, size_dl, reported_file_size))
+            if prog_bar else None)
+        with open(part_filename, 'ab' if resumed else 'wb') as w:
+            file_size_dl = copy_stream(response, w, offset, progress=progress,
+                                       deadline=deadline, url=url, digest=digest)
 
     # from urlretrieve doc: urlretrieve() will raise ContentTooShortError when
     # it detects that the amount of data available was less than the expected
@@ -156,17 +509,325 @@ def download_in_chunks(url: str, filename: str,
     # The Content-Length is treated as a lower bound: if there’s more data to
     # read, urlretrieve reads more data, but if less data is available, it
     # raises the exception.
+    # NOTE: the .part file is kept so the download can be resumed
     if file_size_dl < reported_file_size:
         raise ContentTooShortError(
             f"Downloaded file's size is samller than the reported size for \"{url}\"",
             None)
     else:
+        # only move the file to its final location once it's complete
+        os.replace(part_filename, filename)
         return file_size_dl
 
 
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+
+class ThrottledProgress:
+    """
+    Only passes on progress updates to callback every interval seconds, since
+    formatting and flushing a progress bar for every block costs more CPU than
+    the actual copying
+
+    :param callback: Gets passed the number of bytes downloaded so far
+    """
+
+    def __init__(self, callback: Callable[[int], None], interval: float = 0.25):
+        self.callback = callback
+        self.interval = interval
+        self._last_update = float("-inf")
+        self._last_value: Optional[int] = None
+
+    def update(self, value: int) -> None:
+        now = time.monotonic()
+        if now - self._last_update >= self.interval:
+            self._last_update = now
+            self._last_value = value
+            self.callback(value)
+
+    def finish(self, value: int) -> None:
+        """Makes sure the final value is always reported"""
+        if self._last_value != value:
+            self._last_value = value
+            self.callback(value)
+
+
+def copy_stream(src, dst, start: int = 0, progress: Optional[ThrottledProgress] = None,
+                deadline: Optional[Deadline] = None, url: str = "",
+                digest: Optional[ContentDigest] = None) -> int:
+    """
+    Copies src to dst using readinto on a single reusable buffer
+
+    The chunk size adapts between MIN_CHUNK_SIZE and MAX_CHUNK_SIZE: it grows while
+    reads fill the buffer quickly and shrinks when they take long, so progress
+    and the deadline are still checked regularly on slow connections
+
+    :param start: Number of bytes that were already downloaded
+    :param digest: Gets fed all the bytes that are copied
+    :return: Total number of bytes downloaded including start
+    """
+    buf = bytearray(MAX_CHUNK_SIZE)
+    view = memoryview(buf)
+    chunk_size = MIN_CHUNK_SIZE
+    size_dl = start
+    while True:
+        read_started = time.perf_counter()
+        nr_read = src.readinto(view[:chunk_size])
+        if not nr_read:
+            break
+        read_duration = time.perf_counter() - read_started
+
+        dst.write(view[:nr_read])
+        size_dl += nr_read
+        if digest is not None:
+            digest.update(view[:nr_read])
+
+        if nr_read == chunk_size and read_duration < 0.05:
+            chunk_size = min(MAX_CHUNK_SIZE, chunk_size * 2)
+        elif read_duration > 0.5:
+            chunk_size = max(MIN_CHUNK_SIZE, chunk_size // 2)
+
+        if progress is not None:
+            progress.update(size_dl)
+        if deadline is not None:
+            deadline.check(url)
+
+    if progress is not None:
+        progress.finish(size_dl)
+
+    return size_dl
+
+
+class _RangeError(Exception):
+    """Server doesn't handle range requests properly"""
+    pass
+
+
+class _SegmentAborted(Exception):
+    pass
+
+
+def split_ranges(total: int, parts: int) -> List[Tuple[int, int]]:
+    """
+    Splits total bytes into (at most) parts inclusive byte ranges of about the same size
+    """
+    parts = max(1, min(parts, total))
+    size, rest = divmod(total, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < rest else 0) - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def probe_range_support(url: str, headers: Dict[str, str],
+                        deadline: Deadline,
+                        before_request: Optional[Callable[[], Any]] = None) -> Optional[int]:
+    """
+    Requests the first byte of url to find out whether the server supports
+    range requests
+
+    :return: Total size of the file or None if ranges aren't supported
+    """
+    req = urllib.request.Request(url, headers={**headers, "Range": "bytes=0-0"})
+    if before_request is not None:
+        before_request()
+    try:
+        with http_session.urlopen(req, timeout=deadline.timeout(url)) as response:
+            if response.getcode() != 206:
+                return None
+            first, total = parse_content_range(response.headers.get("Content-Range"))
+            response.read()
+    except urllib.error.HTTPError as err:
+        if err.code != 416:
+            raise
+        err.close()
+        return None
+
+    return total if first == 0 else None
+
+
+class _SegmentProgress:
+    """
+    Adds the progress of a single segment to the total of all segments and aborts
+    the segment download once another segment failed
+    """
+
+    def __init__(self, on_progress: Callable[[int], None], abort: threading.Event,
+                 start: int):
+        self.on_progress = on_progress
+        self.abort = abort
+        self.last = start
+
+    def update(self, value: int) -> None:
+        if self.abort.is_set():
+            raise _SegmentAborted()
+        self.on_progress(value - self.last)
+        self.last = value
+
+    def finish(self, value: int) -> None:
+        self.on_progress(value - self.last)
+        self.last = value
+
+
+def _download_range(url: str, part_filename: str, headers: Dict[str, str],
+                    start: int, end: int, deadline: Deadline, retry_policy: RetryPolicy,
+                    on_progress: Callable[[int], None], abort: threading.Event,
+                    before_request: Optional[Callable[[], Any]] = None) -> None:
+    pos = start
+
+    def fetch() -> None:
+        nonlocal pos
+        req = urllib.request.Request(url, headers={**headers, "Range": f"bytes={pos}-{end}"})
+        if before_request is not None:
+            before_request()
+        with http_session.urlopen(req, timeout=deadline.timeout(url)) as response:
+            first, _ = parse_content_range(response.headers.get("Content-Range"))
+            if response.getcode() != 206 or first != pos:
+                raise _RangeError(f"Server ignored the range request for bytes {pos}-{end}")
+            with open(part_filename, "r+b") as f:
+                f.seek(pos)
+                pos = copy_stream(response, f, pos,
+                                  progress=_SegmentProgress(on_progress, abort, pos),
+                                  deadline=deadline, url=url)
+        if pos > end + 1:
+            raise _RangeError(f"Server sent more than bytes {start}-{end}")
+        elif pos <= end:
+            raise ContentTooShortError(
+                f"Segment {start}-{end} of \"{url}\" ended at {pos}", None)
+
+    attempt = 1
+    while True:
+        try:
+            retry_policy.call(fetch, url=url, deadline=deadline)
+            return
+        except ContentTooShortError:
+            # continue from where we left off
+            if attempt >= retry_policy.max_attempts:
+                raise
+            attempt += 1
+
+
+def download_segmented(url: str, filename: str, connections: int,
+                       headers: Optional[Dict[str, str]] = None,
+                       prog_bar: bool = False,
+                       deadline: Optional[Deadline] = None,
+                       retry_policy: Optional[RetryPolicy] = None,
+                       min_size: int = 0,
+                       digest: Optional[ContentDigest] = None,
+                       before_request: Optional[Callable[[], Any]] = None) -> int:
+    """
+    Downloads the file at url using up to `connections` parallel range requests
+    that write into a preallocated `filename.part` file, which gets renamed to
+    filename once the size was verified
+
+    Falls back to download_in_chunks if the server doesn't support range requests,
+    the file is smaller than min_size or a (resumable) sidecar file of a single
+    stream download exists
+
+    :param digest: Gets reset and fed the complete content of the file; since the
+                   segments arrive out of order the finished file is hashed
+                   (single stream downloads are hashed while downloading)
+    :param before_request: Called before every request that is sent, so every segment
+                           (and each of its retries) is rate limited on its own
+    :return: Size of the downloaded file in bytes
+    """
+    if deadline is None:
+        deadline = Deadline()
+    if retry_policy is None:
+        retry_policy = RetryPolicy.from_config()
+
+    def single_stream() -> int:
+        return download_in_chunks(url, filename, headers=headers, prog_bar=prog_bar,
+                                  deadline=deadline, retry_policy=retry_policy,
+                                  digest=digest, before_request=before_request)
+
+    part_filename = f"{filename}{PART_FILE_EXT}"
+    if connections < 2 or os.path.exists(part_filename):
+        return single_stream()
+
+    req_headers = {**DEFAULT_HEADERS, **headers} if headers else DEFAULT_HEADERS
+    total = retry_policy.call(
+        functools.partial(probe_range_support, url, req_headers, deadline, before_request),
+        url=url, deadline=deadline)
+    if total is None or total < max(min_size, 2):
+        logger.debug("Not using a segmented download for %s (size: %s)", url, total)
+        return single_stream()
+
+    dirpath = os.path.dirname(filename)
+    if dirpath:
+        os.makedirs(dirpath, exist_ok=True)
+    with open(part_filename, "wb") as f:
+        f.truncate(total)
+
+    ranges = split_ranges(total, connections)
+    logger.info("Downloading %.2f MB using %d connections", total / 1024**2, len(ranges))
+    lock = threading.Lock()
+    abort = threading.Event()
+    size_dl = 0
+    progress = (ThrottledProgress(lambda size: prog_bar_dl(1, size, total))
+                if prog_bar else None)
+
+    def on_progress(nr_bytes: int) -> None:
+        nonlocal size_dl
+        with lock:
+            size_dl += nr_bytes
+            if progress is not None:
+                progress.update(size_dl)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges),
+                                thread_name_prefix="gwaripper-seg") as executor:
+            futures = [executor.submit(_download_range, url, part_filename, req_headers,
+                                       start, end, deadline, retry_policy, on_progress, abort,
+                                       before_request)
+                       for start, end in ranges]
+            errors = []
+            try:
+                for future in as_completed(futures):
+                    exc = future.exception()
+                    if exc is not None:
+                        # stop the other segments
+                        abort.set()
+                        if not isinstance(exc, _SegmentAborted):
+                            errors.append(exc)
+            except BaseException:
+                abort.set()
+                raise
+        if errors:
+            # re-raise the error that happened first
+            raise errors[0]
+    except _RangeError as err:
+        # NOTE: the preallocated file can't be resumed by download_in_chunks, since
+        # its size doesn't match the number of bytes that were downloaded
+        _remove_if_exists(part_filename)
+        logger.info("%s, falling back to a single connection", err)
+        return single_stream()
+    except BaseException:
+        _remove_if_exists(part_filename)
+        raise
+
+    if progress is not None:
+        progress.finish(size_dl)
+
+    if size_dl != total or os.path.getsize(part_filename) != total:
+        _remove_if_exists(part_filename)
+        raise ContentTooShortError(
+            f"Segmented download of \"{url}\" has {size_dl} instead of {total} bytes", None)
+
+    os.replace(part_filename, filename)
+    if digest is not None:
+        digest.reset()
+        digest.update_from_file(filename)
+    return total
+
+
 def get_url_file_size(url: str) -> int:
     """Returns file size in bytes that is reported in Content-Length Header"""
-    with urllib.request.urlopen(url) as response:
+    with http_session.urlopen(url, timeout=Deadline().timeout(url)) as response:
         reported_file_size = int(response.info()["Content-Length"])
     return reported_file_size
 
@@ -229,137 +890,326 @@ if getattr(sys, 'frozen', False):
         BUNDLED_FFMPEG = shutil.which(ffmpeg_exe)
 
 
+class AdaptiveBackoff:
+    """
+    Backoff state that is shared by concurrent requests to the same host
+
+    Every rate-limit hit (HTTP 429) doubles the delay that the workers wait before
+    issuing their next request (up to max_backoff), every successful request
+    halves it again, so workers only slow down when the host asks us to
+
+    :param backoff_factor: Delay in seconds after the first hit
+    :param max_backoff: Max delay in seconds
+    """
+
+    def __init__(self, backoff_factor: float = 1, max_backoff: float = 64):
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self._level = 0
+        self._lock = threading.Lock()
+
+    @property
+    def delay(self) -> float:
+        if self._level == 0:
+            return 0
+        return min(self.max_backoff, self.backoff_factor * 2 ** (self._level - 1))
+
+    def wait(self) -> None:
+        delay = self.delay
+        if delay:
+            time.sleep(delay)
+
+    def hit(self) -> None:
+        with self._lock:
+            self._level += 1
+
+    def success(self) -> None:
+        # a successful attempt decreases the level and thus the sleeping time
+        # otherwise we might be stuck at the max_backoff
+        with self._lock:
+            self._level = max(0, self._level - 1)
+
+
+def _fetch_hls_segment(url: str, backoff: AdaptiveBackoff, max_retries: int,
+                       deadline: Deadline,
+                       before_request: Optional[Callable[[], Any]] = None) -> bytes:
+    retries = 0
+    req = urllib.request.Request(url, headers=DEFAULT_HEADERS)
+    while True:
+        backoff.wait()
+        if before_request is not None:
+            before_request()
+        try:
+            with http_session.urlopen(req, timeout=deadline.timeout(url)) as resp:
+                # NOTE: segments are only a few hundred KiB so we keep them in memory
+                # read() raises IncompleteRead if we got less than Content-Length
+                data = resp.read()
+        except http.client.IncompleteRead:
+            # retry
+            if retries >= max_retries:
+                raise ContentTooShortError(
+                    f"Segment download incomplete after {retries} retries: {url}", None)
+        except urllib.error.HTTPError as e:
+            if e.code != 429 or retries >= max_retries:
+                raise
+            logger.debug("Hit request limit while downloading... backing off...")
+            # too many requests -> sleep more and retry
+            backoff.hit()
+            # the server might also tell us how long to wait
+            retry_after = parse_retry_after(e.headers.get("Retry-After"))
+            e.close()
+            if retry_after:
+                time.sleep(min(retry_after, backoff.max_backoff))
+        else:
+            backoff.success()
+            return data
+
+        retries += 1
+
+
+def iter_hls_segments(parts: List[str], max_workers: int = 4, max_retries: int = 10,
+                      show_progress: bool = True,
+                      deadline: Optional[Deadline] = None,
+                      before_request: Optional[Callable[[], Any]] = None) -> Iterator[bytes]:
+    """
+    Downloads the segments of a HLS playlist using up to max_workers concurrent
+    requests and yields their contents in playlist order
+
+    At most 2 * max_workers segments are buffered in memory at a time
+    Raises the exception of the first segment that failed to download
+    All segments share one deadline
+
+    :param before_request: Called before every segment request (including retries),
+                           e.g. for rate limiting
+    :return: Iterator over the segment data in playlist order
+    """
+    if deadline is None:
+        deadline = Deadline()
+    num_parts = len(parts)
+    max_workers = max(1, max_workers)
+    window = 2 * max_workers
+    # NOTE: default of 1 seems to work for erocast
+    backoff = AdaptiveBackoff(backoff_factor=1, max_backoff=64)
+
+    if show_progress:
+        print("Downloading TS-parts of the m3u8 playlist:")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers,
+                            thread_name_prefix="gwaripper-hls") as executor:
+        pending: Deque[Future] = deque()
+        next_part = 0
+        try:
+            for nr_done in range(1, num_parts + 1):
+                while next_part < num_parts and len(pending) < window:
+                    pending.append(executor.submit(
+                        _fetch_hls_segment, parts[next_part], backoff, max_retries,
+                        deadline, before_request))
+                    next_part += 1
+
+                data = pending.popleft().result()
+                if show_progress:
+                    elapsed = time.perf_counter() - started
+                    print(f"\r{nr_done}/{num_parts} ({nr_done / elapsed:.2f} segments/s)",
+                          end="")
+                yield data
+        finally:
+            # also reached when the consumer stops early
+            for future in pending:
+                future.cancel()
+
+    elapsed = time.perf_counter() - started
+    logger.info("Downloaded %d segments in %.2fs (%.2f segments/s)", num_parts, elapsed,
+                num_parts / elapsed if elapsed > 0 else float(num_parts))
+
+
 def download_hls_ffmpeg(
     m3u8_url, filename,
     show_progress: bool = True,
     # prefer the bundled ffmpeg by default
-    ffmpeg_executable: str = BUNDLED_FFMPEG or 'ffmpeg'
+    ffmpeg_executable: str = BUNDLED_FFMPEG or 'ffmpeg',
+    max_workers: int = 4,
+    before_request: Optional[Callable[[], Any]] = None,
 ) -> bool:
+    """
+    Downloads the MPEG-TS segments of the HLS playlist at m3u8_url and pipes them
+    in order into ffmpeg's stdin, which remuxes them into filename, so the
+    segment data is only written to disk once
+
+    :param before_request: Called before every request that is sent, e.g. for rate limiting
+    :return: Whether ffmpeg successfully produced filename
+    """
     if shutil.which(ffmpeg_executable) is None:
         logger.error("No ffmpeg executable found! Aborting download!")
         return False
 
-    # TODO: add max retries or timeout
-    res, err_code = download_text(DEFAULT_HEADERS, m3u8_url)
+    deadline = Deadline()
+    res, err_code = download_text(DEFAULT_HEADERS, m3u8_url, deadline=deadline,
+                                  before_request=before_request)
     if not res:
         logger.error("Failed to get m3u8 playlist")
         return False
 
     parts = PARTS_RE.findall(res)
 
-    i = 0
-    num_parts = len(parts)
-    # NOTE: default of 1 seems to work for erocast, which results in a default sleep time of 0.5s
-    # in seconds
-    backoff_factor = 1
-    retries = 0
-    # in seconds
-    max_backoff = 64
-
-    tmp_dir = os.path.join(config.get_root(), "_tmp")
-    os.makedirs(tmp_dir, exist_ok=True)
-    ts_files = []
-
-    print("Downloading TS-parts of the m3u8 playlist:")
-    while i < num_parts:
-        url = parts[i]
-        rel_fn = url.rsplit("/", 1)[1]
-        full_fn = os.path.join(tmp_dir, rel_fn)
-
-        if show_progress:
-            print(f"\r{i + 1}/{num_parts}", end="")
+    # MPEG-TS segments can simply be concatenated byte-wise
+    # -vn: no vieo; -acodec copy: copy audio codec
+    # -y: never prompt for overwriting, since that would read from our stdin; the
+    # filename was already padded so it doesn't exist
+    args = [ffmpeg_executable, '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'mpegts', '-i', 'pipe:0', '-vn', '-acodec', 'copy', filename]
+    # NOTE: stderr goes into a temp file so ffmpeg can never block on a full pipe
+    # while we're still writing to its stdin
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                    stdout=subprocess.DEVNULL, stderr=stderr)
+        except FileNotFoundError:
+            logger.error("Missing ffmpeg executable! Aborting download...")
+            return False
 
         try:
-            download_in_chunks(url, full_fn, headers=DEFAULT_HEADERS)
-        except ContentTooShortError:
-            # retry
-            retries += 1
-        except urllib.error.HTTPError as e:
-            if e.code == 429:
-                logger.debug(
-                    "Hit request limit while downloading... backing off...", )
-                # too many requests -> sleep more and retry
-                retries += 1
-            else:
-                raise e
-        else:
-            i += 1
-            # a successful attempt decrease the retries and thus the sleeping time
-            # otherwise we might be stuck at the max_backoff
-            retries = max(0, retries - 1)
-            # add to ts_files after successful download
-            ts_files.append(rel_fn)
+            for data in iter_hls_segments(parts, max_workers=max_workers,
+                                          show_progress=show_progress, deadline=deadline,
+                                          before_request=before_request):
+                proc.stdin.write(data)
+        except BrokenPipeError:
+            # ffmpeg exited early, error is reported below
+            pass
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            _remove_if_exists(filename)
+            raise
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
 
-        time_to_sleep = min(max_backoff, backoff_factor * 2 ** (retries - 1))
-        time.sleep(time_to_sleep)
+        if show_progress:
+            print("\nWaiting for ffmpeg to finish remuxing")
+        returncode = proc.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            logger.error("FFmpeg remuxing error: exit status %d", returncode)
+            logger.debug("FFmpeg stderr: %s", stderr.read())
+            _remove_if_exists(filename)
+            return False
 
-    if show_progress:
-        print("\nMerging parts with ffmpeg")
+    return True
 
-    # write concatenation list for ffmpeg
-    # passing it through stdin using -i pipe: is wonky
-    # NOTE: we need to use paths relative to the concat file list, since / and \ etc.
-    # are not considered safe characters
-    concat_list_fn = os.path.join(tmp_dir, "parts_list.txt")
-    with open(concat_list_fn, "w", encoding="utf-8") as f:
-        f.write("\n".join(f"file '{ts}'" for ts in ts_files))
 
-    # -vn: no vieo; -acodec copy: copy audio codec
-    # NOTE: the path to the concat file apparently needs to use all / even on Windows
-    args = [ffmpeg_executable, '-hide_banner', '-f', 'concat', '-i',
-            concat_list_fn.replace("\\", "/"), '-vn', '-acodec', 'copy',
-            filename]
-    ffmpeg_success = False
+def _remove_if_exists(filename: str) -> None:
     try:
-        subprocess.run(args, capture_output=True, check=True)
+        os.remove(filename)
     except FileNotFoundError:
-        logger.error("Missing ffmpeg executable! Aborting merge...")
-    except subprocess.CalledProcessError as err:
-        logger.error("FFmpeg concatentation error: %s", str(err))
-        logger.debug("FFmpeg stdout: %s", err.stdout)
-        logger.debug("FFmpeg stderr: %s", err.stderr)
-    else:
-        ffmpeg_success = True
-
-    # clean up
-    os.remove(concat_list_fn)
-    for ts in ts_files:
-        try:
-            os.remove(os.path.join(tmp_dir, ts))
-        except FileNotFoundError:
-            pass
-
-    return ffmpeg_success
+        pass
 
 
 def download_text(headers, url: str,
-                  additional_headers: Optional[Dict[str, str]] = None) -> Tuple[
+                  additional_headers: Optional[Dict[str, str]] = None,
+                  deadline: Optional[Deadline] = None,
+                  retry_policy: Optional[RetryPolicy] = None,
+                  cache: Optional[http_cache.HTTPCache] = None,
+                  cache_ttl: float = 0,
+                  before_request: Optional[Callable[[], Any]] = None) -> Tuple[
         Optional[str], Optional[int]]:
+    """
+    :param cache: Cache to consult before sending the request; cached responses
+                  that are older than cache_ttl seconds are revalidated using
+                  a conditional GET
+    :param before_request: Called before every attempt to send the request, but not if
+                           the response is served from the cache, e.g. for rate limiting
+    :return: Decoded response body (None on errors) and the HTTP status code
+             if an HTTPError occured
+    """
     res: Optional[str] = None
     http_code: Optional[int] = None
+    if deadline is None:
+        deadline = Deadline()
+    if retry_policy is None:
+        retry_policy = RetryPolicy.from_config()
 
     req = urllib.request.Request(url, headers=headers)
     if additional_headers is not None:
         for k, v in additional_headers.items():
             req.add_header(k, v)
 
+    cached: Optional[http_cache.CachedResponse] = None
+    # NOTE: the conditional headers are not part of the cache key
+    req_headers = dict(req.header_items())
+    if cache is not None:
+        cached = cache.lookup(url, req_headers)
+        if cached is not None and cached.is_fresh(cache_ttl):
+            cache.mark_used(cached)
+            logger.debug("Using cached response for %s", url)
+            return _decode(cached.body, cached.charset), None
+        if cached is not None:
+            for k, v in cached.conditional_headers().items():
+                req.add_header(k, v)
+        else:
+            cache.mark_miss()
+
+    def send() -> Tuple[bytes, http.client.HTTPMessage]:
+        # NOTE: called for every attempt, so retries are rate limited as well
+        if before_request is not None:
+            before_request()
+        return _read_all(req, deadline)
+
     try:
-        site = urllib.request.urlopen(req)
+        response, resp_headers = retry_policy.call(send, url=url, deadline=deadline)
     except urllib.error.HTTPError as err:
+        err.close()
+        if err.code == 304 and cached is not None and cache is not None:
+            logger.debug("Cached response for %s is still valid", url)
+            # store again so the response is fresh for another cache_ttl seconds
+            cached = cache.store(
+                url, req_headers, cached.body, cached.charset,
+                err.headers.get("ETag", cached.etag) if err.headers else cached.etag,
+                cached.last_modified)
+            cache.mark_used(cached, revalidated=True)
+            return _decode(cached.body, cached.charset), None
         http_code = err.code
         logger.warning("HTTP Error %s: %s: \"%s\"", err.code, err.reason, url)
     except urllib.error.URLError as err:
         # Often, URLError is raised because there is no network connection
         # (no route to the specified server), or the specified server
         # doesn’t exist
+        # also raised when we time out while connecting
         logger.warning("URL Error: %s (url: %s)", err.reason, url)
+    except socket.timeout as err:
+        # read timeout or deadline exceeded
+        logger.warning("Timed out: %s (url: %s)", str(err) or "read timeout", url)
     else:
-        response = site.read()
-        site.close()
-
         # try to read encoding from headers otherwise use utf-8 as fallback
-        encoding = site.headers.get_content_charset()
-        res = response.decode(encoding.lower() if encoding else "utf-8")
+        charset = resp_headers.get_content_charset()
+        res = _decode(response, charset)
+        if (cache is not None and
+                "no-store" not in resp_headers.get("Cache-Control", "").lower()):
+            cache.store(url, req_headers, response, charset, resp_headers.get("ETag"),
+                        resp_headers.get("Last-Modified"))
         logger.debug("Getting html done!")
 
     return res, http_code
+
+
+def _decode(body: bytes, charset: Optional[str]) -> str:
+    return body.decode(charset.lower() if charset else "utf-8")
+
+
+def _read_all(req: urllib.request.Request,
+              deadline: Deadline) -> Tuple[bytes, http.client.HTTPMessage]:
+    """
+    :return: Response body and headers
+    """
+    url = req.full_url
+    with http_session.urlopen(req, timeout=deadline.timeout(url)) as site:
+        chunks = []
+        while True:
+            chunk = site.read(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            deadline.check(url)
+
+        return b"".join(chunks), site.headers
@@ -0,0 +1,104 @@
+import json
+import time
+import logging
+import sqlite3
+import threading
+
+from typing import Dict, Optional, Type, TYPE_CHECKING
+
+from . import info
+from . import extractors as extr
+
+if TYPE_CHECKING:
+    from .extractors.base import BaseExtractor
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionCache:
+    """
+    Persistent cache of the FileInfos extracted from urls in the ExtractionCache
+    table keyed by the canonical url, so pages whose information doesn't change
+    (e.g. soundgasm files) don't have to be fetched again when they're
+    re-downloaded or their reddit info gets added later
+
+    How long entries stay valid is set per extractor by its EXTRACTION_CACHE_TTL
+    and can be overridden in the ExtractionCacheTTL section of the config
+
+    :param db_lock: Lock that needs to be held while using db_con
+    """
+
+    def __init__(self, db_con: sqlite3.Connection, db_lock: threading.RLock):
+        self.db_con = db_con
+        self.db_lock = db_lock
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "expired": 0}
+
+    @staticmethod
+    def serialize(fi: 'info.FileInfo') -> str:
+        return json.dumps({
+            "extractor_id": fi.extractor.EXTRACTOR_ID,
+            "is_audio": fi.is_audio,
+            "ext": fi.ext,
+            "page_url": fi.page_url,
+            "direct_url": fi.direct_url,
+            "id": fi.id,
+            "title": fi.title,
+            "descr": fi.descr,
+            "author": fi.author,
+            "download_type": fi.download_type.name,
+            "additional_headers": fi.additional_headers,
+        })
+
+    @staticmethod
+    def deserialize(data: str) -> 'info.FileInfo':
+        fields = json.loads(data)
+        fi = info.FileInfo(
+            extr.EXTRACTOR_ID_TO_EXTRACTOR[fields["extractor_id"]], fields["is_audio"],
+            fields["ext"], fields["page_url"], fields["direct_url"], fields["id"],
+            fields["title"], fields["descr"], fields["author"],
+            download_type=info.DownloadType[fields["download_type"]])
+        fi.additional_headers = fields["additional_headers"]
+        return fi
+
+    def get(self, key: str, extractor: Type['BaseExtractor']) -> Optional['info.FileInfo']:
+        """
+        :param extractor: Extractor that is compatible with the url, its TTL decides
+                          whether an entry is still valid
+        :return: FileInfo that was stored under key if it's still valid
+        """
+        ttl = extractor.extraction_cache_ttl()
+        if ttl is None:
+            return None
+        # NOTE: stats are also guarded by db_lock
+        with self.db_lock:
+            row = self.db_con.execute(
+                "SELECT data, stored FROM ExtractionCache WHERE url_key = ?",
+                (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            if time.time() - row[1] >= ttl:
+                self.stats["expired"] += 1
+                return None
+
+            try:
+                fi = self.deserialize(row[0])
+            except (ValueError, KeyError, TypeError):
+                # e.g. the extractor was removed since
+                logger.debug("Ignoring malformed extraction cache entry of %s", key,
+                             exc_info=True)
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+        return fi
+
+    def put(self, key: str, extractor: Type['BaseExtractor'], fi: 'info.FileInfo') -> None:
+        if extractor.extraction_cache_ttl() is None:
+            return
+        with self.db_lock, self.db_con:
+            self.db_con.execute("""
+                INSERT INTO ExtractionCache(url_key, data, stored) VALUES (?, ?, ?)
+                ON CONFLICT(url_key) DO UPDATE SET
+                    data = excluded.data,
+                    stored = excluded.stored""",
+                                (key, self.serialize(fi), time.time()))
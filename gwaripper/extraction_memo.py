@@ -0,0 +1,51 @@
+import threading
+
+from collections import OrderedDict
+from typing import Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .info import FileInfo
+
+
+class ExtractionMemo:
+    """
+    Run-scoped memo of the FileInfos extracted from urls keyed by their canonical
+    url, so a file that's linked in several collections (reposts, masterposts
+    of a series, ...) only has its page fetched and parsed once per run
+
+    Stores detached clones without a parent or download state and hands out
+    new clones, so every parent gets its own FileInfo
+
+    :param max_entries: Max. number of FileInfos to keep, the least recently
+                        used ones get evicted first
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, FileInfo]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional['FileInfo']:
+        """:return: New clone of the FileInfo stored under key or None"""
+        with self._lock:
+            fi = self._entries.get(key)
+            if fi is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+        return fi.clone()
+
+    def put(self, key: str, fi: 'FileInfo') -> None:
+        # NOTE: clone so the memo doesn't keep the parent collections alive
+        fi = fi.clone()
+        with self._lock:
+            self._entries[key] = fi
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
@@ -1,5 +1,7 @@
+import re
+
 from enum import Enum, unique, auto
-from typing import Type, Optional, Sequence, Dict
+from typing import Type, Optional, Sequence, Dict, Tuple, Pattern
 
 from .base import BaseExtractor
 from .reddit import RedditExtractor
@@ -51,8 +53,46 @@ EXTRACTOR_TO_HOST: Dict[Type[BaseExtractor], AudioHost] = {
 }
 
 
+# NOTE: the url regexes of all extractors allow omitting the scheme as well as a www. prefix
+HOSTNAME_RE: Pattern = re.compile(r"^(?:https?://)?(?:www\.)?([^/?#]*)", re.IGNORECASE)
+
+
+def _build_host_index(
+        extractors: Sequence[Type[BaseExtractor]]) -> Dict[str, Tuple[Type[BaseExtractor], ...]]:
+    index: Dict[str, Tuple[Type[BaseExtractor], ...]] = {}
+    for extractor in extractors:
+        assert extractor.HOSTNAMES, f"{extractor.__name__} is missing HOSTNAMES"
+        for hostname in extractor.HOSTNAMES:
+            # keeps the order of AVAILABLE_EXTRACTORS, which determines the priority
+            # of extractors for the same host
+            index[hostname] = index.get(hostname, ()) + (extractor,)
+    return index
+
+
+# hostname -> extractors that have to be checked for urls of that host
+EXTRACTORS_BY_HOST: Dict[str, Tuple[Type[BaseExtractor], ...]] = _build_host_index(
+    AVAILABLE_EXTRACTORS)
+
+
+def get_hostname(url: str) -> str:
+    """Returns the lower-case hostname of the url without a leading www."""
+    # always matches, but the group might be empty
+    return HOSTNAME_RE.match(url).group(1).lower()  # type: ignore
+
+
 def find_extractor(url: str) -> Optional[Type[BaseExtractor]]:
-    for extractor in AVAILABLE_EXTRACTORS:
+    # only the extractors that are registered for the url's host need to run their regex
+    for extractor in EXTRACTORS_BY_HOST.get(get_hostname(url), ()):
         if extractor.is_compatible(url):
             return extractor
     return None
+
+
+def canonical_url(url: str) -> str:
+    """
+    Returns the key url is stored under in the DB, so different spellings of the
+    same url (scheme, www., trailing slash, host aliases, ...) are detected as duplicates
+    Uses the canonicalization of the extractor that's compatible with url
+    or the generic one if there is none
+    """
+    return (find_extractor(url) or BaseExtractor).canonicalize_url(url)
@@ -2,10 +2,11 @@ import urllib.request
 import urllib.error
 import logging
 import re
+import threading
 
 from typing import (
         Optional, Dict, Union, ClassVar, Tuple, List, Any, TypeVar, Generic,
-        Pattern
+        Pattern, Callable, Match, cast, TYPE_CHECKING
         )
 from enum import Enum, auto, unique
 
@@ -14,6 +15,12 @@ from ..exceptions import (
         NoAuthenticationError, AuthenticationFailed
         )
 from gwaripper import config
+from gwaripper import utils
+from gwaripper import http_cache
+from gwaripper.extraction_memo import ExtractionMemo
+from gwaripper.dead_urls import DeadUrlCache, DEAD_HTTP_CODES
+if TYPE_CHECKING:
+    from gwaripper.extraction_cache import ExtractionCache
 # import whole module instead of individual symbols (import FileCollection,..)
 # to avoid circular import problems
 from gwaripper import info
@@ -21,6 +28,88 @@ from ..download import DownloadErrorCode, download_text
 
 logger = logging.getLogger(__name__)
 
+_rate_limiter: Optional[utils.KeyedRateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> utils.KeyedRateLimiter:
+    """
+    Returns the per-host rate limiter shared by all extractors and downloads,
+    which is created from the RateLimits config section on first use
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            default_rate, rates = config.get_rate_limits()
+            _rate_limiter = utils.KeyedRateLimiter(rates, default_rate=default_rate)
+        return _rate_limiter
+
+
+# set by GWARipper for the duration of a run; returns True if a file with the
+# passed page url was already downloaded, so collection extractors can skip
+# fetching the pages of their known children
+_known_url_check: Optional[Callable[[str], bool]] = None
+
+
+def set_known_url_check(check: Optional[Callable[[str], bool]]) -> None:
+    global _known_url_check
+    _known_url_check = check
+
+
+def is_known_url(url: str) -> bool:
+    check = _known_url_check
+    return check is not None and check(url)
+
+
+# set by GWARipper for the duration of a run, so files that are linked more than
+# once only get extracted once
+_extraction_memo: Optional[ExtractionMemo] = None
+
+
+def set_extraction_memo(memo: Optional[ExtractionMemo]) -> None:
+    global _extraction_memo
+    _extraction_memo = memo
+
+
+# set by GWARipper for the duration of a run, so the pages of files that
+# were extracted in a previous run don't have to be fetched again
+_extraction_cache: Optional['ExtractionCache'] = None
+
+
+def set_extraction_cache(cache: Optional['ExtractionCache']) -> None:
+    global _extraction_cache
+    _extraction_cache = cache
+
+
+# set by GWARipper for the duration of a run, so urls that returned 404/410
+# before are skipped without sending a request
+_dead_urls: Optional[DeadUrlCache] = None
+
+
+def set_dead_url_cache(dead_urls: Optional[DeadUrlCache]) -> None:
+    global _dead_urls
+    _dead_urls = dead_urls
+
+
+# grp1: hostname without www., grp2: path, grp3: query string including the ?
+URL_PARTS_RE: Pattern = re.compile(
+        r"^(?:[a-z][-a-z0-9+.]*://)?(?:www\.)?([^/?#]*)([^?#]*)(\?[^#]*)?", re.IGNORECASE)
+
+
+def url_key(url: str, host_aliases: Optional[Dict[str, str]] = None) -> str:
+    """
+    Generic normalization of url into a key for deduplication: drops the scheme,
+    a www. prefix, the fragment and trailing slashes and lower-cases the hostname
+
+    :param host_aliases: Maps (lower-case) hostnames to the one they're an alias of
+    """
+    # always matches
+    match = cast(Match, URL_PARTS_RE.match(url.strip()))
+    host = match.group(1).lower()
+    if host_aliases:
+        host = host_aliases.get(host, host)
+    return f"{host}{match.group(2).rstrip('/')}{match.group(3) or ''}"
+
 
 # codes only for indivual extractor errors not for collections
 # since those are visible in the reports children
@@ -74,11 +163,16 @@ class ExtractorReport:
     children: List['ExtractorReport']
 
     def __init__(self, url: str, err_code: ExtractorErrorCode,
-                 download_error_code: DownloadErrorCode = DownloadErrorCode.NOT_DOWNLOADED):
+                 download_error_code: DownloadErrorCode = DownloadErrorCode.NOT_DOWNLOADED,
+                 http_code: Optional[int] = None):
         self.url = url
         self.err_code = err_code
         # TODO make sure this uses ERROR_IN_CHILDREN as default for collections?
         self.download_error_code = download_error_code
+        # status code of the response if the page couldn't be retrieved
+        self.http_code = http_code
+        # result is from a previous run and not from extracting the url again
+        self.cached = False
         self.children = []
 
 
@@ -108,7 +202,21 @@ class BaseExtractor(Generic[T]):
     # these need to be re-defined by sub-classes!!
     EXTRACTOR_NAME: ClassVar[str] = "Base"
     EXTRACTOR_ID: ClassVar[int] = 0
+    # hostnames (without a leading www.) of all urls the extractor is compatible with
+    # used to build the dispatch index of find_extractor
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ()
     BASE_URL: ClassVar[str] = ""
+    # hostnames (without a leading www.) that serve the same pages as the hostname
+    # they're mapped to, e.g. old.reddit.com -> reddit.com
+    HOST_ALIASES: ClassVar[Dict[str, str]] = {}
+    # seconds responses of get_html stay fresh in the HTTP cache (if enabled), after
+    # that they're revalidated using a conditional GET; None disables caching
+    # can be overridden per extractor in the CacheTTL section of the config
+    CACHE_TTL: ClassVar[Optional[float]] = None
+    # seconds a FileInfo that was extracted using this extractor can be re-used
+    # from the ExtractionCache table without fetching its page again; None disables it
+    # can be overridden per extractor in the ExtractionCacheTTL section of the config
+    EXTRACTION_CACHE_TTL: ClassVar[Optional[float]] = None
 
     # set by extractors on their class if an extraction fails and the extractor
     # should be considered broken
@@ -148,6 +256,10 @@ class BaseExtractor(Generic[T]):
             # NOTE: so users can see there should be an audio on patreon
             re.compile(r"^(?:https?://)?(?:www\.)?skittykat\.cc/exclusive/$", re.IGNORECASE),
             ]
+    # all of the above as one alternation, so only a single regex has to be run per url
+    FILTER_URLS_COMBINED_RE: ClassVar[Pattern] = re.compile(
+            "|".join(f"(?:{filtered_re.pattern})" for filtered_re in FILTER_URLS_RE),
+            re.IGNORECASE)
 
 
     # NOTE: workaround to get type checking to work with passing differently
@@ -166,6 +278,17 @@ class BaseExtractor(Generic[T]):
     def is_compatible(cls, url: str) -> bool:
         raise NotImplementedError
 
+    @classmethod
+    def canonicalize_url(cls, url: str) -> str:
+        """
+        Normalizes url into the key that's used to detect duplicates, so
+        different spellings of the same page's url compare equal
+        Extractors whose urls have more variants (e.g. soundgasm's /u/ and /user/)
+        should override this and build the key from the parts of the url that
+        identify the page
+        """
+        return url_key(url, cls.HOST_ALIASES)
+
     # can raise InfoExtractingError (or exceptions based on it) if
     # they provide more information than the generic InfoExtractingError
     # that is raised by cls.extract on all Exceptions
@@ -196,7 +319,43 @@ class BaseExtractor(Generic[T]):
         report = ExtractorReport(url, ExtractorErrorCode.BROKEN_EXTRACTOR)
         result: Optional[Union['info.FileInfo', 'info.FileCollection']] = None
 
-        if cls.is_broken:
+        memo = _extraction_memo
+        cache = _extraction_cache
+        dead_urls = _dead_urls
+        key: Optional[str] = None
+        dead_http_code: Optional[int] = None
+        reused: Optional['info.FileInfo'] = None
+        from_cache = False
+        if memo is not None or cache is not None or dead_urls is not None:
+            key = cls.canonicalize_url(url)
+        if dead_urls is not None and key is not None:
+            dead_http_code = dead_urls.check(key)
+        if dead_http_code is None and memo is not None and key is not None:
+            reused = memo.get(key)
+        if (dead_http_code is None and reused is None and cache is not None and
+                key is not None):
+            reused = cache.get(key, cls)
+            from_cache = reused is not None
+            # NOTE: the banned tags might have changed since the file was cached
+            if (reused is not None and reused.is_audio and reused.title and
+                    title_has_banned_tag(reused.title)):
+                reused = None
+                report = ExtractorReport(url, ExtractorErrorCode.BANNED_TAG)
+            elif reused is not None and memo is not None:
+                memo.put(key, reused)
+
+        if dead_http_code is not None:
+            logger.info("Skipping URL that returned HTTP %d in a previous run: %s",
+                        dead_http_code, url)
+            report = ExtractorReport(url, ExtractorErrorCode.NO_RESPONSE,
+                                     http_code=dead_http_code)
+        elif reused is not None:
+            logger.debug("Re-using the extracted information of %s", url)
+            result = reused
+            report = ExtractorReport(url, ExtractorErrorCode.NO_ERRORS)
+        elif report.err_code is ExtractorErrorCode.BANNED_TAG:
+            cls.log_report(report)
+        elif cls.is_broken:
             logger.warning("Skipping URL '%s' due to broken extractor: %s",
                            url, cls.EXTRACTOR_NAME)
         else:
@@ -228,7 +387,22 @@ class BaseExtractor(Generic[T]):
             else:
                 # only log/print if no exc was raised since exc already get logged above
                 cls.log_report(report)
-
+                # NOTE: only single files are memoized, since collections can't be
+                # shared between parents without cloning their whole tree
+                if (key is not None and isinstance(result, info.FileInfo) and
+                        report.err_code is ExtractorErrorCode.NO_ERRORS):
+                    if memo is not None:
+                        memo.put(key, result)
+                    if cache is not None:
+                        cache.put(key, cls, result)
+                if dead_urls is not None and key is not None:
+                    if (report.err_code is ExtractorErrorCode.NO_RESPONSE and
+                            report.http_code in DEAD_HTTP_CODES):
+                        dead_urls.record(key, cast(int, report.http_code))
+                    elif result is not None:
+                        dead_urls.forget(key)
+
+        report.cached = from_cache or dead_http_code is not None
         if result is not None:
             if parent is not None:
                 if isinstance(result, info.FileCollection):
@@ -245,6 +419,31 @@ class BaseExtractor(Generic[T]):
                 parent_report.err_code = ExtractorErrorCode.ERROR_IN_CHILDREN
         return result, report
 
+    @classmethod
+    def skip_known_urls(cls, urls: List[str], parent: 'info.FileCollection',
+                        parent_report: ExtractorReport) -> List[str]:
+        """
+        Removes the urls of files that were already downloaded, so their pages don't
+        have to be fetched, and adds a SKIPPED_DUPLICATE report for each of them
+
+        :return: Urls that still need to be extracted
+        """
+        new_urls = []
+        for url in urls:
+            if is_known_url(url):
+                parent_report.children.append(ExtractorReport(
+                    url, ExtractorErrorCode.NO_ERRORS, DownloadErrorCode.SKIPPED_DUPLICATE))
+            else:
+                new_urls.append(url)
+        nr_skipped = len(urls) - len(new_urls)
+        if nr_skipped:
+            logger.info("Skipped extracting %d of %d files of %s that were already downloaded",
+                        nr_skipped, len(urls), parent.url)
+            # NOTE: still count the skipped files, so the collection keeps using the
+            # same sub-directory as in previous runs
+            parent.nr_files += nr_skipped
+        return new_urls
+
     @classmethod
     def log_report(cls, report: ExtractorReport):
         if report.err_code not in (
@@ -279,14 +478,42 @@ class BaseExtractor(Generic[T]):
 
     @classmethod
     def is_unsupported_audio_url(cls, url: str) -> bool:
-        return any(filtered_re.match(url) for filtered_re in
-                   cls.FILTER_URLS_RE)
+        return bool(cls.FILTER_URLS_COMBINED_RE.match(url))
 
     @classmethod
     def get_html(cls, url: str,
                  additional_headers: Optional[Dict[str, str]] = None) -> Tuple[
                          Optional[str], Optional[int]]:
-        return download_text(cls.headers, url, additional_headers=additional_headers)
+        ttl = config.get_cache_ttl(cls.EXTRACTOR_NAME, cls.CACHE_TTL)
+        # NOTE: only requests that are actually sent count towards the rate limit,
+        # not responses that are served from the cache
+        return download_text(cls.headers, url, additional_headers=additional_headers,
+                             cache=http_cache.get_cache() if ttl is not None else None,
+                             cache_ttl=ttl or 0,
+                             before_request=cls.wait_for_request_slot)
+
+    @classmethod
+    def extraction_cache_ttl(cls) -> Optional[float]:
+        return config.get_cache_ttl(cls.EXTRACTOR_NAME, cls.EXTRACTION_CACHE_TTL,
+                                    section="ExtractionCacheTTL")
+
+    @classmethod
+    def rate_limit_key(cls) -> Optional[str]:
+        """:return: Host that requests of this extractor count towards"""
+        return cls.BASE_URL.split("/", 1)[0] or None
+
+    @classmethod
+    def wait_for_request_slot(cls) -> float:
+        """
+        Blocks till the rate limit of the extractor's host allows another request
+
+        :return: Seconds that were spent waiting
+        """
+        return get_rate_limiter().acquire(cls.rate_limit_key())
+
+    @classmethod
+    async def wait_for_request_slot_async(cls) -> float:
+        return await get_rate_limiter().acquire_async(cls.rate_limit_key())
 
 
 def title_has_banned_tag(
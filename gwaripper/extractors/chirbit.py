@@ -1,19 +1,21 @@
 import re
 import base64
 
-import bs4
 
 from typing import Optional, ClassVar, Pattern, Match, cast, Tuple, Any
 
 from .base import BaseExtractor, ExtractorErrorCode, ExtractorReport, title_has_banned_tag
 from gwaripper import info
 from ..exceptions import InfoExtractingError
+from ..html_parse import make_soup
 
 
 class ChirbitExtractor(BaseExtractor):
 
     EXTRACTOR_NAME: ClassVar[str] = "Chirbit"
     EXTRACTOR_ID: ClassVar[int] = 5
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("chirb.it",)
+    CACHE_TTL: ClassVar[Optional[float]] = 7 * 24 * 3600
     BASE_URL: ClassVar[str] = "chirb.it"
 
     VALID_CHIRBIT_URL_RE: ClassVar[Pattern] = re.compile(
@@ -44,9 +46,10 @@ class ChirbitExtractor(BaseExtractor):
                         "or the site changed and the extractor is broken!",
                         self.url)
             else:
-                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE)
+                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE,
+                                             http_code=http_code)
 
-        soup = bs4.BeautifulSoup(html, "html.parser")
+        soup = make_soup(html)
 
         title = soup.select_one('div.chirbit-title').text
         if title_has_banned_tag(title):
@@ -1,19 +1,20 @@
 import re
 
-import bs4
-
 from typing import Optional, Match, cast, Pattern, ClassVar, Tuple, Any
 from urllib.parse import quote as url_quote
 
 from .base import BaseExtractor, ExtractorErrorCode, ExtractorReport
 from gwaripper import info
 from ..exceptions import InfoExtractingError
+from ..html_parse import make_soup
 
 
 class EraudicaExtractor(BaseExtractor):
 
     EXTRACTOR_NAME: ClassVar[str] = "Eraudica"
     EXTRACTOR_ID: ClassVar[int] = 4
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("eraudica.com",)
+    CACHE_TTL: ClassVar[Optional[float]] = 7 * 24 * 3600
     BASE_URL: ClassVar[str] = "eraudica.com"
 
     VALID_ERAUDICA_URL_RE: ClassVar[Pattern] = re.compile(
@@ -44,9 +45,10 @@ class EraudicaExtractor(BaseExtractor):
                         "the modified URL is invalid. In either case the extractor "
                         "is broken!", self.url)
             else:
-                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE)
+                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE,
+                                             http_code=http_code)
 
-        soup = bs4.BeautifulSoup(html, "html.parser")
+        soup = make_soup(html)
 
         # selects script tags beneath div with id main and div class post
         # returns list of bs4.element.Tag -> access text with .text
@@ -14,6 +14,8 @@ from ..exceptions import InfoExtractingError
 class ErocastExtractor(BaseExtractor):
     EXTRACTOR_NAME: ClassVar[str] = "Erocast"
     EXTRACTOR_ID: ClassVar[int] = 9
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("erocast.me",)
+    CACHE_TTL: ClassVar[Optional[float]] = 7 * 24 * 3600
     BASE_URL: ClassVar[str] = "erocast.me"
 
     # grp1: sgasm username, grp2: title
@@ -44,7 +46,8 @@ class ErocastExtractor(BaseExtractor):
                        "or the site changed and the extractor is broken!")
                 raise InfoExtractingError(msg, self.url)
             else:
-                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE)
+                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE,
+                                             http_code=http_code)
 
         search_str = f"var song_data_{self.id} = "
         start = html.find(search_str)
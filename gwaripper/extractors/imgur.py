@@ -26,6 +26,9 @@ class ImgurImageExtractor(BaseExtractor[Dict[str, Any]]):
 
     EXTRACTOR_NAME: ClassVar[str] = "ImgurImage"
     EXTRACTOR_ID: ClassVar[int] = 6
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("i.imgur.com", "imgur.com", "m.imgur.com")
+    HOST_ALIASES: ClassVar[Dict[str, str]] = {"m.imgur.com": "imgur.com"}
+    CACHE_TTL: ClassVar[Optional[float]] = 7 * 24 * 3600
     BASE_URL: ClassVar[str] = "imgur.com"
 
     IMAGE_FILE_URL_RE: ClassVar[Pattern] = re.compile(
@@ -82,7 +85,8 @@ class ImgurImageExtractor(BaseExtractor[Dict[str, Any]]):
                             "API endpoint did not return a response! Imgur.com"
                             "probably changed their API!", self.api_url)
                 else:
-                    return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE)
+                    return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE,
+                                                 http_code=http_code)
 
             self.api_response = json.loads(resp)
             if self.api_response:
@@ -100,6 +104,9 @@ class ImgurAlbumExtractor(BaseExtractor):
 
     EXTRACTOR_NAME: ClassVar[str] = "ImgurAlbum"
     EXTRACTOR_ID: ClassVar[int] = 7
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("imgur.com", "m.imgur.com")
+    HOST_ALIASES: ClassVar[Dict[str, str]] = {"m.imgur.com": "imgur.com"}
+    CACHE_TTL: ClassVar[Optional[float]] = 24 * 3600
     BASE_URL: ClassVar[str] = "imgur.com"
 
     headers = {
@@ -124,6 +131,14 @@ class ImgurAlbumExtractor(BaseExtractor):
     def is_compatible(cls, url: str) -> bool:
         return bool(cls.ALBUM_URL_RE.match(url))
 
+    @classmethod
+    def canonicalize_url(cls, url: str) -> str:
+        match = cls.ALBUM_URL_RE.match(url)
+        if match is None:
+            return super().canonicalize_url(url)
+        # gallery and album urls with the same hash lead to the same album
+        return f"imgur.com/a/{match.group(1)}"
+
     def _extract(self) -> Tuple[Optional['info.FileCollection'], ExtractorReport]:
         api_response, http_code = ImgurAlbumExtractor.get_html(self.api_url)
 
@@ -133,7 +148,8 @@ class ImgurAlbumExtractor(BaseExtractor):
                         "API endpoint did not return a response! Imgur.com"
                         "probably changed their API!", self.api_url)
             else:
-                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE)
+                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE,
+                                             http_code=http_code)
 
         self.api_response = json.loads(api_response)
         self.image_count = int(self.api_response["data"]["images_count"])  # type: ignore
@@ -1,10 +1,9 @@
 import re
 import logging
 
-import bs4
 import prawcore
 
-from typing import Optional, cast, Pattern, ClassVar, List, Tuple, Type, TypeVar
+from typing import Optional, cast, Pattern, ClassVar, List, Tuple, Type, TypeVar, Dict
 
 from praw.models import Submission
 
@@ -15,6 +14,7 @@ from .soundgasm import SoundgasmUserExtractor
 from .. import config
 from gwaripper import info
 from ..reddit import reddit_praw, redirect_xpost
+from ..html_parse import find_links, make_soup
 from ..exceptions import InfoExtractingError
 
 logger = logging.getLogger(__name__)
@@ -27,7 +27,9 @@ class RedditExtractor(BaseExtractor[Submission]):
 
     EXTRACTOR_NAME: ClassVar[str] = "Reddit"
     EXTRACTOR_ID: ClassVar[int] = 1
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("reddit.com", "old.reddit.com")
     BASE_URL: ClassVar[str] = "reddit.com"
+    HOST_ALIASES: ClassVar[Dict[str, str]] = {"old.reddit.com": "reddit.com"}
 
     # grp1: r|user, grp2: subreddit/username, grp3: reddit id, grp4: title
     # user subreddit link: /user/fooname/comments/...
@@ -52,6 +54,15 @@ class RedditExtractor(BaseExtractor[Submission]):
     def is_compatible(cls, url: str) -> bool:
         return bool(cls.VALID_REDDIT_URL_RE.match(url))
 
+    @classmethod
+    def canonicalize_url(cls, url: str) -> str:
+        match = cls.VALID_REDDIT_URL_RE.match(url)
+        if match is None:
+            return super().canonicalize_url(url)
+        # the submission is identified by its id alone, the subreddit and the
+        # title slug might change or be missing
+        return f"reddit.com/comments/{match.group(3).lower()}"
+
     def _handle_praw_exc(self, exc: prawcore.exceptions.ResponseException) -> Tuple[
             None, ExtractorReport]:
         if BaseExtractor.http_code_is_extractor_broken(exc.response.status_code):
@@ -147,16 +158,20 @@ class RedditExtractor(BaseExtractor[Submission]):
         elif submission.selftext_html is not None:
             ri.selftext = submission.selftext
 
-            soup = bs4.BeautifulSoup(submission.selftext_html, "html.parser")
             # selftext_html is not like the normal html it starts with <div class="md"..
             # so i can just go through all a
-            # css selector -> tag a with set href attribute
-            links = soup.select('a[href]')
+            # the markup is generated by reddit, so the regex fast path should
+            # always work, but fall back to bs4 if it doesn't
+            links = find_links(submission.selftext_html)
+            if links is None:
+                logger.debug("Falling back to bs4 for the selftext of %s", submission.permalink)
+                soup = make_soup(submission.selftext_html)
+                # css selector -> tag a with set href attribute
+                links = [(a["href"], a.text) for a in soup.select('a[href]')]
 
             # TODO i.redd.it is always a direct link append FileInfo for it here
             # without extractor?
-            for link in links:
-                href = link["href"]
+            for href, link_text in links:
                 extractor = find_extractor(href)
                 # TODO skipping "recursive" FileCollections should be handled in gwaripper.py
                 # NOTE: @Hack checking extractor types directly
@@ -174,7 +189,7 @@ class RedditExtractor(BaseExtractor[Submission]):
                 if extractor is not None:
                     logger.info("%s link found in selftext of: %s",
                                 extractor.EXTRACTOR_NAME, submission.permalink)
-                    if title_has_banned_tag(link.text):
+                    if title_has_banned_tag(link_text):
                         report.err_code = ExtractorErrorCode.ERROR_IN_CHILDREN
                         report.children.append(
                                 ExtractorReport(href, ExtractorErrorCode.BANNED_TAG))
@@ -3,7 +3,6 @@ import logging
 import urllib3
 import urllib.parse
 
-import bs4
 
 from typing import Optional, cast, Pattern, Match, ClassVar, List, Tuple, Type, TypeVar, Any, Final
 
@@ -12,6 +11,7 @@ from .soundgasm import SoundgasmUserExtractor
 from ..exceptions import InfoExtractingError
 from gwaripper import info
 from .reddit import RedditExtractor
+from ..html_parse import make_soup
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +19,8 @@ class SkittykatExtractor(BaseExtractor):
     # these need to be re-defined by sub-classes!!
     EXTRACTOR_NAME: ClassVar[str] = "Skittkat"
     EXTRACTOR_ID: ClassVar[int] = 8
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("skittykat.cc",)
+    CACHE_TTL: ClassVar[Optional[float]] = 24 * 3600
     BASE_URL: ClassVar[str] = "skittykat.cc"
 
     SKITTYKAT_URL_RE: ClassVar[Pattern] = re.compile(
@@ -57,9 +59,10 @@ class SkittykatExtractor(BaseExtractor):
                         "or the site changed and the extractor is broken!",
                         self.url)
             else:
-                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE)
+                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE,
+                                             http_code=http_code)
 
-        soup = bs4.BeautifulSoup(html, "html.parser")
+        soup = make_soup(html)
 
         title_el = soup.select_one('h1.entry-title, h2.elementor-heading-title')
         title: str
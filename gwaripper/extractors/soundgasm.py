@@ -1,17 +1,25 @@
 import re
+import logging
 
-import bs4
-
-from typing import Optional, Union, cast, Match, ClassVar, Pattern, Tuple, Any
+from html import unescape as html_unescape
+from typing import Optional, Union, cast, Match, ClassVar, Pattern, Tuple, List, Any
 
 from .base import BaseExtractor, ExtractorReport, ExtractorErrorCode, title_has_banned_tag
 from gwaripper import info
+from ..html_parse import make_soup, text_content, count_tags_with_class
 from ..exceptions import InfoExtractingError
 
+logger = logging.getLogger(__name__)
+
 
 class SoundgasmExtractor(BaseExtractor):
     EXTRACTOR_NAME: ClassVar[str] = "Soundgasm"
     EXTRACTOR_ID: ClassVar[int] = 2
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("soundgasm.net",)
+    # file pages never change
+    CACHE_TTL: ClassVar[Optional[float]] = 7 * 24 * 3600
+    # direct urls and titles are stable
+    EXTRACTION_CACHE_TTL: ClassVar[Optional[float]] = 30 * 24 * 3600
     BASE_URL: ClassVar[str] = "soundgasm.net"
 
     # grp1: sgasm username, grp2: title
@@ -20,6 +28,11 @@ class SoundgasmExtractor(BaseExtractor):
             r"([-A-Za-z0-9_]+)/([-A-Za-z0-9_]+)/?",
             re.IGNORECASE)
 
+    TITLE_RE: ClassVar[Pattern] = re.compile(
+            r'<div class="jp-title"[^>]*>(.*?)</div>', re.DOTALL)
+    DESCRIPTION_RE: ClassVar[Pattern] = re.compile(
+            r'<div class="jp-description"[^>]*>\s*<p[^>]*>(.*?)</p>', re.DOTALL)
+
     author: str
 
     # NOTE: dont use init_from unless you change base class to BaseExtractor[type of init_from]
@@ -32,6 +45,37 @@ class SoundgasmExtractor(BaseExtractor):
     def is_compatible(cls, url: str) -> bool:
         return bool(cls.VALID_SGASM_FILE_URL_RE.match(url))
 
+    @classmethod
+    def canonicalize_url(cls, url: str) -> str:
+        match = cls.VALID_SGASM_FILE_URL_RE.match(url)
+        # NOTE: regex isn't anchored at the end, so make sure nothing else follows
+        if match is None or not cls._matches_whole_path(url, match):
+            return super().canonicalize_url(url)
+        # /u/ and /user/ lead to the same page
+        return f"soundgasm.net/u/{match.group(1)}/{match.group(2)}"
+
+    @staticmethod
+    def _matches_whole_path(url: str, match: Match) -> bool:
+        rest = url[match.end():]
+        return not rest or rest[0] in "?#"
+
+    @classmethod
+    def parse_title_descr_fast(cls, html: str) -> Optional[Tuple[str, str]]:
+        """
+        Regex version of selecting div.jp-title and div.jp-description > p
+
+        :return: Title and description or None if one of them couldn't be found
+        """
+        titles = cls.TITLE_RE.findall(html)
+        descrs = cls.DESCRIPTION_RE.findall(html)
+        # NOTE: validate by comparing with the number of container tags, so we don't
+        # silently pick a different element than the selector would if the markup changed
+        if (len(titles) != 1 or len(descrs) != 1 or
+                count_tags_with_class(html, "div", "jp-title") != 1 or
+                count_tags_with_class(html, "div", "jp-description") != 1):
+            return None
+        return text_content(titles[0]), text_content(descrs[0])
+
     def _extract(self) -> Tuple[Optional['info.FileInfo'], ExtractorReport]:
         html, http_code = SoundgasmExtractor.get_html(self.url)
         if not html:
@@ -42,17 +86,21 @@ class SoundgasmExtractor(BaseExtractor):
                        "or the site changed and the extractor is broken!")
                 raise InfoExtractingError(msg, self.url)
             else:
-                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE)
-
-        soup = bs4.BeautifulSoup(html, "html.parser")
-
-        title = soup.select_one("div.jp-title").text
+                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE,
+                                             http_code=http_code)
+
+        fields = self.parse_title_descr_fast(html)
+        if fields is None:
+            logger.debug("Unexpected markup, falling back to bs4: %s", self.url)
+            soup = make_soup(html)
+            fields = (soup.select_one("div.jp-title").text,
+                      soup.select_one("div.jp-description > p").text)
+        title, descr = fields
         if title_has_banned_tag(title):
             return None, ExtractorReport(self.url, ExtractorErrorCode.BANNED_TAG)
 
         direct_url = cast(Match, re.search("m4a: \"(.+)\"", html)).group(1)
         ext = direct_url.rsplit('.', 1)[1]
-        descr = soup.select_one("div.jp-description > p").text
 
         return (info.FileInfo(self.__class__, True, ext, self.url,
                          # use cast supress type checker warning, since we just assume it's
@@ -66,11 +114,16 @@ class SoundgasmExtractor(BaseExtractor):
 class SoundgasmUserExtractor(BaseExtractor):
     EXTRACTOR_NAME: ClassVar[str] = "SoundgasmUser"
     EXTRACTOR_ID: ClassVar[int] = 3
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("soundgasm.net",)
+    # always revalidated, since new files get added
+    CACHE_TTL: ClassVar[Optional[float]] = 0
     BASE_URL: ClassVar[str] = "soundgasm.net/u/"
 
     VALID_SGASM_USER_URL_RE: ClassVar[Pattern] = re.compile(
             r"(?:https?://)?(?:www\.)?soundgasm\.net/(?:u|user)/([-A-Za-z0-9_]+)/?",
             re.IGNORECASE)
+    SOUND_DETAILS_LINK_RE: ClassVar[Pattern] = re.compile(
+            r'<div class="sound-details"[^>]*>\s*<a\s[^>]*?href="([^"]*)"', re.IGNORECASE)
 
     # NOTE: dont use init_from unless you change base class to BaseExtractor[type of init_from]
     def __init__(self, url: str, init_from: Optional[Any] = None):
@@ -82,6 +135,27 @@ class SoundgasmUserExtractor(BaseExtractor):
     def is_compatible(cls, url: str) -> bool:
         return bool(cls.VALID_SGASM_USER_URL_RE.match(url))
 
+    @classmethod
+    def canonicalize_url(cls, url: str) -> str:
+        match = cls.VALID_SGASM_USER_URL_RE.match(url)
+        if match is None or not SoundgasmExtractor._matches_whole_path(url, match):
+            return super().canonicalize_url(url)
+        return f"soundgasm.net/u/{match.group(1)}"
+
+    @classmethod
+    def parse_user_files_fast(cls, html: str) -> Optional[List[str]]:
+        """
+        Regex version of selecting the hrefs of div.sound-details > a
+
+        :return: List of hrefs or None if not all div.sound-details could be matched
+        """
+        hrefs = [html_unescape(href) for href in cls.SOUND_DETAILS_LINK_RE.findall(html)]
+        # NOTE: validate by comparing the number of container tags, since changed markup
+        # would otherwise lead to silently missing files
+        if len(hrefs) != count_tags_with_class(html, "div", "sound-details"):
+            return None
+        return hrefs
+
     # @Refactor should an extractor just return a FileCollection with a list of urls
     # or should it resolve all these links and include a list of FileInfo_s?
     def _extract(self) -> Tuple[Optional['info.FileCollection'],
@@ -90,10 +164,10 @@ class SoundgasmUserExtractor(BaseExtractor):
         Gets all the links to soundgasm.net posts of the user/at user url and returns
         them in a list
 
-         Use bs4 to select all <a> tags directly beneath <div> with class sound-details
+         Selects all <a> tags directly beneath <div> with class sound-details
          Writes content of href attributes of found tags to list and return it
         """
-        html, http_code = SoundgasmExtractor.get_html(self.url)
+        html, http_code = self.get_html(self.url)
         if not html:
             if self.http_code_is_extractor_broken(http_code):
                 # we did not modify passed in url
@@ -102,18 +176,20 @@ class SoundgasmUserExtractor(BaseExtractor):
                        "or the site changed and the extractor is broken!")
                 raise InfoExtractingError(msg, self.url)
             else:
-                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE)
-
-        soup = bs4.BeautifulSoup(html, 'html.parser')
+                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE,
+                                             http_code=http_code)
 
-        # decision for bs4 vs regex -> more safe and speed loss prob not significant
         # splits: 874 µs per loop; regex: 1.49 ms per loop; bs4: 84.3 ms per loop
-        anchs = soup.select("div.sound-details > a")
-        user_files = [a["href"] for a in anchs]
+        # -> use the regex and only fall back to bs4 if the markup changed
+        user_files = self.parse_user_files_fast(html)
+        if user_files is None:
+            logger.debug("Unexpected markup, falling back to bs4: %s", self.url)
+            soup = make_soup(html)
+            user_files = [a["href"] for a in soup.select("div.sound-details > a")]
 
         report = ExtractorReport(self.url, ExtractorErrorCode.NO_ERRORS)
         fcol = info.FileCollection(self.__class__, self.url, self.author, self.author, self.author)
-        for url in user_files:
+        for url in self.skip_known_urls(user_files, fcol, report):
             fi, extr_report = SoundgasmExtractor.extract(url, parent=fcol,
                                                          parent_report=report)
 
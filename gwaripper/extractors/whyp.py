@@ -18,6 +18,8 @@ logger = logging.getLogger(__name__)
 class WhypExtractor(BaseExtractor):
     EXTRACTOR_NAME: ClassVar[str] = "Whyp"
     EXTRACTOR_ID: ClassVar[int] = 10
+    HOSTNAMES: ClassVar[Tuple[str, ...]] = ("whyp.it",)
+    CACHE_TTL: ClassVar[Optional[float]] = 24 * 3600
     BASE_URL: ClassVar[str] = "whyp.it"
 
     # grp1: id, grp2: slug, grp3: token
@@ -64,7 +66,8 @@ class WhypExtractor(BaseExtractor):
                     "Retrieving API response failed! Either the audio is private and "
                     "the url is missing the token (e.g. ?token=yAtIM) or the "
                     "audio was removed! URL: %s", self.url)
-                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE)
+                return None, ExtractorReport(self.url, ExtractorErrorCode.NO_RESPONSE,
+                                             http_code=http_code)
 
         try:
             data = json.loads(response)["track"]
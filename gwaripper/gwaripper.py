@@ -4,14 +4,24 @@ import os
 import time
 import datetime
 import re
+import socket
 import urllib.request
 import urllib.error
 import dataclasses
 import sqlite3
+import threading
+import functools
+import queue
+
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 
 import praw
+import prawcore
 
-from typing import List, Union, Optional, cast, Dict, ClassVar, Tuple, Any, Set, Final, Type
+from typing import (
+    List, Union, Optional, cast, Dict, ClassVar, Tuple, Any, Set, Final, Type, Callable,
+    Match, Iterable, Iterator, Sized
+)
 from enum import Enum, unique, auto
 
 from . import utils
@@ -22,12 +32,21 @@ from .info import (
     UNKNOWN_USR_FOLDER, DELETED_USR_FOLDER, DownloadType
 )
 from . import download as dl
+from . import http_session
+from . import http_cache
 from . import exceptions
-from .reddit import reddit_praw
-from .db import load_or_create_sql_db, export_table_to_csv, backup_db
+from .jobs import JobJournal, JobState
+from .known_urls import KnownUrlIndex
+from .extraction_memo import ExtractionMemo
+from .extraction_cache import ExtractionCache
+from .dead_urls import DeadUrlCache
+from .reddit import reddit_praw, fetch_submissions, get_request_stats
+from .db import (
+    load_or_create_sql_db, export_table_to_csv, backup_db, find_content_duplicates,
+    audio_file_path
+)
 from .file_tags import update_meta_tags
 
-rqd = utils.RequestDelayer(0.25, 0.75)
 
 # configure logging
 # logfn = time.strftime("%Y-%m-%d.log")
@@ -100,6 +119,11 @@ class DownloadCollectionResult:
     error_code: dl.DownloadErrorCode
 
 
+# url, extracted FileInfo/FileCollection (None on failure) and report
+ExtractionResult = Tuple[str, Optional[Union[FileInfo, FileCollection]],
+                         extr.base.ExtractorReport]
+
+
 @unique
 class Status(Enum):
     SUCCESS = 0
@@ -123,6 +147,9 @@ class GWARipper:
     skip_non_audio: Final[bool]
     only_one_mirror: Final[bool]
     host_priority: Final[List['extr.AudioHost']]
+    max_workers: Final[int]
+    max_workers_per_host: Final[int]
+    extract_workers: Final[int]
 
     # we can only omit -> None if at least one arg is typed otherwise it is
     # considered an untyped method
@@ -131,11 +158,22 @@ class GWARipper:
                  skip_non_audio: bool = False,
                  dont_write_selftext: bool = False,
                  only_one_mirror: bool = False,
-                 host_priority: Optional[List['extr.AudioHost']] = None) -> None:
+                 host_priority: Optional[List['extr.AudioHost']] = None,
+                 max_workers: int = 1,
+                 max_workers_per_host: int = 2,
+                 extract_workers: int = 1) -> None:
         # TODO @CleanUp remove all dependencies on config, the class should be passed all the relevant
         # setting through init -> easiert to test, more robust etc.
+        # NOTE: the connection is shared between the download workers if max_workers > 1
+        # all access to it has to be done while holding self._db_lock
         self.db_con, _ = load_or_create_sql_db(
-            os.path.join(config.get_root(), "gwarip_db.sqlite"))
+            os.path.join(config.get_root(), "gwarip_db.sqlite"),
+            check_same_thread=False)
+        self._db_lock = threading.RLock()
+        # so most already_downloaded checks don't need a query
+        self.known_urls = KnownUrlIndex.load(self.db_con)
+        # records the state of the urls passed to download_all so the run can be resumed
+        self.journal = JobJournal(self.db_con, self._db_lock)
         self.urls: List[str] = []
         self.nr_urls: int = 0
         self.extractor_reports: List[extr.base.ExtractorReport] = []
@@ -145,6 +183,38 @@ class GWARipper:
         self.dont_write_selftext = dont_write_selftext
         self.only_one_mirror = only_one_mirror
         self.host_priority = host_priority if host_priority is not None else []
+        # max_workers of 1 means everything is processed sequentially on the calling thread
+        self.max_workers = max(1, max_workers)
+        self.max_workers_per_host = max(1, max_workers_per_host)
+        # if either is > 1 extraction and downloads run in separate stages that overlap
+        # (max_workers is the number of download workers then)
+        self.extract_workers = max(1, extract_workers)
+        self._host_limiter = utils.KeyedConcurrencyLimiter(self.max_workers_per_host)
+        # abs. paths of files that are currently being downloaded, so concurrent
+        # downloads don't pick the same filename
+        self._reserved_paths: Set[str] = set()
+        # url keys of files that are currently being downloaded
+        self._inflight_urls: Set[str] = set()
+        self._inflight_lock = threading.Lock()
+        self._filename_lock = threading.Lock()
+        # (sha256, size) -> abs. path and id in the DB of audio files downloaded during
+        # this run, since their DB rows might not have their final path yet
+        self._content_paths: Dict[Tuple[str, int], Tuple[str, int]] = {}
+        # id in the DB -> ids of the rows that were added for content duplicates of
+        # the file, which need to be moved along with it when its collection is added
+        self._content_duplicate_ids: Dict[int, List[int]] = {}
+        # so collection extractors don't fetch the pages of files we already have
+        extr.base.set_known_url_check(None if download_duplicates else self.is_known_url)
+        memo_size = config.config.getint("Settings", "extraction_memo_size", fallback=1000)
+        self.extraction_memo = ExtractionMemo(memo_size) if memo_size > 0 else None
+        extr.base.set_extraction_memo(self.extraction_memo)
+        self.extraction_cache = ExtractionCache(self.db_con, self._db_lock)
+        extr.base.set_extraction_cache(self.extraction_cache)
+        self.dead_urls = DeadUrlCache(
+            self.db_con, self._db_lock,
+            recheck_interval=config.config.getfloat(
+                "Settings", "dead_url_recheck_hours", fallback=24) * 3600)
+        extr.base.set_dead_url_cache(self.dead_urls)
 
     # return type needed otherwise we don't get type checking if used in with..as
     def __enter__(self) -> 'GWARipper':
@@ -156,6 +226,12 @@ class GWARipper:
         # suppress the exception by returning a true value from this method. If
         # you don't want to suppress errors then you can return a value that
         # evaluates to False.
+        # so state changes of the jobs are written even on KeyboardInterrupt
+        self.journal.flush()
+        extr.base.set_known_url_check(None)
+        extr.base.set_extraction_memo(None)
+        extr.base.set_extraction_cache(None)
+        extr.base.set_dead_url_cache(None)
         export_table_to_csv(
             self.db_con,
             os.path.join(config.get_root(), "gwarip_db_exp.csv"),
@@ -173,36 +249,68 @@ class GWARipper:
         return None
 
     def set_urls(self, urls: List[str]):
-        # NOTE: deduplicates urls
-        self.urls = list(set(urls))
+        # NOTE: deduplicates urls, also ones that are only spelled differently
+        self.urls = list({extr.canonical_url(url): url for url in urls}.values())
         self.nr_urls = len(self.urls)
 
     def extract_and_download(self, url: str) -> None:
+        self.extractor_reports.append(self._extract_and_download(url))
+
+    def _extract_and_download(self, url: str) -> extr.base.ExtractorReport:
+        return self._download_extracted(*self._extract(url))
+
+    def _extract(self, url: str, init_from: Optional[Any] = None) -> ExtractionResult:
         extractor = extr.find_extractor(url)
         if extractor is None:
-            self.extractor_reports.append(
-                extr.base.ExtractorReport(url, extr.base.ExtractorErrorCode.NO_EXTRACTOR))
             logger.warning("Found no extractor for URL: %s", url)
-            return None
+            return url, None, extr.base.ExtractorReport(
+                url, extr.base.ExtractorErrorCode.NO_EXTRACTOR)
 
-        info, extr_report = extractor.extract(url)
-        if info is None:
-            self.extractor_reports.append(extr_report)
-            return None
+        self.journal.set_state(url, JobState.EXTRACTING)
+        info, extr_report = extractor.extract(url, init_from=init_from)
+        if info is not None:
+            self.journal.set_state(url, JobState.EXTRACTED)
+        return url, info, extr_report
 
-        self.download(info)
-        self.extractor_reports.append(extr_report)
+    def _download_extracted(self, url: str, info: Optional[Union[FileInfo, FileCollection]],
+                            extr_report: extr.base.ExtractorReport) -> extr.base.ExtractorReport:
+        if info is not None:
+            self.journal.set_state(url, JobState.DOWNLOADING)
+            self.download(info)
+
+        self.journal.set_state(url, self._job_state_from_report(extr_report))
+        return extr_report
+
+    @staticmethod
+    def _job_state_from_report(report: extr.base.ExtractorReport) -> JobState:
+        if (extr.base.ExtractorErrorCode.is_ok(report.err_code) or
+                extr.base.ExtractorErrorCode.is_warning(report.err_code)) and (
+                dl.DownloadErrorCode.is_ok(report.download_error_code) or
+                dl.DownloadErrorCode.is_warning(report.download_error_code)):
+            return JobState.DONE
+        return JobState.FAILED
 
     def parse_and_download_submission(self, sub: praw.models.Submission,
                                       reddit_url: str = "https://www.reddit.com") -> None:
+        self.extractor_reports.append(
+            self._parse_and_download_submission(sub, reddit_url=reddit_url))
+
+    def _parse_and_download_submission(
+            self, sub: praw.models.Submission,
+            reddit_url: str = "https://www.reddit.com") -> extr.base.ExtractorReport:
+        return self._download_extracted(*self._extract_submission(sub, reddit_url))
+
+    def _extract_submission(self, sub: praw.models.Submission,
+                            reddit_url: str = "https://www.reddit.com") -> ExtractionResult:
         url = f"{reddit_url}{sub.permalink}"
+        self.journal.set_state(url, JobState.EXTRACTING)
         # init_from not type-checked for Submission since praw doesn't have
         # type hints
         info, extr_report = extr.reddit.RedditExtractor.extract(
             url, init_from=sub)
         if info is not None:
-            self.download(info)
-        self.extractor_reports.append(extr_report)
+            self.journal.set_state(url, JobState.EXTRACTED)
+        return url, info, extr_report
 
     def write_report(self, reports: List[extr.base.ExtractorReport]):
         # parsing report!
@@ -260,6 +368,8 @@ class GWARipper:
             contents.append(
                 f"<div class='info'>EXTRACT: <span class='"
                 f"{success.name.lower()}'>{report.err_code.name}"
+                f"{f' (HTTP {report.http_code})' if report.http_code else ''}"
+                f"{' (CACHED)' if report.cached else ''}"
                 f"</span></div>")
             contents.append(
                 f"<div class='info'>DOWNLOAD: <span class='"
@@ -291,6 +401,15 @@ class GWARipper:
                          f"<li><span class=\"error\">ERROR: {dl_status[Status.ERROR.value]}</span></li>"
                          "</ul></p>")
                         )
+        memo_stats = self.extraction_memo.stats if self.extraction_memo is not None else None
+        if memo_stats is not None and (memo_stats["hits"] or memo_stats["misses"]):
+            contents.insert(2,
+                            ("<p>EXTRACTION MEMO:"
+                             "<ul>"
+                             f"<li>RE-USED: {memo_stats['hits']}</li>"
+                             f"<li>EXTRACTED: {memo_stats['misses']}</li>"
+                             "</ul></p>")
+                            )
 
         while True:
             try:
@@ -300,24 +419,213 @@ class GWARipper:
             except FileNotFoundError:
                 os.makedirs(dirname)
 
-    def download_all(self, sub_list: Optional[List[praw.models.Submission]] = None) -> None:
+    def download_all(self, sub_list: Optional[Iterable[praw.models.Submission]] = None) -> None:
+        """
+        Downloads all the urls in self.urls or the submissions in sub_list
+
+        :param sub_list: Submissions to download, can be a lazy iterable like a
+                         praw ListingGenerator, which will only be consumed as
+                         fast as the submissions can be processed
+        """
         if config.config.getboolean("Settings", "set_missing_reddit", fallback=False):
             logger.info("GWARipper will update already downloaded files with information "
                         "from reddit if they were previously downloaded from the site "
                         "directly. You can disable this in the settings")
 
+        jobs: Iterable[Callable[[], ExtractionResult]]
         if sub_list is None:
-            for idx, url in enumerate(self.urls):
-                logger.info("Processing URL %d of %d: %s",
-                            idx + 1, self.nr_urls, url)
-                self.extract_and_download(url)
+            prefetched = self._prefetch_reddit_submissions(self.urls)
+            jobs = [functools.partial(self._process_url, url, idx + 1, prefetched.get(url))
+                    for idx, url in enumerate(self.urls)]
+            self.journal.add(self.urls)
         else:
-            nr_subs = len(sub_list)
-            idx = 1
-            for sub in sub_list:
-                logger.info("Processing submission %d of %d: %s",
-                            idx, nr_subs, sub.permalink)
-                self.parse_and_download_submission(sub)
+            jobs = self._submission_jobs(sub_list)
+
+        if self.max_workers == 1 and self.extract_workers == 1:
+            for job in jobs:
+                self.extractor_reports.append(self._download_extracted(*job()))
+        else:
+            logger.info("Processing items using %d extraction and %d download workers "
+                        "(max. %d per host)", self.extract_workers,
+                        self.max_workers, self.max_workers_per_host)
+            self.extractor_reports.extend(self._run_pipeline(jobs))
+
+        # all jobs were processed -> only failed ones need to be kept for resuming
+        self.journal.clear_done()
+
+        http_stats = http_session.get_session().stats
+        logger.info("Made %d HTTP requests using %d connections (%d re-used)",
+                    http_stats["requests"], http_stats["connections_opened"],
+                    http_stats["connections_reused"])
+        logger.info("Known URL index: %d URLs loaded in %.2fs using %.1f MiB, %d of %d "
+                    "lookups didn't need a query", len(self.known_urls),
+                    self.known_urls.load_time, self.known_urls.memory_usage / 1024 / 1024,
+                    self.known_urls.misses, self.known_urls.lookups)
+        memo_stats = self.extraction_memo.stats if self.extraction_memo is not None else None
+        if memo_stats is not None and memo_stats["hits"]:
+            logger.info("Re-used the extracted information of %d urls that were linked "
+                        "more than once (%d extracted, %d evicted)", memo_stats["hits"],
+                        memo_stats["misses"], memo_stats["evicted"])
+        extr_cache_stats = self.extraction_cache.stats
+        if extr_cache_stats["hits"]:
+            logger.info("Extraction cache: %d hits, %d expired, %d misses",
+                        extr_cache_stats["hits"], extr_cache_stats["expired"],
+                        extr_cache_stats["misses"])
+        dead_stats = self.dead_urls.stats
+        if dead_stats["skipped"] or dead_stats["recorded"]:
+            logger.info("Skipped %d URLs that were dead in previous runs, %d were "
+                        "re-checked and %d recorded as dead", dead_stats["skipped"],
+                        dead_stats["rechecked"], dead_stats["recorded"])
+        cache = http_cache.get_cache()
+        if cache is not None:
+            cache_stats = cache.stats
+            logger.info("HTTP cache: %d hits, %d revalidated, %d misses, %d evicted",
+                        cache_stats["hits"], cache_stats["revalidated"],
+                        cache_stats["misses"], cache_stats["evicted"])
+        for host, rl_stats in extr.base.get_rate_limiter().stats.items():
+            if rl_stats["delayed"]:
+                logger.info("Rate limit for %s delayed %d of %d requests by %.1fs in total "
+                            "(max. %.2fs)", host, rl_stats["delayed"], rl_stats["requests"],
+                            rl_stats["total_wait"], rl_stats["max_wait"])
+        reddit_stats = get_request_stats()
+        if reddit_stats is not None and reddit_stats["requests"]:
+            logger.info("Made %d reddit API requests, %d were delayed by %.1fs in total "
+                        "to stay within the rate limit", reddit_stats["requests"],
+                        reddit_stats["delayed"], reddit_stats["total_wait"])
+
+    def _run_pipeline(self, jobs: Iterable[Callable[[], ExtractionResult]]
+                      ) -> List[extr.base.ExtractorReport]:
+        """
+        Runs the extraction jobs on extract_workers threads that pass the extracted
+        FileInfos/FileCollections to max_workers download threads using a bounded
+        queue, so extraction and downloading overlap, but extraction can't get
+        too far ahead of the downloads
+
+        jobs is consumed lazily with at most 2 * extract_workers jobs being
+        submitted at a time, so a generator only gets advanced as fast as
+        the downloads progress
+
+        Top-level FileCollections are downloaded by a single download worker, so
+        their files stay together and end up in the same author folder
+
+        :return: Reports in the same order as the jobs
+        """
+        reports: Dict[int, extr.base.ExtractorReport] = {}
+        extracted: "queue.Queue[Tuple[int, ExtractionResult]]" = queue.Queue(
+            maxsize=2 * self.max_workers)
+        extraction_done = threading.Event()
+        # set if one of the stages failed, so the other one doesn't block forever
+        abort = threading.Event()
+        max_pending = 2 * self.extract_workers
+        nr_jobs = 0
+
+        def extract_stage(idx: int, job: Callable[[], ExtractionResult]) -> None:
+            if abort.is_set():
+                return
+            result = job()
+            if result[1] is None:
+                # nothing to download
+                reports[idx] = self._download_extracted(*result)
+                return
+            # blocks while the download stage is behind
+            while not abort.is_set():
+                try:
+                    extracted.put((idx, result), timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def download_stage() -> None:
+            while not abort.is_set():
+                try:
+                    idx, result = extracted.get(timeout=0.1)
+                except queue.Empty:
+                    # NOTE: done is only set after all items were put into the queue
+                    if extraction_done.is_set() and extracted.empty():
+                        return
+                    continue
+                try:
+                    reports[idx] = self._download_extracted(*result)
+                except BaseException:
+                    abort.set()
+                    raise
+
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix="gwaripper-dl") as dl_executor:
+            dl_futures = [dl_executor.submit(download_stage)
+                          for _ in range(self.max_workers)]
+            try:
+                with ThreadPoolExecutor(max_workers=self.extract_workers,
+                                        thread_name_prefix="gwaripper-extract") as ex_executor:
+                    pending: Set[Future] = set()
+                    for idx, job in enumerate(jobs):
+                        if abort.is_set():
+                            break
+                        pending.add(ex_executor.submit(extract_stage, idx, job))
+                        nr_jobs += 1
+                        if len(pending) >= max_pending:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                future.result()
+                    for future in pending:
+                        future.result()
+            except BaseException:
+                abort.set()
+                raise
+            finally:
+                extraction_done.set()
+            for future in dl_futures:
+                future.result()
+
+        return [reports[idx] for idx in range(nr_jobs)]
+
+    def _process_url(self, url: str, idx: int,
+                     init_from: Optional[praw.models.Submission] = None) -> ExtractionResult:
+        logger.info("Processing URL %d of %d: %s", idx, self.nr_urls, url)
+        return self._extract(url, init_from=init_from)
+
+    def _prefetch_reddit_submissions(self, urls: List[str]) -> Dict[str, praw.models.Submission]:
+        """
+        Fetches the submissions of all reddit urls in batches, so the RedditExtractor
+        doesn't have to make one API request per url
+
+        :return: Dict of url to the fetched submission
+        """
+        ids: Dict[str, str] = {}
+        for url in urls:
+            if extr.find_extractor(url) is extr.reddit.RedditExtractor:
+                ids[url] = cast(Match, extr.reddit.RedditExtractor.VALID_REDDIT_URL_RE.match(
+                    url)).group(3).lower()
+        # not worth it for a single submission
+        if len(ids) < 2:
+            return {}
+
+        try:
+            submissions = fetch_submissions(ids.values())
+        except (prawcore.exceptions.PrawcoreException, exceptions.NoAuthenticationError) as err:
+            logger.warning("Prefetching reddit submissions failed, they will be fetched "
+                           "one by one: %s", err)
+            return {}
+        logger.info("Prefetched %d of %d reddit submissions", len(submissions), len(ids))
+
+        return {url: submissions[sub_id] for url, sub_id in ids.items() if sub_id in submissions}
+
+    def _submission_jobs(self, subs: Iterable[praw.models.Submission]
+                         ) -> Iterator[Callable[[], ExtractionResult]]:
+        """Lazily creates the jobs for subs, so listings can be streamed"""
+        nr_subs = len(subs) if isinstance(subs, Sized) else None
+        for idx, sub in enumerate(subs):
+            # NOTE: submissions are resumed using their url
+            self.journal.add((f"https://www.reddit.com{sub.permalink}",))
+            yield functools.partial(self._process_submission, sub, idx + 1, nr_subs)
+
+    def _process_submission(self, sub: praw.models.Submission, idx: int,
+                            nr_subs: Optional[int]) -> ExtractionResult:
+        if nr_subs is None:
+            logger.info("Processing submission %d: %s", idx, sub.permalink)
+        else:
+            logger.info("Processing submission %d of %d: %s", idx, nr_subs, sub.permalink)
+        return self._extract_submission(sub)
 
     def download(self, info: Union[FileInfo, FileCollection]):
         if isinstance(info, FileInfo):
@@ -326,21 +634,32 @@ class GWARipper:
             self._download_collection(info, None)
 
     @staticmethod
-    def _pad_filename_if_exists(dirpath: str, filename: str, ext: str):
+    def _pad_filename_if_exists(dirpath: str, filename: str, ext: str,
+                                reserved: Optional[Set[str]] = None):
+        """
+        :param reserved: Set of paths that count as taken even if they're not on
+                         disk (yet); the chosen path will be added to it
+        """
         filename_old = filename
         i = 1
 
+        def taken(fn: str) -> bool:
+            path = os.path.join(dirpath, f"{fn}.{ext}")
+            return os.path.isfile(path) or (reserved is not None and path in reserved)
+
         # file alrdy exists but it wasnt in the url database -> prob same titles
         # only one tag or the ending is different (since fname got cut off, so we
         # dont exceed win path limit)
         # count up i till file doesnt exist anymore
         # isfile works without checking if dir exists first
-        while os.path.isfile(os.path.join(dirpath, f"{filename}.{ext}")):
+        while taken(filename):
             i += 1
             # :02d -> pad number with 0 to a width of 2, d -> digit(int)
             filename = f"{filename_old}_{i:02d}"
         if i > 1:
             logger.info("FILE ALREADY EXISTS - ADDED: _%02d", i)
+        if reserved is not None:
+            reserved.add(os.path.join(dirpath, f"{filename}.{ext}"))
         return filename
 
     def _download_file(self, info: FileInfo, author_name: Optional[str],
@@ -351,21 +670,46 @@ class GWARipper:
         if that one is not available the extracted (from the page) author of the file gets
         used
         Calls info.generate_filename to get a valid filename
-        Also calls method to add dl to db commits when download is successful, does a rollback
-        when not (exception raised).
+        Audio files are added to the DB in their own transaction once the download
+        was successful, so failed downloads never end up in the DB
 
         :return subpath: Returns subpath to folder the file is located in relative to root_dir
                          None for unsuccessful downloads
         """
         # TODO re-add request delay?
-        already_downloaded = self.already_downloaded(info)
-        if already_downloaded and not self.download_duplicates:
-            logger.info(
-                "File was already downloaded, skipped URL: %s", info.page_url)
-            return None
-        elif not info.is_audio and self.skip_non_audio:
-            logger.info("Non-audio file was skipped! URL: %s", info.page_url)
-            return None
+        key = extr.canonical_url(info.page_url)
+        # NOTE: the same url might be downloaded by another worker right now, which
+        # already_downloaded can't know about yet; checking both and claiming the url
+        # happen under the same lock and the claim is only released once the file
+        # was added to the DB, so two workers can't both pass the checks
+        with self._inflight_lock:
+            if key in self._inflight_urls and not self.download_duplicates:
+                logger.info("File is being downloaded by another worker, skipped URL: %s",
+                            info.page_url)
+                info.downloaded = dl.DownloadErrorCode.SKIPPED_DUPLICATE
+                return None
+
+            already_downloaded = self.already_downloaded(info)
+            if already_downloaded and not self.download_duplicates:
+                logger.info(
+                    "File was already downloaded, skipped URL: %s", info.page_url)
+                return None
+            elif not info.is_audio and self.skip_non_audio:
+                logger.info("Non-audio file was skipped! URL: %s", info.page_url)
+                return None
+            self._inflight_urls.add(key)
+        try:
+            return self._download_new_file(
+                info, author_name, top_collection, already_downloaded,
+                file_index=file_index, dl_idx=dl_idx, dl_max=dl_max)
+        finally:
+            with self._inflight_lock:
+                self._inflight_urls.discard(key)
+
+    def _download_new_file(self, info: FileInfo, author_name: Optional[str],
+                           top_collection: Optional[FileCollection], already_downloaded: bool,
+                           file_index: int = 0, dl_idx: int = 1,
+                           dl_max: int = 1) -> Optional[str]:
 
         if not author_name:
             author_name = UNKNOWN_USR_FOLDER
@@ -375,7 +719,9 @@ class GWARipper:
 
         mypath = os.path.join(config.get_root(), author_name, subpath)
         os.makedirs(mypath, exist_ok=True)
-        filename = self._pad_filename_if_exists(mypath, filename, ext)
+        with self._filename_lock:
+            filename = self._pad_filename_if_exists(mypath, filename, ext, self._reserved_paths)
+        reserved_path = os.path.join(mypath, f"{filename}.{ext}")
         filename = f"{filename}.{ext}"
 
         logger.info("Downloading: %s..., File %d of %d", filename,
@@ -388,17 +734,38 @@ class GWARipper:
         # well as non-audio files if self.skip_non_audio was True
         # -> this just needs to branch on audio vs non-audio with regards to adding it to the DB
         try:
+            # NOTE: download first and only add the file to the DB afterwards in its own
+            # short transaction, so the shared connection is never held by one worker
+            # for the whole duration of a download
+            with self._host_limiter.limit(extr.EXTRACTOR_TO_HOST.get(info.extractor)):
+                dl_function(info, mypath, filename)
+
+            dedup_action: Optional[str] = None
             if info.is_audio and not already_downloaded:
+                path = os.path.join(mypath, filename)
                 # automatically commits changes to db_con if everything succeeds or does a rollback
                 # if an exception is raised; exception is still raised and must be caught
-                with self.db_con:
+                # NOTE: looking for a file with the same content and adding the file happen
+                # under the same lock, so a file of another worker is either found with its
+                # row already being in the DB or that worker finds ours
+                with self._db_lock, self.db_con:
+                    dedup_action, existing_id = self._dedup_content(info, path)
                     # executes the SQL query but leaves commiting it to context manager
-                    file_info_id_in_db = self._add_to_db(info, None, filename)
-                    dl_function(info, mypath, filename)
-            else:
-                # don't add to db if it's a redownload or non-audio
-                # NOTE: we already skip duplicate audios up top if download_duplicates isn't set
-                dl_function(info, mypath, filename)
+                    if dedup_action == "skip":
+                        existing_id = cast(int, existing_id)
+                        self._content_duplicate_ids.setdefault(existing_id, []).append(
+                            self._add_to_db_content_duplicate(info, existing_id))
+                    else:
+                        file_info_id_in_db = self._add_to_db(info, None, filename)
+                        if dedup_action is None and info.file_size and info.sha256 is not None:
+                            self._content_paths[(info.sha256, info.file_size)] = (
+                                path, file_info_id_in_db)
+                self.known_urls.add(extr.canonical_url(info.page_url))
+                if dedup_action == "skip":
+                    info.downloaded = dl.DownloadErrorCode.SKIPPED_DUPLICATE
+                    return None
+            # NOTE: don't add to db if it's a redownload or non-audio
+            # we already skip duplicate audios up top if download_duplicates isn't set
         except urllib.error.HTTPError as err:
             logger.warning("HTTP Error %d: %s: \"%s\"",
                            err.code, err.reason, info.direct_url)
@@ -411,8 +778,8 @@ class GWARipper:
             logger.warning(err.reason)
             logger.warning("File information was not added to DB! Reddit selftext might "
                            "not be written if this was the only file! "
-                           "It's recommended to manually delete and re-download the file "
-                           "using GWARipper!")
+                           "The partial download was kept and will be resumed when "
+                           "downloading the file with GWARipper again!")
             info.downloaded = dl.DownloadErrorCode.HTTP_ERROR_OTHER
 
             if info.parent:
@@ -421,19 +788,30 @@ class GWARipper:
                     info.reddit_info.url if info.reddit_info is not None
                     else info.parent.url)
 
+        except socket.timeout as err:
+            # read timeout or the deadline for the URL was exceeded
+            # NOTE: partial HTTP downloads are kept and will be resumed
+            logger.warning("Timed out while downloading %s: %s", info.direct_url,
+                           str(err) or "read timeout")
+            info.downloaded = dl.DownloadErrorCode.TIMED_OUT
         except urllib.error.URLError as err:
-            logger.error("URL Error for %s: %s\nExtractor %s is probably broken! "
-                         "Please report this error on github!", info.direct_url,
-                         str(err.reason).strip(), info.extractor)
-            # TODO inaccurate
-            info.downloaded = dl.DownloadErrorCode.HTTP_ERROR_OTHER
+            if isinstance(err.reason, socket.timeout):
+                logger.warning("Timed out while connecting to %s", info.direct_url)
+                info.downloaded = dl.DownloadErrorCode.TIMED_OUT
+            else:
+                logger.error("URL Error for %s: %s\nExtractor %s is probably broken! "
+                             "Please report this error on github!", info.direct_url,
+                             str(err.reason).strip(), info.extractor)
+                # TODO inaccurate
+                info.downloaded = dl.DownloadErrorCode.HTTP_ERROR_OTHER
         except exceptions.ExternalError:
             info.downloaded = dl.DownloadErrorCode.EXTERNAL_ERROR
         else:
             info.downloaded = dl.DownloadErrorCode.DOWNLOADED
             info.id_in_db = file_info_id_in_db
 
-            if info.is_audio:
+            # NOTE: a hardlinked file shares its tags with the file it was linked to
+            if info.is_audio and dedup_action != "hardlink":
                 try:
                     update_meta_tags(os.path.join(
                         mypath, filename), info, top_collection)
@@ -444,9 +822,73 @@ class GWARipper:
                                    os.path.join(mypath, filename))
 
             return subpath
+        finally:
+            with self._filename_lock:
+                self._reserved_paths.discard(reserved_path)
 
         return None
 
+    def _dedup_content(self, info: FileInfo, path: str) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Looks for a previously downloaded file with the same content (SHA-256 and size)
+        as the newly downloaded file at path and depending on the setting
+        `content_duplicates` replaces the new file with a hardlink to it or removes it
+        Needs to be called with the _db_lock held
+
+        :return: Tuple of "hardlink" or "skip" if a duplicate was found and the action
+                 succeeded, None otherwise, and the id of the duplicate's row in the DB
+        """
+        action = config.config.get("Settings", "content_duplicates", fallback="hardlink")
+        if action not in ("hardlink", "skip") or not info.file_size or info.sha256 is None:
+            return None, None
+
+        key = (info.sha256, info.file_size)
+        existing: Optional[str] = None
+        existing_id: Optional[int] = None
+        if key in self._content_paths:
+            existing, existing_id = self._content_paths[key]
+        if existing is None or not os.path.isfile(existing):
+            existing = None
+            for row in find_content_duplicates(self.db_con, *key):
+                candidate = audio_file_path(config.get_root(), row)
+                if os.path.isfile(candidate):
+                    existing, existing_id = candidate, row["id"]
+                    break
+        if existing is None:
+            return None, None
+
+        if action == "skip":
+            os.remove(path)
+            logger.info("Same content was already downloaded to %s, removed %s",
+                        existing, path)
+            return action, existing_id
+
+        link_path = f"{path}.link"
+        try:
+            os.link(existing, link_path)
+            os.replace(link_path, path)
+        except OSError as err:
+            # e.g. different file systems or not supported by the file system
+            logger.warning("Could not hardlink %s to %s, keeping the copy: %s",
+                           path, existing, err)
+            if os.path.exists(link_path):
+                os.remove(link_path)
+            return None, existing_id
+        logger.info("Same content was already downloaded to %s, replaced %s with a hardlink",
+                    existing, path)
+        return action, existing_id
+
+    @staticmethod
+    def _extractor_host(info: FileInfo) -> Optional[str]:
+        # NOTE: extractor might not be set on manually created FileInfos
+        return (info.extractor.rate_limit_key()
+                if hasattr(info.extractor, "rate_limit_key") else None)
+
+    def _rate_limit_hook(self, info: FileInfo) -> Callable[[], Any]:
+        """:return: Function that takes a token of the file host's rate limit"""
+        return functools.partial(extr.base.get_rate_limiter().acquire,
+                                 self._extractor_host(info))
+
     def _download_file_http(self, info: FileInfo, mypath: str, filename: str):
         # TODO retries etc. or use requests lib?
         # func passed as kwarg reporthook gets called once on establishment
@@ -454,15 +896,36 @@ class GWARipper:
         # The hook will be passed three arguments; a count of blocks transferred
         # so far, a block size in bytes, and the total size of the file
         # total size is -1 if unknown
-        dl.download_in_chunks(info.direct_url,
-                              os.path.abspath(os.path.join(mypath, filename)),
-                              prog_bar=True,
-                              headers=info.additional_headers)
+        # NOTE: progress bars of concurrent downloads would just garble stdout
+        # content is hashed while it's being downloaded
+        digest = dl.ContentDigest()
+        before_request = self._rate_limit_hook(info)
+        connections = config.get_segmented_connections(self._extractor_host(info))
+        if connections > 1:
+            dl.download_segmented(
+                info.direct_url, os.path.abspath(os.path.join(mypath, filename)),
+                connections, prog_bar=self.max_workers == 1,
+                headers=info.additional_headers,
+                min_size=int(config.config.getfloat(
+                    "Settings", "segmented_min_size_mb", fallback=16) * 1024**2),
+                digest=digest, before_request=before_request)
+        else:
+            dl.download_in_chunks(info.direct_url,
+                                  os.path.abspath(os.path.join(mypath, filename)),
+                                  prog_bar=self.max_workers == 1,
+                                  headers=info.additional_headers,
+                                  digest=digest, before_request=before_request)
+        info.sha256, info.file_size = digest.hexdigest(), digest.size
 
     def _download_file_hls(self, info: FileInfo, mypath: str, filename: str):
-
-        if not dl.download_hls_ffmpeg(info.direct_url, os.path.abspath(os.path.join(mypath, filename))):
+        path = os.path.abspath(os.path.join(mypath, filename))
+        if not dl.download_hls_ffmpeg(info.direct_url, path,
+                                      show_progress=self.max_workers == 1,
+                                      before_request=self._rate_limit_hook(info)):
             raise exceptions.ExternalError("FFmpeg concatenation failed!")
+        # NOTE: ffmpeg remuxes the segments so only the output file can be hashed
+        digest = dl.hash_file(path)
+        info.sha256, info.file_size = digest.hexdigest(), digest.size
 
     def _download_collection(self, info: FileCollection, top_collection: Optional[FileCollection],
                              dl_idx: int = 1) -> DownloadCollectionResult:
@@ -524,8 +987,9 @@ class GWARipper:
         # only file collections containing audio files get added to db
         if any_audio_downloads:
             if isinstance(info, RedditInfo):
-                with self.db_con:
+                with self._db_lock, self.db_con:
                     self._add_to_db_ri(cast(RedditInfo, info))
+                self.known_urls.add(extr.canonical_url(info.full_url))
 
                 subpath = top_collection.subpath if top_collection is not None else ""
                 # :PassSubpathSelftext
@@ -533,8 +997,9 @@ class GWARipper:
                     cast(RedditInfo, info).write_selftext_file(
                         config.get_root(), os.path.join(author_name, subpath))
             else:
-                with self.db_con:
+                with self._db_lock, self.db_con:
                     self._add_to_db_collection(info, author_name)
+                self.known_urls.add(extr.canonical_url(info.full_url))
 
         return DownloadCollectionResult(any_audio_downloads, dl_idx, download_err_code)
 
@@ -554,7 +1019,7 @@ class GWARipper:
     def _add_to_db_collection(self, file_col: FileCollection, author: str) -> Tuple[str, bool]:
         """
         Add FileCollection to DB; will return a pre-existing FileCollection if
-        the url column matches file_col.full_url
+        the url_key column matches the canonical url of file_col.full_url
         :return: Tuple of the alias name of the author
                  that was assigned to this collection and whether FileCollection
                  was found in the DB
@@ -572,7 +1037,7 @@ class GWARipper:
         SELECT FileCollection.id as collection_id , Alias.name as alias_name
         FROM FileCollection
         JOIN Alias ON Alias.id = FileCollection.alias_id
-        WHERE url = ?""", (file_col.full_url,)).fetchone()
+        WHERE url_key = ?""", (extr.canonical_url(file_col.full_url),)).fetchone()
 
         # FileCollection already in DB -> just return id and artist/alias
         if existing_collection:
@@ -583,6 +1048,7 @@ class GWARipper:
 
         filecol_dict: Dict[str, Optional[Union[str, int]]] = {
             "url": file_col.full_url,
+            "url_key": extr.canonical_url(file_col.full_url),
             "id_on_page": file_col.id,
             "title": file_col.title,
             "subpath": file_col.subpath,
@@ -593,10 +1059,10 @@ class GWARipper:
         c.execute("""
         INSERT INTO FileCollection(
             url, id_on_page, title, subpath, parent_id,
-            alias_id
+            alias_id, url_key
         ) VALUES (
             :url, :id_on_page, :title, :subpath, :parent_id,
-            (SELECT id FROM Alias WHERE name = :alias_name)
+            (SELECT id FROM Alias WHERE name = :alias_name), :url_key
         )""", filecol_dict)
         file_col.id_in_db = c.lastrowid
 
@@ -613,8 +1079,11 @@ class GWARipper:
                 # bool and DownloadErrorCode (fi.downloaded is True)
                 # needs --strict-equality to detect it
                 if fi.is_audio and fi.downloaded is dl.DownloadErrorCode.DOWNLOADED:
-                    c.execute("UPDATE AudioFile SET collection_id = ? WHERE id = ?",
-                              (file_col.id_in_db, fi.id_in_db))
+                    c.executemany("UPDATE AudioFile SET collection_id = ? WHERE id = ?",
+                                  [(file_col.id_in_db, audio_id) for audio_id in [
+                                      fi.id_in_db,
+                                      *self._content_duplicate_ids.get(
+                                          cast(int, fi.id_in_db), ())]])
 
         return author, False
     
@@ -701,31 +1170,75 @@ class GWARipper:
             "filename": filename,
             "title": info.title,
             "url": info.page_url,
-            "alias_name": info.author
+            "alias_name": info.author,
+            "sha256": info.sha256,
+            "file_size": info.file_size,
+            "url_key": extr.canonical_url(info.page_url),
         }
 
         c.execute("""
         INSERT INTO AudioFile(
             collection_id, date, description,
             filename, title, url,
-            alias_id
+            alias_id, sha256, file_size, url_key
         ) VALUES (
             :collection_id, :date, :description,
             :filename, :title, :url,
-            (SELECT id FROM Alias WHERE name = :alias_name)
+            (SELECT id FROM Alias WHERE name = :alias_name),
+            :sha256, :file_size, :url_key
         )""", audio_file_dict)
 
         return cast(int, c.lastrowid)
 
+    def _add_to_db_content_duplicate(self, info: FileInfo, existing_id: int) -> int:
+        """
+        Adds a row for a file that was not kept since the file of the row existing_id
+        has the same content, so the url is known in later runs and the file isn't
+        downloaded again
+        The row has its own url, title and description but uses the filename, collection
+        and alias of the existing row, so it points to the existing file
+        DOESN'T COMMIT the transaction
+        """
+        c = self.db_con.execute("""
+        INSERT INTO AudioFile(
+            collection_id, date, description,
+            filename, title, url,
+            alias_id, sha256, file_size, url_key
+        )
+        SELECT
+            collection_id, ?, ?,
+            filename, ?, ?,
+            alias_id, sha256, file_size, ?
+        FROM AudioFile WHERE id = ?""", (
+            datetime.datetime.now().date(), info.descr, info.title, info.page_url,
+            extr.canonical_url(info.page_url), existing_id))
+
+        return cast(int, c.lastrowid)
+
+    def is_known_url(self, url: str) -> bool:
+        """:return: True if a file with the page url url is in the DB"""
+        key = extr.canonical_url(url)
+        if not self.known_urls.might_contain(key):
+            return False
+        with self._db_lock:
+            return self.db_con.execute(
+                "SELECT 1 FROM AudioFile WHERE url_key = ?", (key,)).fetchone() is not None
+
     def already_downloaded(self, info: FileInfo) -> bool:
         """
-        Checks by querying for info.page_url and info.direct_url in DB if a file
-        was downloaded before
+        Checks by querying for the canonical urls of info.page_url and
+        info.direct_url in DB if a file was downloaded before
         """
+        keys = tuple(extr.canonical_url(url) if url else None
+                     for url in (info.page_url, info.direct_url))
+        if not (self.known_urls.might_contain(keys[0]) or
+                self.known_urls.might_contain(keys[1])):
+            return False
         # check both url and url_file since some rows only have the url_file set
-        c = self.db_con.execute("SELECT id, collection_id FROM AudioFile WHERE url = ?"
-                                "OR url = ?", (info.page_url, info.direct_url))
-        duplicate = c.fetchone()
+        with self._db_lock:
+            c = self.db_con.execute("SELECT id, collection_id FROM AudioFile WHERE url_key = ? "
+                                    "OR url_key = ?", keys)
+            duplicate = c.fetchone()
 
         if (info.reddit_info and duplicate and not duplicate['collection_id'] and
                 config.config.getboolean("Settings", "set_missing_reddit", fallback=False)):
@@ -757,8 +1270,10 @@ class GWARipper:
         if own_index != 0:
             return
 
-        with self.db_con:
+        with self._db_lock, self.db_con:
             collection_id, reddit_author = self._add_to_db_ri(info.reddit_info)
+            # NOTE: before the commit, but a false positive only costs a query
+            self.known_urls.add(extr.canonical_url(info.reddit_info.full_url))
 
             c = self.db_con.execute("""
             UPDATE AudioFile SET
@@ -0,0 +1,80 @@
+import re
+import html
+import logging
+
+from typing import Optional, List, Tuple, Pattern
+
+import bs4
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# NOTE: full documents are parsed with bs4 using the fastest tree builder that is
+# installed (lxml if available, otherwise the built-in html.parser), which can be
+# forced using the html_parser setting
+# extractors that only need a few fields use regex fast paths instead, which
+# return None if the markup doesn't look as expected, so the caller can fall
+# back to the bs4 version
+
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    LXML_AVAILABLE = False
+else:
+    LXML_AVAILABLE = True
+
+PARSERS = ("lxml", "html.parser")
+
+
+def get_parser() -> str:
+    """:return: Name of the bs4 tree builder to use"""
+    parser = config.config.get("Settings", "html_parser", fallback="auto").strip().lower()
+    if parser == "auto":
+        return "lxml" if LXML_AVAILABLE else "html.parser"
+    if parser not in PARSERS or (parser == "lxml" and not LXML_AVAILABLE):
+        logger.warning("HTML parser '%s' is not available, using html.parser", parser)
+        return "html.parser"
+    return parser
+
+
+def make_soup(markup: str, parser: Optional[str] = None) -> bs4.BeautifulSoup:
+    return bs4.BeautifulSoup(markup, parser or get_parser())
+
+
+TAG_RE: Pattern = re.compile(r"<[^>]*>")
+ANCHOR_RE: Pattern = re.compile(
+    r"<a\s[^>]*?\bhref\s*=\s*(?:\"([^\"]*)\"|'([^']*)')[^>]*>(.*?)</a\s*>",
+    re.IGNORECASE | re.DOTALL)
+
+
+def text_content(fragment: str) -> str:
+    """Same as the .text of a bs4 tag for the markup inside of it"""
+    return html.unescape(TAG_RE.sub("", fragment))
+
+
+def count_tags_with_class(markup: str, tag: str, class_name: str) -> int:
+    """
+    :return: Number of opening tags in markup that have class_name in their
+             double-quoted class attribute, used to validate the fast paths
+    """
+    return len(re.findall(
+        rf'<{tag}\s[^>]*?\bclass="(?:[^"]*\s)?{re.escape(class_name)}(?:\s[^"]*)?"',
+        markup, re.IGNORECASE))
+
+
+def find_links(markup: str) -> Optional[List[Tuple[str, str]]]:
+    """
+    Fast path of soup.select('a[href]')
+
+    :return: List of (href, text) tuples or None if the markup contains anchors
+             that couldn't be matched e.g. due to malformed html
+    """
+    links = [(html.unescape(m.group(1) if m.group(1) is not None else m.group(2)),
+              text_content(m.group(3)))
+             for m in ANCHOR_RE.finditer(markup)]
+    # NOTE: validate by comparing the number of opening tags, since a missing
+    # closing tag or an unquoted href would lead to silently skipped links
+    if len(links) != len(re.findall(r"<a\s[^>]*?\bhref\s*=", markup, re.IGNORECASE)):
+        return None
+    return links
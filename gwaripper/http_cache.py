@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+from typing import Dict, Optional, Mapping
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    def __init__(self, key: str, url: str, body: bytes, charset: Optional[str],
+                 etag: Optional[str], last_modified: Optional[str], stored_at: float):
+        self.key = key
+        self.url = url
+        self.body = body
+        self.charset = charset
+        self.etag = etag
+        self.last_modified = last_modified
+        # time the response was last received or revalidated
+        self.stored_at = stored_at
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.stored_at < ttl
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """:return: Headers for revalidating the response with a conditional GET"""
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HTTPCache:
+    """
+    On-disk cache of text responses keyed by the url and the request headers
+
+    Every entry is stored in its own file that starts with a line of JSON
+    metadata followed by the raw body. The modification time of the file is
+    used for evicting the least recently used entries once the total size
+    exceeds max_size
+
+    :param cache_dir: Directory the entries are stored in
+    :param max_size: Max. total size of all entries in bytes
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = 256 * 1024**2):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        # key -> size in least to most recently used order, built lazily
+        self._lru: Optional['OrderedDict[str, int]'] = None
+        self._total_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "evicted": self.evicted,
+            }
+
+    @staticmethod
+    def make_key(url: str, headers: Mapping[str, str]) -> str:
+        h = hashlib.sha256(url.encode("utf-8"))
+        for name, value in sorted((k.lower(), v) for k, v in headers.items()):
+            h.update(f"\n{name}: {value}".encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _load_index(self) -> 'OrderedDict[str, int]':
+        # NOTE: needs to be called with the lock held
+        if self._lru is None:
+            entries = []
+            if os.path.isdir(self.cache_dir):
+                with os.scandir(self.cache_dir) as it:
+                    for entry in it:
+                        if entry.is_file() and not entry.name.endswith(".tmp"):
+                            st = entry.stat()
+                            entries.append((st.st_mtime, entry.name, st.st_size))
+            entries.sort()
+            self._lru = OrderedDict((name, size) for _, name, size in entries)
+            self._total_size = sum(self._lru.values())
+        return self._lru
+
+    def _forget(self, key: str) -> None:
+        # NOTE: needs to be called with the lock held
+        lru = self._load_index()
+        size = lru.pop(key, None)
+        if size is not None:
+            self._total_size -= size
+
+    def lookup(self, url: str, headers: Mapping[str, str]) -> Optional[CachedResponse]:
+        key = self.make_key(url, headers)
+        try:
+            with open(self._path(key), "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning("Removing unreadable cache entry for %s", url)
+            with self._lock:
+                self._forget(key)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return None
+
+        return CachedResponse(key, url, body, meta["charset"], meta["etag"],
+                              meta["last_modified"], meta["stored_at"])
+
+    def mark_used(self, entry: CachedResponse, revalidated: bool = False) -> None:
+        """Records a response that was served from the cache"""
+        with self._lock:
+            lru = self._load_index()
+            if entry.key in lru:
+                lru.move_to_end(entry.key)
+            if revalidated:
+                self.revalidated += 1
+            else:
+                self.hits += 1
+        try:
+            os.utime(self._path(entry.key))
+        except OSError:
+            pass
+
+    def mark_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def store(self, url: str, headers: Mapping[str, str], body: bytes,
+              charset: Optional[str], etag: Optional[str],
+              last_modified: Optional[str]) -> CachedResponse:
+        entry = CachedResponse(self.make_key(url, headers), url, body, charset, etag,
+                               last_modified, time.time())
+        meta = json.dumps({
+            "url": url,
+            "charset": charset,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": entry.stored_at,
+        }).encode("utf-8")
+
+        path = self._path(entry.key)
+        # write to a temp file first, so concurrent lookups never see a partial entry
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(meta)
+            f.write(b"\n")
+            f.write(body)
+        os.replace(tmp_path, path)
+        size = len(meta) + 1 + len(body)
+
+        with self._lock:
+            self._forget(entry.key)
+            lru = self._load_index()
+            lru[entry.key] = size
+            self._total_size += size
+            evict = []
+            # always keep the entry that was just stored
+            while self._total_size > self.max_size and len(lru) > 1:
+                key, old_size = lru.popitem(last=False)
+                self._total_size -= old_size
+                evict.append(key)
+            self.evicted += len(evict)
+
+        for key in evict:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            lru = self._load_index()
+            keys = list(lru)
+            lru.clear()
+            self._total_size = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+_cache: Optional[HTTPCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[HTTPCache]:
+    """
+    Returns the HTTPCache in `<root>/_cache` that is shared by all extractors or
+    None if caching is disabled (the default) or no root path is set
+    """
+    global _cache
+    if not config.config.getboolean("Settings", "http_cache", fallback=False):
+        return None
+    try:
+        cache_dir = os.path.join(config.get_root(), "_cache")
+    except KeyError:
+        return None
+    with _cache_lock:
+        # re-created if the root path changed
+        if _cache is None or _cache.cache_dir != cache_dir:
+            _cache = HTTPCache(
+                cache_dir,
+                max_size=int(config.config.getfloat(
+                    "Settings", "http_cache_max_size_mb", fallback=256) * 1024**2))
+        return _cache
@@ -0,0 +1,242 @@
+import socket
+import threading
+import logging
+import functools
+import http.client
+import urllib.request
+import urllib.error
+
+from typing import Dict, List, Optional, Type, Callable, Union, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledResponse(http.client.HTTPResponse):
+    """
+    HTTPResponse that hands its connection back to the pool once the body was
+    read completely
+    """
+
+    _release: Optional[Callable[[bool], None]] = None
+    _discard: bool = False
+
+    def close(self):
+        # closed before the body was read completely -> there is still unread
+        # data on the socket so the connection can't be re-used
+        if self.fp is not None and self.length != 0:
+            self._discard = True
+        super().close()
+
+    def _close_conn(self):
+        super()._close_conn()
+        release, self._release = self._release, None
+        if release is not None:
+            release(not self.will_close and not self._discard)
+
+
+class ConnectionPool:
+    """
+    Keeps idle keep-alive connections per (scheme, host) around so they can be
+    re-used by later requests to the same host
+
+    Connections are only handed to one request at a time, so the pool can be
+    shared between threads
+
+    :param max_idle_per_host: Max amount of idle connections to keep per host
+    """
+
+    def __init__(self, max_idle_per_host: int = 4):
+        self.max_idle_per_host = max_idle_per_host
+        self._idle: Dict[Hashable, List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": self.connections_reused,
+            }
+
+    def _acquire(self, key: Hashable) -> Optional[http.client.HTTPConnection]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _release(self, key: Hashable, conn: http.client.HTTPConnection,
+                 reusable: bool) -> None:
+        if reusable:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle_per_host:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def clear(self) -> None:
+        """Closes all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    @staticmethod
+    def _is_stale(conn: http.client.HTTPConnection, reused: bool,
+                  req: urllib.request.Request, err: OSError) -> bool:
+        # the server might have closed the idle connection in the meantime
+        # -> retry requests without a body once using a fresh connection
+        if reused and req.data is None and isinstance(err, ConnectionError):
+            conn.close()
+            logger.debug("Idle connection to %s was closed, reconnecting", req.host)
+            return True
+        return False
+
+    def open(self, http_class: Type[http.client.HTTPConnection],
+             req: urllib.request.Request, **http_conn_args) -> http.client.HTTPResponse:
+        """
+        Same as urllib.request.AbstractHTTPHandler.do_open, but re-uses idle
+        connections and doesn't force `Connection: close`
+        """
+        host = req.host
+        if not host:
+            raise urllib.error.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items()
+                        if k not in headers})
+        headers = {name.title(): val for name, val in headers.items()}
+
+        tunnel_headers = {}
+        if req._tunnel_host:
+            proxy_auth_hdr = "Proxy-Authorization"
+            if proxy_auth_hdr in headers:
+                tunnel_headers[proxy_auth_hdr] = headers[proxy_auth_hdr]
+                # Proxy-Authorization should not be sent to origin server
+                del headers[proxy_auth_hdr]
+
+        # timeout can also be a (connect, read) tuple
+        if isinstance(req.timeout, tuple):
+            connect_timeout, read_timeout = req.timeout
+        else:
+            connect_timeout = read_timeout = req.timeout
+        if read_timeout is socket._GLOBAL_DEFAULT_TIMEOUT:  # type: ignore
+            read_timeout = socket.getdefaulttimeout()
+
+        key = (http_class, host, req._tunnel_host)
+        while True:
+            conn = self._acquire(key)
+            reused = conn is not None
+            if conn is None:
+                conn = http_class(host, timeout=connect_timeout, **http_conn_args)
+                conn.response_class = _PooledResponse
+                if req._tunnel_host:
+                    conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+
+            try:
+                try:
+                    if conn.sock is None:
+                        conn.connect()
+                    # connect timeout only applies to establishing the connection
+                    conn.timeout = read_timeout
+                    conn.sock.settimeout(read_timeout)
+                    conn.request(req.get_method(), req.selector, req.data, headers,
+                                 encode_chunked=req.has_header('Transfer-encoding'))
+                except OSError as err:  # e.g. connect timeout
+                    if self._is_stale(conn, reused, req, err):
+                        continue
+                    raise urllib.error.URLError(err)
+                # NOTE: same as urllib: errors while waiting for the response e.g.
+                # read timeouts are not wrapped in URLError
+                try:
+                    r = conn.getresponse()
+                except OSError as err:
+                    if self._is_stale(conn, reused, req, err):
+                        continue
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+            break
+
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.connections_reused += 1
+            else:
+                self.connections_opened += 1
+
+        if not r.will_close:
+            r._release = functools.partial(self._release, key, conn)
+
+        r.url = req.get_full_url()
+        # urllib clients expect the reason in .msg
+        r.msg = r.reason
+        return r
+
+
+class KeepAliveHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, pool: ConnectionPool, debuglevel: int = 0):
+        super().__init__(debuglevel=debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self.pool.open(http.client.HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, pool: ConnectionPool, debuglevel: int = 0, context=None):
+        super().__init__(debuglevel=debuglevel, context=context)
+        self.pool = pool
+        self.ssl_context = context
+
+    def https_open(self, req):
+        return self.pool.open(http.client.HTTPSConnection, req, context=self.ssl_context)
+
+
+class Session:
+    """
+    Drop-in for urllib.request.urlopen that keeps connections alive between
+    requests to the same host
+    """
+
+    def __init__(self, max_idle_per_host: int = 4):
+        self.pool = ConnectionPool(max_idle_per_host=max_idle_per_host)
+        self._opener = urllib.request.build_opener(
+            KeepAliveHTTPHandler(self.pool), KeepAliveHTTPSHandler(self.pool))
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return self.pool.stats
+
+    def urlopen(self, url: Union[str, urllib.request.Request], data: Optional[bytes] = None,
+                timeout: Optional[float] = socket._GLOBAL_DEFAULT_TIMEOUT):  # type: ignore
+        return self._opener.open(url, data, timeout)
+
+    def close(self) -> None:
+        self.pool.clear()
+
+
+_session: Optional[Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> Session:
+    """Returns the Session that is shared by all extractors and downloaders"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+        return _session
+
+
+def urlopen(url: Union[str, urllib.request.Request], data: Optional[bytes] = None,
+            timeout: Optional[float] = socket._GLOBAL_DEFAULT_TIMEOUT):  # type: ignore
+    """urllib.request.urlopen using the shared Session"""
+    return get_session().urlopen(url, data, timeout)
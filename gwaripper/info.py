@@ -1,4 +1,5 @@
 import os
+import copy
 import logging
 import re
 
@@ -278,6 +279,9 @@ class FileInfo:
         self.download_type = download_type
         self.report: Optional[ExtractorReport] = None
         self.additional_headers = {}
+        # NOTE: set once the file was downloaded
+        self.sha256: Optional[str] = None
+        self.file_size: Optional[int] = None
 
     def __str__(self):
         return f"FileInfo<{self.page_url}>"
@@ -308,6 +312,22 @@ class FileInfo:
                 self.reddit_info = parent
             parent = parent.parent
 
+    def clone(self) -> 'FileInfo':
+        """
+        :return: Copy of the extracted information that isn't attached to a parent
+                 and doesn't have any of the download state of this FileInfo
+        """
+        fi = copy.copy(self)
+        fi._parent = None
+        fi.reddit_info = None
+        fi._downloaded = DownloadErrorCode.NOT_DOWNLOADED
+        fi.id_in_db = None
+        fi.report = None
+        fi.additional_headers = dict(self.additional_headers)
+        fi.sha256 = None
+        fi.file_size = None
+        return fi
+
     def get_topmost_parent(self) -> Optional['FileCollection']:
         if not self.parent:
             return None
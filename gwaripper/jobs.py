@@ -0,0 +1,119 @@
+import time
+import sqlite3
+import logging
+import threading
+
+from enum import Enum, unique
+from typing import Dict, List, Set, Iterable, ContextManager
+
+logger = logging.getLogger(__name__)
+
+
+@unique
+class JobState(Enum):
+    QUEUED = "queued"
+    EXTRACTING = "extracting"
+    EXTRACTED = "extracted"
+    DOWNLOADING = "downloading"
+    DONE = "done"
+    FAILED = "failed"
+
+
+UNFINISHED_STATES = (JobState.QUEUED, JobState.EXTRACTING, JobState.EXTRACTED,
+                     JobState.DOWNLOADING)
+
+
+class JobJournal:
+    """
+    Records the state of every URL of a run in the Job table, so an interrupted
+    run can be resumed later on
+
+    Only the queued jobs are written immediately, all other state changes are
+    buffered and written in a single transaction once batch_size changes
+    accumulated or flush_interval seconds passed. Losing the buffered changes
+    on a crash is fine, since jobs just get resumed from an earlier state and
+    already downloaded files are skipped
+
+    :param db_con: Connection to the gwaripper DB
+    :param db_lock: Lock that has to be held while using db_con, since it
+                    might be shared with other threads
+    """
+
+    def __init__(self, db_con: sqlite3.Connection, db_lock: ContextManager,
+                 batch_size: int = 50, flush_interval: float = 5.0):
+        self.db_con = db_con
+        self.db_lock = db_lock
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # urls of jobs that were added by this journal
+        self._urls: Set[str] = set()
+        self._pending: Dict[str, JobState] = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, urls: Iterable[str]) -> None:
+        """Adds the urls as queued jobs replacing previous jobs with the same url"""
+        now = time.time()
+        rows = [(url, JobState.QUEUED.value, now) for url in urls]
+        with self.db_lock, self.db_con:
+            self.db_con.executemany(
+                "INSERT OR REPLACE INTO Job(url, state, updated) VALUES (?, ?, ?)", rows)
+        with self._lock:
+            self._urls.update(url for url, _, _ in rows)
+
+    def set_state(self, url: str, state: JobState) -> None:
+        """Buffers the state change of the job; urls that weren't added are ignored"""
+        with self._lock:
+            if url not in self._urls:
+                return
+            self._pending[url] = state
+            if (len(self._pending) < self.batch_size and
+                    time.monotonic() - self._last_flush < self.flush_interval):
+                return
+        self.flush()
+
+    def flush(self) -> None:
+        """Writes all buffered state changes to the DB"""
+        # NOTE: holding db_lock the whole time, so concurrent flushes can't
+        # write the state changes out of order
+        with self.db_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+            if not pending:
+                return
+
+            now = time.time()
+            with self.db_con:
+                self.db_con.executemany(
+                    "UPDATE Job SET state = ?, updated = ? WHERE url = ?",
+                    [(state.value, now, url) for url, state in pending.items()])
+
+    def clear_done(self) -> None:
+        """Removes all finished jobs that didn't fail"""
+        self.flush()
+        with self.db_lock, self.db_con:
+            self.db_con.execute("DELETE FROM Job WHERE state = ?", (JobState.DONE.value,))
+
+
+def get_resumable_urls(db_con: sqlite3.Connection, include_failed: bool = False) -> List[str]:
+    """
+    Returns the urls of all jobs that weren't finished in the order they were added
+
+    :param include_failed: Also include jobs that failed
+    """
+    states = [s.value for s in UNFINISHED_STATES]
+    if include_failed:
+        states.append(JobState.FAILED.value)
+    c = db_con.execute(
+        f"SELECT url FROM Job WHERE state IN ({', '.join('?' * len(states))}) ORDER BY id",
+        states)
+    return [row[0] for row in c.fetchall()]
+
+
+def count_jobs(db_con: sqlite3.Connection) -> Dict[JobState, int]:
+    c = db_con.execute("SELECT state, COUNT(*) FROM Job GROUP BY state")
+    counts = {state: 0 for state in JobState}
+    for state, count in c.fetchall():
+        counts[JobState(state)] = count
+    return counts
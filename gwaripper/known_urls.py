@@ -0,0 +1,74 @@
+import sys
+import time
+import bisect
+import sqlite3
+import threading
+
+from array import array
+from operator import itemgetter
+from typing import Iterable, Optional
+
+
+class KnownUrlIndex:
+    """
+    Compact in-memory index of the url keys (see extractors.canonical_url) of all
+    AudioFile and FileCollection rows, so checking whether an url was downloaded
+    before doesn't need a query in the common case that it wasn't
+
+    Stores the 64-bit hashes of the keys in a sorted array (8 bytes per key
+    instead of ~100 for a set of str), so a hit only means the key *might* be
+    in the DB and has to be confirmed with a query, while a miss is certain
+
+    NOTE: hash() of str is randomized per process, which is fine since the
+    index is re-built for every run
+    """
+
+    def __init__(self, keys: Iterable[str] = ()):
+        self._lock = threading.Lock()
+        # NOTE: duplicates don't need to be removed, they don't change the lookups
+        self._hashes = array("q", sorted(map(hash, keys)))
+        # seconds it took to load the index from the DB
+        self.load_time = 0.0
+        self.lookups = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, db_con: sqlite3.Connection) -> 'KnownUrlIndex':
+        started = time.perf_counter()
+        # NOTE: plain tuples are a lot faster to create than sqlite3.Row and the
+        # cursor is consumed lazily, so the rows are never all in memory
+        cursor = db_con.cursor()
+        cursor.row_factory = None
+        index = cls(map(itemgetter(0), cursor.execute(
+            "SELECT url_key FROM AudioFile UNION ALL SELECT url_key FROM FileCollection")))
+        index.load_time = time.perf_counter() - started
+        return index
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    @property
+    def memory_usage(self) -> int:
+        """:return: Size of the index in bytes"""
+        return sys.getsizeof(self._hashes)
+
+    def add(self, key: str) -> None:
+        """Adds the url key once its row was committed to the DB"""
+        key_hash = hash(key)
+        with self._lock:
+            idx = bisect.bisect_left(self._hashes, key_hash)
+            if idx == len(self._hashes) or self._hashes[idx] != key_hash:
+                self._hashes.insert(idx, key_hash)
+
+    def might_contain(self, key: Optional[str]) -> bool:
+        """:return: False if the url key is definitely not in the DB"""
+        if key is None:
+            return False
+        key_hash = hash(key)
+        with self._lock:
+            idx = bisect.bisect_left(self._hashes, key_hash)
+            found = idx < len(self._hashes) and self._hashes[idx] == key_hash
+            self.lookups += 1
+            if not found:
+                self.misses += 1
+        return found
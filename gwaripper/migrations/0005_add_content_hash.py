@@ -0,0 +1,16 @@
+import sqlite3
+
+date = '2026-10-17'
+
+
+def upgrade(db_con):
+    rf = db_con.row_factory
+    db_con.row_factory = sqlite3.Row
+    c = db_con.cursor()
+    db_con.row_factory = rf
+
+    # NOTE: hashes of already downloaded files can be filled in using
+    # the backfill-hashes command
+    c.execute("ALTER TABLE AudioFile ADD COLUMN sha256 TEXT")
+    c.execute("ALTER TABLE AudioFile ADD COLUMN file_size INTEGER")
+    c.execute("CREATE INDEX audio_file_sha256_idx ON AudioFile(sha256)")
@@ -0,0 +1,21 @@
+import sqlite3
+
+date = '2026-10-17'
+
+
+def upgrade(db_con):
+    rf = db_con.row_factory
+    db_con.row_factory = sqlite3.Row
+    c = db_con.cursor()
+    db_con.row_factory = rf
+
+    c.execute("""
+        CREATE TABLE Job(
+            id INTEGER PRIMARY KEY ASC,
+            url TEXT UNIQUE NOT NULL,
+            -- one of: queued, extracting, extracted, downloading, done, failed
+            state TEXT NOT NULL,
+            -- unix timestamp of the last state change
+            updated REAL NOT NULL
+        )""")
+    c.execute("CREATE INDEX job_state_idx ON Job(state)")
@@ -0,0 +1,22 @@
+import sqlite3
+
+date = '2026-10-17'
+
+
+def upgrade(db_con):
+    rf = db_con.row_factory
+    db_con.row_factory = sqlite3.Row
+    c = db_con.cursor()
+    db_con.row_factory = rf
+
+    c.execute("""
+        CREATE TABLE SyncWatermark(
+            id INTEGER PRIMARY KEY ASC,
+            -- e.g. subreddit:gonewildaudio, redditor:name or search:subreddit:query
+            source TEXT UNIQUE NOT NULL,
+            -- created_utc and id of the newest submission that was seen
+            created_utc REAL NOT NULL,
+            reddit_id TEXT,
+            -- unix timestamp of the run that set the watermark
+            updated REAL NOT NULL
+        )""")
@@ -0,0 +1,33 @@
+import sqlite3
+import logging
+
+from ..extractors import canonical_url
+
+date = '2026-10-17'
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade(db_con):
+    rf = db_con.row_factory
+    db_con.row_factory = sqlite3.Row
+    c = db_con.cursor()
+    db_con.row_factory = rf
+
+    # normalized url that's used for finding duplicates, see extractors.canonical_url
+    # NOTE: not UNIQUE since there might already be rows that only differ in how
+    # their urls were spelled
+    for table in ("AudioFile", "FileCollection"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN url_key TEXT")
+        rows = c.execute(f"SELECT id, url FROM {table}").fetchall()
+        c.executemany(f"UPDATE {table} SET url_key = ? WHERE id = ?",
+                      ((canonical_url(row['url']), row['id']) for row in rows))
+
+        nr_dupes = c.execute(f"""
+            SELECT COUNT(*) - COUNT(DISTINCT url_key) FROM {table}""").fetchone()[0]
+        if nr_dupes:
+            logger.warning("Found %d rows in %s whose url only differs in its spelling "
+                           "from the one of another row", nr_dupes, table)
+
+    c.execute("CREATE INDEX audio_file_url_key_idx ON AudioFile(url_key)")
+    c.execute("CREATE INDEX file_collection_url_key_idx ON FileCollection(url_key)")
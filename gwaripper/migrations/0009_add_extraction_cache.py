@@ -0,0 +1,21 @@
+import sqlite3
+
+date = '2026-10-17'
+
+
+def upgrade(db_con):
+    rf = db_con.row_factory
+    db_con.row_factory = sqlite3.Row
+    c = db_con.cursor()
+    db_con.row_factory = rf
+
+    c.execute("""
+        CREATE TABLE ExtractionCache(
+            id INTEGER PRIMARY KEY ASC,
+            -- canonical url, see extractors.canonical_url
+            url_key TEXT UNIQUE NOT NULL,
+            -- JSON of the fields of the extracted FileInfo
+            data TEXT NOT NULL,
+            -- unix timestamp of when the url was extracted
+            stored REAL NOT NULL
+        )""")
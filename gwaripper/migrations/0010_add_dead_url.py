@@ -0,0 +1,24 @@
+import sqlite3
+
+date = '2026-10-17'
+
+
+def upgrade(db_con):
+    rf = db_con.row_factory
+    db_con.row_factory = sqlite3.Row
+    c = db_con.cursor()
+    db_con.row_factory = rf
+
+    c.execute("""
+        CREATE TABLE DeadUrl(
+            id INTEGER PRIMARY KEY ASC,
+            -- canonical url, see extractors.canonical_url
+            url_key TEXT UNIQUE NOT NULL,
+            -- status code of the last check, e.g. 404 or 410
+            http_code INTEGER NOT NULL,
+            -- unix timestamps
+            first_seen REAL NOT NULL,
+            last_checked REAL NOT NULL,
+            -- failed checks so far, the interval between re-checks doubles every time
+            nr_checks INTEGER NOT NULL DEFAULT 1
+        )""")
@@ -1,11 +1,14 @@
+import time
 import logging
+import threading
 
 import praw
 
-from typing import Optional, List, Iterator
+from typing import Optional, Iterator, Iterable, Dict
 
 from .config import config
 from .exceptions import NoAuthenticationError
+from .sync import ListingSync
 
 logger = logging.getLogger(__name__)
 
@@ -16,44 +19,114 @@ reddit_client_id = (reddit_client_id if
                     (reddit_client_id and not
                      reddit_client_id.startswith("to get a client id"))
                     else None)
-reddit_instance = None
+reddit_instance: Optional[praw.Reddit] = None
+_reddit_lock = threading.Lock()
+
+
+class SharedReddit(praw.Reddit):
+    """
+    praw.Reddit that can be shared by multiple threads by sending all requests
+    through prawcore's Session one at a time, since neither its Authorizer
+    (token refresh) nor its RateLimiter use any locking
+
+    Requests are paced by prawcore's RateLimiter using the x-ratelimit-* headers
+    of reddit's responses; the time it makes us wait is only recorded here
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._request_lock = threading.Lock()
+        self._request_stats: Dict[str, float] = {
+            "requests": 0,
+            "delayed": 0,
+            "total_wait": 0.0,
+        }
+
+    @property
+    def request_stats(self) -> Dict[str, float]:
+        return dict(self._request_stats)
+
+    def request(self, *args, **kwargs):
+        with self._request_lock:
+            # NOTE: needs to be read before the request, since the RateLimiter sleeps
+            # till then and updates it from the response
+            next_request = self._core._rate_limiter.next_request_timestamp
+            wait = next_request - time.time() if next_request is not None else 0
+            self._request_stats["requests"] += 1
+            if wait > 0:
+                self._request_stats["delayed"] += 1
+                self._request_stats["total_wait"] += wait
+            return super().request(*args, **kwargs)
+
+
+def create_reddit(**settings) -> praw.Reddit:
+    """
+    Creates a read-only SharedReddit
+
+    :param settings: Passed to praw.Reddit, overriding the settings from the config
+    """
+    if reddit_client_id is None and "client_id" not in settings:
+        raise NoAuthenticationError("Client ID is required to access reddit: "
+                                    "https://www.reddit.com/prefs/apps/")
+    kwargs = dict(client_id=reddit_client_id,
+                  client_secret=config["Reddit"].get("CLIENT_SECRET", None),
+                  user_agent=config["Reddit"]["USER_AGENT"])
+    kwargs.update(settings)
+    reddit = SharedReddit(**kwargs)
+    reddit.read_only = True
+    return reddit
 
 
 def reddit_praw() -> praw.Reddit:
-    if reddit_instance is None:
-        if reddit_client_id is None:
-            raise NoAuthenticationError("Client ID is required to access reddit: "
-                                        "https://www.reddit.com/prefs/apps/")
-        reddit = praw.Reddit(client_id=reddit_client_id,
-                             client_secret=config["Reddit"].get("CLIENT_SECRET", None),
-                             user_agent=config["Reddit"]["USER_AGENT"])
-        reddit.read_only = True
-    else:
+    """
+    Returns the praw.Reddit instance that is shared by the whole process
+    including all worker threads, so authentication and the rate limit state
+    only exist once
+    """
+    global reddit_instance
+    with _reddit_lock:
+        if reddit_instance is None:
+            reddit_instance = create_reddit()
         return reddit_instance
-    return reddit
 
 
-def parse_subreddit(subreddit: str, sort: str, limit: int, time_filter: Optional[str] = None):
+def get_request_stats() -> Optional[Dict[str, float]]:
+    """:return: Request stats of the shared instance or None if it wasn't used"""
+    reddit = reddit_instance
+    if not isinstance(reddit, SharedReddit):
+        return None
+    return reddit.request_stats
+
+
+def parse_subreddit(subreddit: str, sort: str, limit: int, time_filter: Optional[str] = None,
+                    sync: Optional[ListingSync] = None):
     """
     Return limit number of submissions in subreddit with sorting method provided with sort
 
     :param subreddit: Name of subreddit
-    :param sort: Sorting method, only "hot" or "top"
+    :param sort: Sorting method, only "hot", "top" or "new"
     :param limit: Number of submissions to get (1000 max by reddit, 100 per request)
     :param time_filter: Time period to use, can be all, day, hour, month, week, year
-    :return: praw.ListingGenerator
+    :param sync: Only returns submissions newer than its watermark
+    :return: Generator of praw Submissions, the listing pages are only requested
+             once they're consumed
     """
     sub = reddit_praw().subreddit(subreddit)
     if sort == "hot":
-        return redirect_crossposts(sub.hot(limit=limit))
+        listing = sub.hot(limit=limit)
     elif sort == "top":
-        return redirect_crossposts(sub.top(time_filter=time_filter, limit=limit))
+        listing = sub.top(time_filter=time_filter, limit=limit)
+    elif sort == "new":
+        listing = sub.new(limit=limit)
     else:
-        logger.warning("Sort must be either 'hot' or 'top'!")
+        logger.warning("Sort must be either 'hot', 'top' or 'new'!")
+        return None
+    return redirect_crossposts(sync.filter(listing) if sync is not None else listing)
 
 
 def search_subreddit(subname: str, searchstring: str, limit: int = 100,
-                     sort: str = "top", **kwargs) -> List[praw.models.Submission]:
+                     sort: str = "top", sync: Optional[ListingSync] = None,
+                     **kwargs) -> Iterator[praw.models.Submission]:
     """
     Search subreddit(subname) with searchstring and return limit number of submission with
     sorting method = sort. Passes along kwargs to praw's search method.
@@ -62,8 +135,9 @@ def search_subreddit(subname: str, searchstring: str, limit: int = 100,
     :param searchstring: Searchstring in lucene syntax, see https://www.reddit.com/wiki/search
     :param limit: Max number of submissions to get
     :param sort: Sorting method -> relevance, hot, top, new, comments
+    :param sync: Only returns submissions newer than its watermark
     :param kwargs: Kwargs to pass along to search method of praw
-    :return: List containing found praw Submission obj
+    :return: Generator of found praw Submission obj
     """
     # sort: relevance, hot, top, new, comments (default: relevance).
     # syntax: cloudsearch, lucene, plain (default: lucene) in praw4 cloud
@@ -75,8 +149,33 @@ def search_subreddit(subname: str, searchstring: str, limit: int = 100,
             searchstring, sort=sort, limit=limit,
             syntax="lucene", params={'include_over_18': 'on'},
             **kwargs)
-    found_sub_list = redirect_crossposts(matching_sub_gen)
-    return found_sub_list
+    if sync is not None:
+        matching_sub_gen = sync.filter(matching_sub_gen)
+    return redirect_crossposts(matching_sub_gen)
+
+
+# max. number of fullnames reddit's /api/info accepts per request
+INFO_BATCH_SIZE = 100
+
+
+def fetch_submissions(ids: Iterable[str],
+                      batch_size: int = INFO_BATCH_SIZE) -> Dict[str, praw.models.Submission]:
+    """
+    Fetches the submissions with the passed base36 ids using one /api/info request
+    per batch_size submissions instead of one request per submission
+
+    :return: Dict of submission id to fetched Submission, deleted or otherwise
+             unavailable submissions are missing
+    """
+    reddit = reddit_praw()
+    # remove duplicates but keep the order
+    id_list = list(dict.fromkeys(sub_id.lower() for sub_id in ids))
+    result: Dict[str, praw.models.Submission] = {}
+    for i in range(0, len(id_list), batch_size):
+        fullnames = [f"t3_{sub_id}" for sub_id in id_list[i:i + batch_size]]
+        for sub in reddit.info(fullnames=fullnames):
+            result[sub.id] = sub
+    return result
 
 
 def redirect_xpost(sub: praw.models.Submission) -> praw.models.Submission:
@@ -88,6 +187,12 @@ def redirect_xpost(sub: praw.models.Submission) -> praw.models.Submission:
     :return: redirected praw.models.Submission
     """
     try:
+        # NOTE: praw fetches the submission again when accessing a missing attribute
+        # on submissions that came from a listing e.g. fetch_submissions, but the
+        # crosspost_parent is always included in the data if there is one
+        sub_data = vars(sub)
+        if "title" in sub_data and "crosspost_parent" not in sub_data:
+            return sub
         parent = sub.crosspost_parent
         logger.info("Reddit submission with id %s is a crosspost, using the redirected "
                     "submission with id %s instead!", sub.id, parent)
@@ -95,6 +200,10 @@ def redirect_xpost(sub: praw.models.Submission) -> praw.models.Submission:
             logger.warning("Empty parent list, crosspost has most likely been deleted!")
         elif len(sub.crosspost_parent_list) > 1:
             logger.info("Submission has more than one crosspost parent!")
+        for parent_data in sub.crosspost_parent_list or []:
+            if parent_data.get("name") == parent:
+                # full data of the parent is embedded -> no need to fetch it
+                return praw.models.Submission(reddit_praw(), _data=dict(parent_data))
         # crosspost_parent has the full name of the submission -> u get id by splitting at '_'
         # e.g. id 'j6y1n9' has a crosspost_parent of 't3_boo4rq'
         # The fullname of an object is the object’s type followed by an
@@ -106,12 +215,13 @@ def redirect_xpost(sub: praw.models.Submission) -> praw.models.Submission:
         return sub
 
 
-def redirect_crossposts(subs: Iterator[praw.models.Submission]) -> List[praw.models.Submission]:
+def redirect_crossposts(subs: Iterable[praw.models.Submission]
+                        ) -> Iterator[praw.models.Submission]:
     """
-    Redirects crossposts to the original submission and returns them as a list - does nothing
+    Lazily redirects crossposts to the original submission - does nothing
     to non-crossposted submissions
 
     :param subs: Iterable of praw.models.Submission
-    :return: List of praw.models.Submission
+    :return: Generator of praw.models.Submission
     """
-    return [redirect_xpost(sub) for sub in subs]
+    return (redirect_xpost(sub) for sub in subs)
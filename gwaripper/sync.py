@@ -0,0 +1,123 @@
+import time
+import logging
+import sqlite3
+
+from typing import Optional, Iterable, Iterator
+
+import praw
+
+logger = logging.getLogger(__name__)
+
+
+def subreddit_source(subreddit: str) -> str:
+    return f"subreddit:{subreddit.lower()}"
+
+
+def redditor_source(name: str) -> str:
+    return f"redditor:{name.lower()}"
+
+
+def search_source(subreddit: str, searchstring: str) -> str:
+    return f"search:{subreddit.lower()}:{searchstring}"
+
+
+def get_watermark(db_con: sqlite3.Connection, source: str) -> Optional[float]:
+    """:return: created_utc of the newest submission seen of source or None"""
+    row = db_con.execute("SELECT created_utc FROM SyncWatermark WHERE source = ?",
+                         (source,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def set_watermark(db_con: sqlite3.Connection, source: str, created_utc: float,
+                  reddit_id: Optional[str]) -> None:
+    """Moves the watermark of source forward; older timestamps are ignored"""
+    with db_con:
+        db_con.execute("""
+            INSERT INTO SyncWatermark(source, created_utc, reddit_id, updated)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET
+                created_utc = excluded.created_utc,
+                reddit_id = excluded.reddit_id,
+                updated = excluded.updated
+            WHERE excluded.created_utc > SyncWatermark.created_utc""",
+                       (source, created_utc, reddit_id, time.time()))
+
+
+class ListingSync:
+    """
+    Tracks the newest submission of a reddit listing, so it can be stored as the
+    watermark of the source, and optionally filters the listing down to the
+    submissions that were created after a timestamp
+
+    Chronological listings (sort new) are sorted newest first, so when filtering
+    they're stopped at the first submission that isn't newer, which means no
+    further listing pages get requested
+
+    NOTE: needs to be applied to the listing before crossposts get redirected,
+    since the original submission might be a lot older than the crosspost
+    """
+
+    def __init__(self, source: str, watermark: Optional[float], chronological: bool,
+                 limit: Optional[int] = None, after: Optional[float] = None):
+        """
+        :param watermark: Stored watermark of the source
+        :param limit: Max. number of submissions the listing returns
+        :param after: Only submissions created after this utc timestamp are returned
+        """
+        self.source = source
+        self.watermark = watermark
+        self.chronological = chronological
+        self.limit = limit
+        self.after = after
+        self.newest_utc: Optional[float] = None
+        self.newest_id: Optional[str] = None
+        self.nr_seen = 0
+        self.nr_skipped = 0
+        self.reached_watermark = False
+        # listing ended on its own instead of being stopped by us
+        self.exhausted = False
+
+    def filter(self, subs: Iterable[praw.models.Submission]
+               ) -> Iterator[praw.models.Submission]:
+        for sub in subs:
+            self.nr_seen += 1
+            created_utc = sub.created_utc
+            if self.newest_utc is None or created_utc > self.newest_utc:
+                self.newest_utc = created_utc
+                self.newest_id = sub.id
+
+            # NOTE: vars so praw doesn't fetch the submission if they're missing
+            sub_data = vars(sub)
+            # stickied/pinned submissions come first no matter how old they are
+            in_order = self.chronological and not (
+                sub_data.get("stickied") or sub_data.get("pinned"))
+            if in_order and self.watermark is not None and created_utc <= self.watermark:
+                self.reached_watermark = True
+
+            if self.after is None or created_utc > self.after:
+                yield sub
+            elif in_order:
+                logger.info("Stopped listing %s at submission %d, since all following "
+                            "ones are older", self.source, self.nr_seen)
+                return
+            else:
+                self.nr_skipped += 1
+        self.exhausted = True
+
+    def save(self, db_con: sqlite3.Connection) -> None:
+        """
+        Stores the newest submission as the watermark of the source, but only if
+        it's known that all submissions between it and the previous watermark
+        were seen, i.e. the listing was chronological and either reached the
+        previous watermark or was exhausted before the limit
+        """
+        if not self.chronological or self.newest_utc is None:
+            return
+        if not (self.watermark is None or self.reached_watermark or (
+                self.exhausted and (self.limit is None or self.nr_seen < self.limit))):
+            logger.warning("Did not reach the watermark of %s within %d submissions, so "
+                           "older submissions might have been missed! The watermark was "
+                           "not updated, use a higher limit to include them",
+                           self.source, self.nr_seen)
+            return
+        set_watermark(db_con, self.source, self.newest_utc, self.newest_id)
@@ -3,8 +3,11 @@ import os
 import time
 import re
 import logging
+import asyncio
+import threading
+import contextlib
 
-from typing import Optional, Callable, List
+from typing import Optional, List, Dict, Hashable, Iterator
 
 logger = logging.getLogger(__name__)
 
@@ -65,77 +68,160 @@ def handle_exception(exc_type, exc_value, exc_traceback):
 sys.excepthook = handle_exception
 
 
-class RequestDelayer:
+class TokenBucket:
     """
-    Helper class to sleep delay seconds if time_gap number of seconds have passed since
-    last delay on mode "last-delay"
+    Thread-safe token bucket that allows `rate` requests per second on average
+    and bursts of up to `capacity` requests
 
-    Sleep if time since last request is smaller than time_gap on mode "last-request" (default)
-    example for time_gap 1s delay:0.25s:
-    RQ 0.25s -> DELAY RQ 0.1s -> DELAY RQ 1.5s RQ 10s RQ...
-    -> min time between RQ: 0.25s(delay),
-    -> max time between RQ when delay was issued < time_gap+delay
+    Tokens are reserved under a lock and callers sleep outside of it, so waiting
+    callers are served in the order they arrived. Can be used from threads using
+    `acquire` or from coroutines using `acquire_async`
 
-    Note: self.last_delay or request will be set to current time after delaying
+    :param rate: Tokens that get added per second
+    :param capacity: Max number of tokens in the bucket, defaults to max(1, rate)
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        # stats
+        self.requests = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _reserve(self, tokens: float) -> float:
+        """:return: Seconds the caller has to wait before the token is available"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            # tokens can go negative, which means they are reserved by earlier callers
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+            self.requests += 1
+            if wait > 0:
+                self.delayed += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def acquire(self, tokens: float = 1) -> float:
+        """:return: Seconds that were spent waiting"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """:return: Seconds that were spent waiting"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "delayed": self.delayed,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+            }
 
-    :param delay: Delay time in seconds (float)
-    :param time_gap: Time to check before delay is issued (float)
-    :param mode: Check if delay is needed based on either "last-request" or "last-delay"
+
+class KeyedRateLimiter:
+    """
+    One TokenBucket per key (e.g. host) that gets created lazily with the rate
+    from `rates` or `default_rate` if the key is missing
+
+    A key of None or a rate of 0 is not limited at all
+
+    :param rates: Requests per second by key
+    :param default_rate: Requests per second for keys that are not in rates
     """
 
-    # bug in mypy can't assign to callable attribute since it thinks that
-    # we're trying to assign to a function
-    # workaround is defining it as Optional and then wrapping it in a method
-    # mypy removes self argument from Callable
-    _delay_func: Optional[Callable[[], None]]
-
-    def __init__(self, delay: float, time_gap: float, mode: str = "last-request"):
-        self.delay = delay
-        self.time_gap = time_gap
-        self.last_delay: Optional[float] = None
-        self.last_request: Optional[float] = None
-
-        if mode == "last-delay":
-            self._delay_func = self._delay_mode_delay
-        else:
-            self._delay_func = self._delay_mode_request
-
-    def delay_request(self) -> None:
-        assert self._delay_func is not None
-        self._delay_func()
-
-    def _delay_mode_delay(self) -> None:
-        now = time.time()
-        # delay based on last delay time
-        # time since last delay > time_gap -> delay
-        if self.last_delay:
-            if (now - self.last_delay) > self.time_gap:
-                logger.debug("Delaying by {} seconds".format(self.delay))
-                time.sleep(self.delay)
-                self.last_delay = now
-            else:
-                logger.debug("Not delayed: time since last delay {} s".format(
-                    now - self.last_delay))
-        else:
-            time.sleep(self.delay)
-            self.last_delay = now
-
-    def _delay_mode_request(self) -> None:
-        now = time.time()
-        # delay based on last request time
-        # time since last request < time_gap -> delay
-        if self.last_request:
-            if (now - self.last_request) < self.time_gap:
-                logger.debug("Delaying by {} seconds".format(self.delay))
-                time.sleep(self.delay)
-                self.last_request = now
-            else:
-                logger.debug("Not delayed: time since last request {} s".format(
-                    now - self.last_request))
-                self.last_request = now
-        else:
-            # dont sleep on first request
-            self.last_request = now
+    def __init__(self, rates: Optional[Dict[Hashable, float]] = None, default_rate: float = 0):
+        self.rates = dict(rates) if rates else {}
+        self.default_rate = default_rate
+        self._buckets: Dict[Hashable, Optional[TokenBucket]] = {}
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, key: Optional[Hashable]) -> Optional[TokenBucket]:
+        if key is None:
+            return None
+        with self._lock:
+            try:
+                return self._buckets[key]
+            except KeyError:
+                rate = self.rates.get(key, self.default_rate)
+                bucket = TokenBucket(rate) if rate > 0 else None
+                self._buckets[key] = bucket
+                return bucket
+
+    def acquire(self, key: Optional[Hashable]) -> float:
+        """:return: Seconds that were spent waiting"""
+        bucket = self._get_bucket(key)
+        return bucket.acquire() if bucket is not None else 0.0
+
+    async def acquire_async(self, key: Optional[Hashable]) -> float:
+        """:return: Seconds that were spent waiting"""
+        bucket = self._get_bucket(key)
+        return await bucket.acquire_async() if bucket is not None else 0.0
+
+    @property
+    def stats(self) -> Dict[Hashable, Dict[str, float]]:
+        """:return: Stats of the TokenBucket for every limited key"""
+        with self._lock:
+            buckets = list(self._buckets.items())
+        return {key: bucket.stats for key, bucket in buckets if bucket is not None}
+
+
+class KeyedConcurrencyLimiter:
+    """
+    Limits the number of threads that can be inside a `limit(key)` block at the
+    same time for every key separately (e.g. max. 2 concurrent downloads per
+    AudioHost)
+
+    Uses one BoundedSemaphore per key which gets created lazily
+    A key of None is not limited at all
+
+    :param max_per_key: Max number of concurrent holders per key
+    """
+
+    def __init__(self, max_per_key: int):
+        if max_per_key < 1:
+            raise ValueError("max_per_key must be at least 1")
+        self.max_per_key = max_per_key
+        self._semaphores: Dict[Hashable, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _get_semaphore(self, key: Hashable) -> threading.BoundedSemaphore:
+        with self._lock:
+            try:
+                return self._semaphores[key]
+            except KeyError:
+                sem = threading.BoundedSemaphore(self.max_per_key)
+                self._semaphores[key] = sem
+                return sem
+
+    @contextlib.contextmanager
+    def limit(self, key: Optional[Hashable]) -> Iterator[None]:
+        if key is None:
+            yield
+            return
+
+        sem = self._get_semaphore(key)
+        with sem:
+            yield
 
 
 def txt_to_list(txtfilename: str) -> List[str]:
@@ -41,6 +41,8 @@ setuptools.setup(
                       "typing-extensions>=3.7.4"],
 
     tests_require=['pytest'],
+    # faster html parsing, which is used automatically if it's installed
+    extras_require={"lxml": ["lxml"]},
     # using MANIFEST.in for these files does not seem to work!
     # non-python data that should be included in the pkg
     # mapping from package name to a list of relative (to package) path names that should be
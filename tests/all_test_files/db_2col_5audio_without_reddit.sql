@@ -22,6 +22,11 @@ CREATE TABLE AudioFile(
                     alias_id INTEGER NOT NULL,
                     rating REAL,
                     favorite INTEGER NOT NULL DEFAULT 0,
+                    -- hex digest and size in bytes of the downloaded file
+                    sha256 TEXT,
+                    file_size INTEGER,
+                    -- normalized url for finding duplicates, see extractors.canonical_url
+                    url_key TEXT,
                     FOREIGN KEY (collection_id) REFERENCES FileCollection(id)
                       -- can't delete a FileCollection if there are still rows with
                       -- it's id as collection_id here
@@ -29,6 +34,27 @@ CREATE TABLE AudioFile(
                     FOREIGN KEY (alias_id) REFERENCES Alias(id)
                       ON DELETE RESTRICT
                 );
+CREATE TABLE DeadUrl(
+            id INTEGER PRIMARY KEY ASC,
+            -- canonical url, see extractors.canonical_url
+            url_key TEXT UNIQUE NOT NULL,
+            -- status code of the last check, e.g. 404 or 410
+            http_code INTEGER NOT NULL,
+            -- unix timestamps
+            first_seen REAL NOT NULL,
+            last_checked REAL NOT NULL,
+            -- failed checks so far, the interval between re-checks doubles every time
+            nr_checks INTEGER NOT NULL DEFAULT 1
+        );
+CREATE TABLE ExtractionCache(
+            id INTEGER PRIMARY KEY ASC,
+            -- canonical url, see extractors.canonical_url
+            url_key TEXT UNIQUE NOT NULL,
+            -- JSON of the fields of the extracted FileInfo
+            data TEXT NOT NULL,
+            -- unix timestamp of when the url was extracted
+            stored REAL NOT NULL
+        );
 CREATE TABLE FileCollection(
                     id INTEGER PRIMARY KEY ASC,
                     url TEXT UNIQUE NOT NULL,
@@ -38,6 +64,7 @@ CREATE TABLE FileCollection(
                     reddit_info_id INTEGER,
                     parent_id INTEGER,
                     alias_id INTEGER NOT NULL,
+                    url_key TEXT,
                     FOREIGN KEY (reddit_info_id) REFERENCES "RedditInfo"(id)
                       ON DELETE RESTRICT,
                     FOREIGN KEY (parent_id) REFERENCES FileCollection(id)
@@ -53,6 +80,14 @@ CREATE TABLE GWAR_Version (
                     version_id INTEGER PRIMARY KEY ASC,
                     dirty INTEGER NOT NULL
                 );
+CREATE TABLE Job(
+            id INTEGER PRIMARY KEY ASC,
+            url TEXT UNIQUE NOT NULL,
+            -- one of: queued, extracting, extracted, downloading, done, failed
+            state TEXT NOT NULL,
+            -- unix timestamp of the last state change
+            updated REAL NOT NULL
+        );
 CREATE TABLE ListenLater (
           id INTEGER PRIMARY KEY ASC,
           audio_id INTEGER,
@@ -68,6 +103,16 @@ CREATE TABLE "RedditInfo"(
             FOREIGN KEY (flair_id) REFERENCES Flair(id)
               ON DELETE RESTRICT
         );
+CREATE TABLE SyncWatermark(
+            id INTEGER PRIMARY KEY ASC,
+            -- e.g. subreddit:gonewildaudio, redditor:name or search:subreddit:query
+            source TEXT UNIQUE NOT NULL,
+            -- created_utc and id of the newest submission that was seen
+            created_utc REAL NOT NULL,
+            reddit_id TEXT,
+            -- unix timestamp of the run that set the watermark
+            updated REAL NOT NULL
+        );
 CREATE VIRTUAL TABLE Titles_fts_idx USING fts5(
           audio_title, collection_title,
           content='v_audio_and_collection_titles',
@@ -126,14 +171,14 @@ INSERT INTO "Alias" VALUES
 (4,NULL,'skitty'),
 (5,NULL,'sassmastah77');
 INSERT INTO "AudioFile" VALUES
-(1,NULL,'2020-11-13','[F4M] [Gentle Fdom] [Size difference] [Thicc] [Monster Mommy] [Breast play] [Outercourse] [Handjob] [Cozy blanket] [Kissing] [Thighjob] [Pinning you down] [Grinding] [Wrapped in wings] [Aftercare] [ASMR] [Script: BowTieGuy]','02_Motherly Moth Girl Keeps You Warm [F4M].m4a','Motherly Moth Girl Keeps You Warm [F4M]','https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4M',4,NULL,0),
-(2,NULL,'2020-11-13','[F4F] [Gentle Fdom] [Size difference] [Thicc] [Monster Mommy] [Breast play] [Outercourse] [Fingering] [Cozy blanket] [Kissing] [Cunnilingus] [Two orgasms] [Clit play] [Pinning you down] [Wrapped in wings] [Aftercare] [ASMR] [Script: BowTieGuy]','03_Motherly Moth Girl Keeps You Warm [F4F].m4a','Motherly Moth Girl Keeps You Warm [F4F]','https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4F',4,NULL,0),
-(3,NULL,'2020-11-13','[F4TF] [Gentle Fdom] [Size difference] [Thicc] [Monster Mommy] [Breast play] [Outercourse] [Handjob] [Cozy blanket] [Kissing] [Thighjob] [Pinning you down] [Grinding] [Wrapped in wings] [Aftercare] [ASMR] [Script: BowTieGuy]','04_Motherly Moth Girl Keeps You Warm [F4TF].m4a','Motherly Moth Girl Keeps You Warm [F4TF]','https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4TF',4,NULL,0),
-(4,NULL,'2020-11-13',NULL,'Lonely Kitty.mp3','Lonely Kitty','https://chirb.it/F5hInh',4,NULL,0),
-(5,NULL,'2020-11-13','[MILF] [comforted by your ex''s sweet + sexy mom] [realistic slow build] [kissing] [sloppy wet handjob] [cock worshipping, deep-throating blowjob] [just use my mouth to make yourself feel good] [dirty talk] [sucking my big tits] [riding you on the couch] [creampie] [tasting myself on your dick] [improv] [43 mins]','[F4M] My Daughter is an Idiot for Breaking Up With You... Let Me Help _F4M] My Daughter is an Idiot for Breaking Up With You... Let Me Help You Feel Better.m4a','F4M] My Daughter is an Idiot for Breaking Up With You... Let Me Help You Feel Better','https://soundgasm.net/u/sassmastah77/F4M-My-Daughter-is-an-Idiot-for-Breaking-Up-With-You-Let-Me-Help-You-Feel-Better',5,NULL,0),
-(6,NULL,'2020-11-13','[your older female cousin] [friends to lovers] [teasing] [tickling] [giggles] [perv encouragement] [kissing] [big tits] [dirty talk] [whispers] [blowjob] [licking, sucking + face-fucking] [rubbing my clit while deep-throating your cock] [begging for your cum] [27 mins]','[f4m] Your Favourite Cousin.m4a','[f4m] Your Favourite Cousin','https://soundgasm.net/u/sassmastah77/f4m-Your-Favourite-Cousin-1',5,NULL,0);
+(1,NULL,'2020-11-13','[F4M] [Gentle Fdom] [Size difference] [Thicc] [Monster Mommy] [Breast play] [Outercourse] [Handjob] [Cozy blanket] [Kissing] [Thighjob] [Pinning you down] [Grinding] [Wrapped in wings] [Aftercare] [ASMR] [Script: BowTieGuy]','02_Motherly Moth Girl Keeps You Warm [F4M].m4a','Motherly Moth Girl Keeps You Warm [F4M]','https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4M',4,NULL,0,NULL,NULL,'soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4M'),
+(2,NULL,'2020-11-13','[F4F] [Gentle Fdom] [Size difference] [Thicc] [Monster Mommy] [Breast play] [Outercourse] [Fingering] [Cozy blanket] [Kissing] [Cunnilingus] [Two orgasms] [Clit play] [Pinning you down] [Wrapped in wings] [Aftercare] [ASMR] [Script: BowTieGuy]','03_Motherly Moth Girl Keeps You Warm [F4F].m4a','Motherly Moth Girl Keeps You Warm [F4F]','https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4F',4,NULL,0,NULL,NULL,'soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4F'),
+(3,NULL,'2020-11-13','[F4TF] [Gentle Fdom] [Size difference] [Thicc] [Monster Mommy] [Breast play] [Outercourse] [Handjob] [Cozy blanket] [Kissing] [Thighjob] [Pinning you down] [Grinding] [Wrapped in wings] [Aftercare] [ASMR] [Script: BowTieGuy]','04_Motherly Moth Girl Keeps You Warm [F4TF].m4a','Motherly Moth Girl Keeps You Warm [F4TF]','https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4TF',4,NULL,0,NULL,NULL,'soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4TF'),
+(4,NULL,'2020-11-13',NULL,'Lonely Kitty.mp3','Lonely Kitty','https://chirb.it/F5hInh',4,NULL,0,NULL,NULL,'chirb.it/F5hInh'),
+(5,NULL,'2020-11-13','[MILF] [comforted by your ex''s sweet + sexy mom] [realistic slow build] [kissing] [sloppy wet handjob] [cock worshipping, deep-throating blowjob] [just use my mouth to make yourself feel good] [dirty talk] [sucking my big tits] [riding you on the couch] [creampie] [tasting myself on your dick] [improv] [43 mins]','[F4M] My Daughter is an Idiot for Breaking Up With You... Let Me Help _F4M] My Daughter is an Idiot for Breaking Up With You... Let Me Help You Feel Better.m4a','F4M] My Daughter is an Idiot for Breaking Up With You... Let Me Help You Feel Better','https://soundgasm.net/u/sassmastah77/F4M-My-Daughter-is-an-Idiot-for-Breaking-Up-With-You-Let-Me-Help-You-Feel-Better',5,NULL,0,NULL,NULL,'soundgasm.net/u/sassmastah77/F4M-My-Daughter-is-an-Idiot-for-Breaking-Up-With-You-Let-Me-Help-You-Feel-Better'),
+(6,NULL,'2020-11-13','[your older female cousin] [friends to lovers] [teasing] [tickling] [giggles] [perv encouragement] [kissing] [big tits] [dirty talk] [whispers] [blowjob] [licking, sucking + face-fucking] [rubbing my clit while deep-throating your cock] [begging for your cum] [27 mins]','[f4m] Your Favourite Cousin.m4a','[f4m] Your Favourite Cousin','https://soundgasm.net/u/sassmastah77/f4m-Your-Favourite-Cousin-1',5,NULL,0,NULL,NULL,'soundgasm.net/u/sassmastah77/f4m-Your-Favourite-Cousin-1');
 INSERT INTO "GWAR_Version" VALUES
-(4,0);
+(10,0);
 INSERT INTO "Titles_fts_idx" VALUES
 ('Motherly Moth Girl Keeps You Warm [F4M]',NULL),
 ('Motherly Moth Girl Keeps You Warm [F4F]',NULL),
@@ -144,6 +189,10 @@ INSERT INTO "Titles_fts_idx" VALUES
 CREATE INDEX alias_artist_id_idx ON Alias(artist_id);
 CREATE INDEX audio_file_alias_id_idx ON AudioFile(alias_id);
 CREATE INDEX audio_file_collection_id_idx ON AudioFile(collection_id);
+CREATE INDEX audio_file_sha256_idx ON AudioFile(sha256);
+CREATE INDEX audio_file_url_key_idx ON AudioFile(url_key);
+CREATE INDEX file_collection_url_key_idx ON FileCollection(url_key);
+CREATE INDEX job_state_idx ON Job(state);
 CREATE TRIGGER AudioFile_ad AFTER DELETE ON AudioFile
         BEGIN
             INSERT INTO Titles_fts_idx(Titles_fts_idx, rowid, audio_title, collection_title)
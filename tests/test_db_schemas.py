@@ -828,3 +828,29 @@ def test_gather_migrations(setup_tmpdir, monkeypatch):
     assert migrations[v].version_id == v and migrations[v].filename == found[2]
     v = 5432
     assert migrations[v].version_id == v and migrations[v].filename == found[3]
+
+
+def test_migration_backfills_url_key(caplog):
+    migration = importlib.import_module("gwaripper.migrations.0008_add_url_key")
+    db_con = sqlite3.connect(":memory:")
+    db_con.executescript("""
+    CREATE TABLE AudioFile(id INTEGER PRIMARY KEY ASC, url TEXT UNIQUE NOT NULL);
+    CREATE TABLE FileCollection(id INTEGER PRIMARY KEY ASC, url TEXT UNIQUE NOT NULL);
+    INSERT INTO AudioFile(url) VALUES
+        ('https://soundgasm.net/u/user/Title-F4M'),
+        ('http://www.soundgasm.net/user/user/Title-F4M/'),
+        ('https://chirb.it/F5hInh');
+    INSERT INTO FileCollection(url) VALUES
+        ('https://old.reddit.com/r/gonewildaudio/comments/ix81f7/title/');""")
+
+    migration.upgrade(db_con)
+
+    assert db_con.execute("SELECT url_key FROM AudioFile ORDER BY id").fetchall() == [
+        ('soundgasm.net/u/user/Title-F4M',), ('soundgasm.net/u/user/Title-F4M',),
+        ('chirb.it/F5hInh',)]
+    assert db_con.execute("SELECT url_key FROM FileCollection").fetchall() == [
+        ('reddit.com/comments/ix81f7',)]
+    assert "Found 1 rows in AudioFile" in caplog.text
+    # dedup is a single index lookup
+    assert "audio_file_url_key_idx" in db_con.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM AudioFile WHERE url_key = ?", ("x",)).fetchall()[0][3]
@@ -0,0 +1,84 @@
+import pytest
+import os
+import time
+
+import gwaripper.dead_urls
+
+from gwaripper.gwaripper import GWARipper
+from gwaripper.dead_urls import DeadUrlCache, MAX_RECHECK_INTERVAL
+from gwaripper.extractors.base import ExtractorErrorCode
+from gwaripper.extractors.soundgasm import SoundgasmExtractor
+from utils import TESTS_DIR, setup_tmpdir
+
+URL = "https://soundgasm.net/u/testuser/Deleted-Audio"
+
+
+def test_dead_url_recheck_interval():
+    dead_urls = DeadUrlCache(None, None, recheck_interval=10)
+    assert [dead_urls.next_check(100, n) for n in range(1, 5)] == [110, 120, 140, 180]
+    assert dead_urls.next_check(100, 1000) == 100 + MAX_RECHECK_INTERVAL
+
+
+def test_dead_urls_skipped_across_runs(setup_tmpdir, monkeypatch):
+    tmpdir = setup_tmpdir
+    with open(os.path.join(TESTS_DIR, "all_test_files", "html", "soundgasm_file.html"),
+              "r", encoding="utf-8") as f:
+        page = f.read()
+    responses = [(None, 404)]
+    fetched = []
+
+    def get_html(cls, url, additional_headers=None):
+        fetched.append(url)
+        return responses[-1]
+
+    monkeypatch.setattr(SoundgasmExtractor, "get_html", classmethod(get_html))
+    now = time.time()
+    monkeypatch.setattr(gwaripper.dead_urls.time, "time", lambda: now)
+
+    def run(write_report=False):
+        with GWARipper() as gwa:
+            fi, report = SoundgasmExtractor.extract(URL)
+            if write_report:
+                gwa.write_report([report])
+            row = gwa.db_con.execute(
+                "SELECT http_code, first_seen, last_checked, nr_checks FROM DeadUrl").fetchone()
+            return fi, report, tuple(row) if row is not None else None
+
+    fi, report, row = run()
+    assert fi is None
+    assert (report.err_code, report.http_code, report.cached) == (
+        ExtractorErrorCode.NO_RESPONSE, 404, False)
+    assert row == (404, now, now, 1)
+    assert len(fetched) == 1
+
+    # skipped without a request till the first re-check is due after 24h
+    first_seen = now
+    now += 23 * 3600
+    fi, report, row = run(write_report=True)
+    assert (report.err_code, report.http_code, report.cached) == (
+        ExtractorErrorCode.NO_RESPONSE, 404, True)
+    assert len(fetched) == 1
+    with open(os.path.join(tmpdir, "_reports",
+                           f"report_{time.strftime('%Y-%m-%dT%Hh%Mm')}.html"), "r") as f:
+        assert "NO_RESPONSE (HTTP 404) (CACHED)" in f.read()
+
+    responses.append((None, 410))
+    now += 2 * 3600
+    fi, report, row = run()
+    assert not report.cached
+    assert row == (410, first_seen, now, 2)
+    assert len(fetched) == 2
+
+    # interval doubled
+    now += 47 * 3600
+    run()
+    assert len(fetched) == 2
+
+    # available again
+    responses.append((page, 200))
+    now += 2 * 3600
+    fi, report, row = run()
+    assert report.err_code is ExtractorErrorCode.NO_ERRORS
+    assert fi is not None
+    assert row is None
+    assert len(fetched) == 3
@@ -1,14 +1,30 @@
 import pytest
 
+import io
 import os
+import sys
+import time
+import socket
+import email.utils
+import hashlib
+import threading
+import collections
+import urllib.error
 import gwaripper.config as cfg
 
 from gwaripper.gwaripper import GWARipper
 from gwaripper.info import FileInfo, FileCollection
 from gwaripper.cli import _cl_link
-from gwaripper.download import DownloadErrorCode
+from gwaripper.download import (
+    DownloadErrorCode, download_in_chunks, parse_content_range, iter_hls_segments,
+    download_hls_ffmpeg, AdaptiveBackoff, Deadline, DeadlineExceeded, download_text,
+    RetryPolicy, parse_retry_after, copy_stream, ThrottledProgress, MIN_CHUNK_SIZE,
+    MAX_CHUNK_SIZE, download_segmented, split_ranges, ContentDigest, hash_file
+)
 from gwaripper import extractors
-from utils import TESTS_DIR, setup_tmpdir_param, gen_hash_from_file
+from utils import (
+    TESTS_DIR, setup_tmpdir_param, gen_hash_from_file, local_http_server, LocalHTTPServer
+)
 
 class ArgsDummy:
     def __init__(self, links, **kwargs):
@@ -143,3 +159,420 @@ def test_skip_non_prio_hosts(monkeypatch, setup_tmpdir_param):
     assert files[5].downloaded is DownloadErrorCode.CHOSE_OTHER_HOST
     assert files[6].downloaded is DownloadErrorCode.NO_ERRORS
     assert files[7].downloaded is DownloadErrorCode.CHOSE_OTHER_HOST
+
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 100-199/1000") == (100, 1000)
+    assert parse_content_range("bytes 0-0/*") == (0, None)
+    assert parse_content_range("bytes */1000") == (None, 1000)
+    assert parse_content_range(None) == (None, None)
+    assert parse_content_range("garbage") == (None, None)
+
+
+def test_download_in_chunks_resume(setup_tmpdir_param, local_http_server):
+    tmpdir = setup_tmpdir_param
+    server = local_http_server
+    data = os.urandom(100_000)
+    server.files["/audio.m4a"] = data
+    server.httpd.truncate_at["/audio.m4a"] = 30_000
+
+    fn = os.path.join(tmpdir, "audio.m4a")
+    # connection drops -> partial data is kept in the sidecar
+    with pytest.raises(urllib.error.ContentTooShortError):
+        download_in_chunks(server.url("/audio.m4a"), fn)
+    assert not os.path.isfile(fn)
+    assert os.path.getsize(fn + ".part") == 30_000
+
+    # re-run only transfers the missing bytes
+    digest = ContentDigest()
+    assert download_in_chunks(server.url("/audio.m4a"), fn, digest=digest) == len(data)
+    assert server.requests[-1][2]["Range"] == "bytes=30000-"
+    assert not os.path.isfile(fn + ".part")
+    with open(fn, "rb") as f:
+        assert f.read() == data
+    # bytes from the sidecar are part of the digest
+    assert digest.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert digest.size == len(data)
+
+
+def test_download_in_chunks_resume_sidecar_complete(setup_tmpdir_param, local_http_server):
+    tmpdir = setup_tmpdir_param
+    server = local_http_server
+    data = os.urandom(5_000)
+    server.files["/audio.m4a"] = data
+
+    fn = os.path.join(tmpdir, "audio.m4a")
+    with open(fn + ".part", "wb") as f:
+        f.write(data)
+
+    # 416 -> sidecar is already complete
+    assert download_in_chunks(server.url("/audio.m4a"), fn) == len(data)
+    with open(fn, "rb") as f:
+        assert f.read() == data
+
+    # 416 and sidecar is bigger than the file -> starts over with a rate limited request
+    os.remove(fn)
+    with open(fn + ".part", "wb") as f:
+        f.write(data + b"x")
+    server.requests.clear()
+    tokens_taken = []
+    assert download_in_chunks(server.url("/audio.m4a"), fn,
+                              before_request=lambda: tokens_taken.append(1)) == len(data)
+    assert len(tokens_taken) == len(server.requests) == 2
+    with open(fn, "rb") as f:
+        assert f.read() == data
+
+
+def test_download_in_chunks_no_range_support(setup_tmpdir_param):
+    tmpdir = setup_tmpdir_param
+    data = os.urandom(50_000)
+
+    fn = os.path.join(tmpdir, "audio.m4a")
+    with open(fn + ".part", "wb") as f:
+        f.write(b"x" * 1000)
+
+    with LocalHTTPServer(accept_ranges=False) as server:
+        server.files["/audio.m4a"] = data
+        # server ignores the range -> starts over
+        assert download_in_chunks(server.url("/audio.m4a"), fn) == len(data)
+
+    with open(fn, "rb") as f:
+        assert f.read() == data
+
+
+def test_content_digest(setup_tmpdir_param):
+    tmpdir = setup_tmpdir_param
+    data = os.urandom(3 * MAX_CHUNK_SIZE // 2)
+    fn = os.path.join(tmpdir, "audio.m4a")
+    with open(fn, "wb") as f:
+        f.write(data)
+
+    digest = hash_file(fn)
+    assert digest.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert digest.size == len(data)
+
+    digest.reset()
+    digest.update_from_file(fn, 1000)
+    digest.update(data[1000:2000])
+    assert digest.hexdigest() == hashlib.sha256(data[:2000]).hexdigest()
+    assert digest.size == 2000
+
+
+def test_iter_hls_segments(local_http_server):
+    server = local_http_server
+    segments = {f"/hls/seg{i}.ts": os.urandom(2_000 + i) for i in range(12)}
+    server.files.update(segments)
+    # rate limit two of the segments and drop the connection for another
+    server.httpd.fail_with["/hls/seg3.ts"] = [429, 429]
+    server.httpd.fail_with["/hls/seg7.ts"] = [429]
+    server.httpd.truncate_at["/hls/seg9.ts"] = 500
+    parts = [server.url(path) for path in segments]
+
+    tokens_taken = []
+
+    # yielded in playlist order
+    assert list(iter_hls_segments(parts, max_workers=4, show_progress=False,
+                                  before_request=lambda: tokens_taken.append(1))) == list(
+        segments.values())
+    # retries are rate limited as well
+    assert len(tokens_taken) == len(server.requests) == 12 + 3 + 1
+
+
+def test_iter_hls_segments_error(local_http_server):
+    server = local_http_server
+    server.files["/hls/seg0.ts"] = b"data"
+    parts = [server.url("/hls/seg0.ts"), server.url("/hls/missing.ts")]
+
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        list(iter_hls_segments(parts, max_workers=2, show_progress=False))
+    assert exc.value.code == 404
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="fake ffmpeg is a shell script")
+def test_download_hls_ffmpeg_pipes_segments(setup_tmpdir_param, local_http_server):
+    tmpdir = setup_tmpdir_param
+    server = local_http_server
+    segments = {f"/hls/seg{i}.ts": os.urandom(1_000) for i in range(5)}
+    server.files.update(segments)
+    server.files["/hls/index.m3u8"] = "\n".join(
+        ["#EXTM3U"] + [server.url(path) for path in segments]).encode("utf-8")
+
+    # stand-in for ffmpeg that copies stdin to the output file (last arg)
+    fake_ffmpeg = os.path.join(tmpdir, "ffmpeg")
+    with open(fake_ffmpeg, "w") as f:
+        f.write(f"#!{sys.executable}\n"
+                "import sys, shutil\n"
+                "assert 'pipe:0' in sys.argv\n"
+                "with open(sys.argv[-1], 'wb') as out:\n"
+                "    shutil.copyfileobj(sys.stdin.buffer, out)\n")
+    os.chmod(fake_ffmpeg, 0o755)
+
+    out_fn = os.path.join(tmpdir, "out.m4a")
+    assert download_hls_ffmpeg(server.url("/hls/index.m3u8"), out_fn, show_progress=False,
+                               ffmpeg_executable=fake_ffmpeg)
+    with open(out_fn, "rb") as f:
+        assert f.read() == b"".join(segments.values())
+    # nothing but the output (and our fake ffmpeg) was written
+    assert sorted(os.listdir(tmpdir)) == ["ffmpeg", "out.m4a"]
+
+
+def test_adaptive_backoff(monkeypatch):
+    slept = []
+    monkeypatch.setattr("gwaripper.download.time.sleep", slept.append)
+    backoff = AdaptiveBackoff(backoff_factor=0.5, max_backoff=2)
+
+    backoff.wait()
+    assert slept == []
+    backoff.hit()
+    assert backoff.delay == 0.5
+    backoff.hit()
+    backoff.hit()
+    backoff.hit()
+    assert backoff.delay == 2
+    backoff.wait()
+    assert slept == [2]
+    for _ in range(4):
+        backoff.success()
+    assert backoff.delay == 0
+    backoff.success()
+    assert backoff.delay == 0
+
+
+def test_download_text_timeouts(monkeypatch, local_http_server):
+    server = local_http_server
+    server.files["/page"] = b"<html></html>"
+    monkeypatch.setitem(cfg.config["Settings"], "timeout_read", "0.2")
+
+    assert download_text({}, server.url("/page")) == ("<html></html>", None)
+
+    server.httpd.stall["/page"] = 1
+    started = time.monotonic()
+    assert download_text({}, server.url("/page")) == (None, None)
+    assert time.monotonic() - started < 1
+
+
+def test_download_in_chunks_deadline(setup_tmpdir_param, local_http_server):
+    tmpdir = setup_tmpdir_param
+    server = local_http_server
+    server.files["/audio.m4a"] = os.urandom(5_000)
+    server.httpd.stall["/audio.m4a"] = 1
+    fn = os.path.join(tmpdir, "audio.m4a")
+
+    started = time.monotonic()
+    # read timeout is capped by the remaining time
+    with pytest.raises(socket.timeout):
+        download_in_chunks(server.url("/audio.m4a"), fn, deadline=Deadline(0.3))
+    assert time.monotonic() - started < 1
+    assert not os.path.isfile(fn)
+
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    with pytest.raises(DeadlineExceeded):
+        download_in_chunks(server.url("/audio.m4a"), fn, deadline=deadline)
+
+
+def test_deadline():
+    deadline = Deadline(0)
+    assert deadline.remaining() is None
+    deadline.check("url")
+
+    deadline = Deadline(100)
+    connect, read = deadline.timeout("url")
+    assert connect <= 100 and read <= 100
+    deadline.expires_at = time.monotonic() - 1
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout("url")
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after("120") == 120
+    assert parse_retry_after("soon") is None
+    in_a_minute = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert 55 < parse_retry_after(in_a_minute) <= 60
+    in_the_past = email.utils.formatdate(time.time() - 60, usegmt=True)
+    assert parse_retry_after(in_the_past) == 0
+
+
+def test_retry_policy_delay():
+    policy = RetryPolicy(max_attempts=5, backoff_factor=1, max_backoff=3, jitter=0)
+    assert [policy.delay(i) for i in range(1, 5)] == [1, 2, 3, 3]
+
+    policy = RetryPolicy(backoff_factor=4, jitter=0.5)
+    assert all(2 <= policy.delay(1) <= 4 for _ in range(20))
+
+    policy = RetryPolicy(max_retry_after=60)
+    err = urllib.error.HTTPError("url", 429, "Too Many Requests", {"Retry-After": "7"}, None)
+    assert policy.delay(1, err) == 7
+    err = urllib.error.HTTPError("url", 429, "Too Many Requests", {"Retry-After": "600"}, None)
+    assert policy.delay(1, err) is None
+
+
+def test_download_text_retries(local_http_server):
+    server = local_http_server
+    server.files["/page"] = b"<html></html>"
+    server.httpd.fail_with["/page"] = [503, (429, {"Retry-After": "0"})]
+    policy = RetryPolicy(max_attempts=3, backoff_factor=0.01)
+    tokens_taken = []
+
+    assert download_text({}, server.url("/page"), retry_policy=policy,
+                         before_request=lambda: tokens_taken.append(1)) == (
+        "<html></html>", None)
+    assert len(server.requests) == 3
+    # every attempt is rate limited
+    assert len(tokens_taken) == 3
+
+    # not retryable
+    server.requests.clear()
+    assert download_text({}, server.url("/missing"), retry_policy=policy) == (None, 404)
+    assert len(server.requests) == 1
+
+
+def test_download_in_chunks_retries(setup_tmpdir_param, local_http_server):
+    tmpdir = setup_tmpdir_param
+    server = local_http_server
+    data = os.urandom(10_000)
+    server.files["/audio.m4a"] = data
+    server.httpd.fail_with["/audio.m4a"] = [502, 502, 502]
+    fn = os.path.join(tmpdir, "audio.m4a")
+
+    tokens_taken = []
+
+    # gives up after max_attempts
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        download_in_chunks(server.url("/audio.m4a"), fn,
+                           retry_policy=RetryPolicy(max_attempts=2, backoff_factor=0.01),
+                           before_request=lambda: tokens_taken.append(1))
+    assert exc.value.code == 502
+    assert len(server.requests) == 2
+    # every attempt is rate limited
+    assert len(tokens_taken) == 2
+
+    assert download_in_chunks(server.url("/audio.m4a"), fn,
+                              retry_policy=RetryPolicy(max_attempts=2, backoff_factor=0.01),
+                              before_request=lambda: tokens_taken.append(1)) == len(data)
+    assert len(tokens_taken) == len(server.requests) == 4
+    with open(fn, "rb") as f:
+        assert f.read() == data
+
+
+class RecordingReader(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.read_sizes = []
+
+    def readinto(self, b):
+        self.read_sizes.append(len(b))
+        return super().readinto(b)
+
+
+def test_copy_stream():
+    data = os.urandom(5 * MAX_CHUNK_SIZE + 123)
+    src = RecordingReader(data)
+    dst = io.BytesIO()
+    reported = []
+
+    assert copy_stream(src, dst, start=10, progress=ThrottledProgress(
+        reported.append, interval=3600)) == len(data) + 10
+    assert dst.getvalue() == data
+    # chunk size grows up to the max
+    assert src.read_sizes[0] == MIN_CHUNK_SIZE
+    assert max(src.read_sizes) == MAX_CHUNK_SIZE
+    assert src.read_sizes == sorted(src.read_sizes)
+    # first and final update only
+    assert reported == [MIN_CHUNK_SIZE + 10, len(data) + 10]
+
+
+def test_throttled_progress(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("gwaripper.download.time.monotonic", lambda: now[0])
+    reported = []
+    progress = ThrottledProgress(reported.append, interval=1)
+
+    for i in range(10):
+        progress.update(i)
+        now[0] += 0.3
+    progress.finish(10)
+    progress.finish(10)
+    assert reported == [0, 4, 8, 10]
+
+
+def test_split_ranges():
+    assert split_ranges(10, 3) == [(0, 3), (4, 6), (7, 9)]
+    assert split_ranges(9, 3) == [(0, 2), (3, 5), (6, 8)]
+    assert split_ranges(2, 4) == [(0, 0), (1, 1)]
+    assert split_ranges(5, 1) == [(0, 4)]
+
+
+def test_download_segmented(setup_tmpdir_param, local_http_server):
+    tmpdir = setup_tmpdir_param
+    server = local_http_server
+    data = os.urandom(1_000_000)
+    server.files["/audio.m4a"] = data
+    # drop the connection in the middle of the second segment
+    server.httpd.truncate_at[("/audio.m4a", 250_000)] = 100_000
+    fn = os.path.join(tmpdir, "audio.m4a")
+
+    tokens_taken = collections.Counter()
+
+    def before_request():
+        tokens_taken[threading.current_thread().name] += 1
+
+    digest = ContentDigest()
+    assert download_segmented(server.url("/audio.m4a"), fn, 4, digest=digest,
+                              before_request=before_request) == len(data)
+    with open(fn, "rb") as f:
+        assert f.read() == data
+    assert not os.path.exists(fn + ".part")
+    assert digest.hexdigest() == hashlib.sha256(data).hexdigest()
+
+    # every segment request is rate limited, including the resumed one
+    assert tokens_taken.pop(threading.current_thread().name) == 1  # probe
+    assert sorted(tokens_taken.values()) == [1, 1, 1, 2]
+
+    ranges = sorted(headers["Range"] for _, _, headers in server.requests)
+    # probe, 4 segments and the resumed part of the second one
+    assert ranges == sorted([
+        "bytes=0-0", "bytes=0-249999", "bytes=250000-499999", "bytes=350000-499999",
+        "bytes=500000-749999", "bytes=750000-999999"])
+
+
+def test_download_segmented_fallback(setup_tmpdir_param):
+    tmpdir = setup_tmpdir_param
+    data = os.urandom(100_000)
+    fn = os.path.join(tmpdir, "audio.m4a")
+
+    with LocalHTTPServer(accept_ranges=False) as server:
+        server.files["/audio.m4a"] = data
+        assert download_segmented(server.url("/audio.m4a"), fn, 4) == len(data)
+        # probe + single stream
+        assert len(server.requests) == 2
+    with open(fn, "rb") as f:
+        assert f.read() == data
+    os.remove(fn)
+
+    # too small
+    with LocalHTTPServer() as server:
+        server.files["/audio.m4a"] = data
+        assert download_segmented(server.url("/audio.m4a"), fn, 4,
+                                  min_size=len(data) + 1) == len(data)
+        assert len(server.requests) == 2
+    with open(fn, "rb") as f:
+        assert f.read() == data
+
+
+def test_download_segmented_error(setup_tmpdir_param, local_http_server):
+    tmpdir = setup_tmpdir_param
+    server = local_http_server
+    server.files["/audio.m4a"] = os.urandom(100_000)
+    fn = os.path.join(tmpdir, "audio.m4a")
+    # probe succeeds, a segment fails for good
+    server.httpd.truncate_at[("/audio.m4a", 50_000)] = 10
+
+    with pytest.raises(urllib.error.ContentTooShortError):
+        download_segmented(server.url("/audio.m4a"), fn, 2,
+                           retry_policy=RetryPolicy(max_attempts=1))
+    # preallocated file is not left behind as a resumable sidecar
+    assert not os.path.exists(fn + ".part")
+    assert not os.path.exists(fn)
@@ -0,0 +1,97 @@
+import pytest
+import os
+import json
+
+import gwaripper.config as cfg
+
+from gwaripper.gwaripper import GWARipper
+from gwaripper.extractors.base import ExtractorErrorCode, title_has_banned_tag
+from gwaripper.extractors.soundgasm import SoundgasmExtractor
+from gwaripper.info import DownloadType
+from utils import TESTS_DIR, setup_tmpdir
+
+URL = "https://soundgasm.net/u/testuser/Sleepy-cuddles"
+
+
+@pytest.fixture
+def sgasm_page(monkeypatch):
+    with open(os.path.join(TESTS_DIR, "all_test_files", "html", "soundgasm_file.html"),
+              "r", encoding="utf-8") as f:
+        page = f.read()
+    fetched = []
+
+    def get_html(cls, url, additional_headers=None):
+        fetched.append(url)
+        return page, 200
+
+    monkeypatch.setattr(SoundgasmExtractor, "get_html", classmethod(get_html))
+    return fetched
+
+
+def test_extraction_cache_across_runs(setup_tmpdir, sgasm_page):
+    fetched = sgasm_page
+    with GWARipper() as gwa:
+        extracted, report = SoundgasmExtractor.extract(URL)
+        assert report.err_code is ExtractorErrorCode.NO_ERRORS
+        data, = gwa.db_con.execute("SELECT data FROM ExtractionCache WHERE url_key = ?",
+                                   ("soundgasm.net/u/testuser/Sleepy-cuddles",)).fetchone()
+        assert json.loads(data)["direct_url"] == extracted.direct_url
+    assert len(fetched) == 1
+
+    # next run re-uses it without fetching the page, also for other spellings of the url
+    with GWARipper() as gwa:
+        for url in (URL, URL.replace("/u/", "/user/") + "/"):
+            fi, report = SoundgasmExtractor.extract(url)
+            assert report.err_code is ExtractorErrorCode.NO_ERRORS
+            assert fi.report is report
+            assert fi.extractor is SoundgasmExtractor
+            assert fi.download_type is DownloadType.HTTP
+            assert ((fi.is_audio, fi.ext, fi.page_url, fi.direct_url, fi.id, fi.title,
+                     fi.descr, fi.author) ==
+                    (extracted.is_audio, extracted.ext, extracted.page_url,
+                     extracted.direct_url, extracted.id, extracted.title,
+                     extracted.descr, extracted.author))
+        # second one is served by the run's memo
+        assert gwa.extraction_cache.stats["hits"] == 1
+    assert len(fetched) == 1
+
+    # outside of a run there's no cache
+    SoundgasmExtractor.extract(URL)
+    assert len(fetched) == 2
+
+
+def test_extraction_cache_ttl(setup_tmpdir, sgasm_page):
+    fetched = sgasm_page
+    cfg.config["ExtractionCacheTTL"] = {"soundgasm": "0"}
+    try:
+        with GWARipper() as gwa:
+            SoundgasmExtractor.extract(URL)
+        with GWARipper() as gwa:
+            SoundgasmExtractor.extract(URL)
+            assert gwa.extraction_cache.stats["expired"] == 1
+        assert len(fetched) == 2
+
+        # disabled -> nothing gets stored
+        cfg.config["ExtractionCacheTTL"] = {"soundgasm": "None"}
+        with GWARipper() as gwa:
+            gwa.db_con.execute("DELETE FROM ExtractionCache")
+            gwa.db_con.commit()
+            SoundgasmExtractor.extract(URL)
+            assert gwa.db_con.execute("SELECT 1 FROM ExtractionCache").fetchone() is None
+    finally:
+        cfg.config.remove_section("ExtractionCacheTTL")
+
+
+def test_extraction_cache_rechecks_banned_tags(setup_tmpdir, sgasm_page, monkeypatch):
+    with GWARipper():
+        fi, _ = SoundgasmExtractor.extract(URL)
+
+    def patched_banned_tag(title, keywordlist=[fi.title.split()[0].lower()], t12=[]):
+        return title_has_banned_tag(title, keywordlist, t12)
+
+    monkeypatch.setattr('gwaripper.extractors.base.title_has_banned_tag', patched_banned_tag)
+    with GWARipper() as gwa:
+        cached, report = SoundgasmExtractor.extract(URL)
+        assert cached is None
+        assert report.err_code is ExtractorErrorCode.BANNED_TAG
+    assert len(sgasm_page) == 1
@@ -0,0 +1,75 @@
+import pytest
+import os
+import time
+
+from gwaripper.gwaripper import GWARipper
+from gwaripper.extraction_memo import ExtractionMemo
+from gwaripper.extractors import base
+from gwaripper.extractors.base import ExtractorReport, ExtractorErrorCode
+from gwaripper.extractors.soundgasm import SoundgasmExtractor
+from gwaripper.info import FileInfo, FileCollection
+from gwaripper.download import DownloadErrorCode
+from utils import TESTS_DIR, setup_tmpdir
+
+
+def test_extraction_memo_bounded():
+    memo = ExtractionMemo(max_entries=2)
+    for i in range(3):
+        memo.put(f"key{i}", FileInfo(SoundgasmExtractor, True, "m4a", f"url{i}",
+                                     f"url{i}.m4a", None, f"title{i}", None, "author"))
+    assert len(memo) == 2
+    assert memo.get("key0") is None
+    fi = memo.get("key1")
+    assert fi.title == "title1"
+    # handed out FileInfos don't share state
+    fi.additional_headers["Referer"] = "x"
+    assert memo.get("key1").additional_headers == {}
+    assert memo.stats == {"hits": 2, "misses": 1, "evicted": 1}
+
+
+def test_repeated_urls_extracted_once(setup_tmpdir, monkeypatch):
+    tmpdir = setup_tmpdir
+    with open(os.path.join(TESTS_DIR, "all_test_files", "html", "soundgasm_file.html"),
+              "r", encoding="utf-8") as f:
+        page = f.read()
+    fetched = []
+
+    def get_html(cls, url, additional_headers=None):
+        fetched.append(url)
+        return page, 200
+
+    monkeypatch.setattr(SoundgasmExtractor, "get_html", classmethod(get_html))
+    url = "https://soundgasm.net/u/testuser/Sleepy-cuddles"
+
+    with GWARipper() as gwa:
+        parents = [FileCollection(SoundgasmExtractor, f"https://parent/{i}", str(i),
+                                  f"parent {i}", "author") for i in range(3)]
+        results = []
+        # same file linked in 3 posts, once using a different spelling of the url
+        for parent, link in zip(parents, (url, url + "/", url.replace("/u/", "/user/"))):
+            parent_report = ExtractorReport(parent.url, ExtractorErrorCode.NO_ERRORS)
+            fi, report = SoundgasmExtractor.extract(link, parent=parent,
+                                                    parent_report=parent_report)
+            assert report.err_code is ExtractorErrorCode.NO_ERRORS
+            assert parent_report.children == [report]
+            results.append(fi)
+
+        assert fetched == [url]
+        assert gwa.extraction_memo.stats["hits"] == 2
+        # every parent got its own copy
+        assert len({id(fi) for fi in results}) == 3
+        for parent, fi in zip(parents, results):
+            assert parent.children == [fi]
+            assert fi.parent is parent
+            assert fi.title == results[0].title
+            assert fi.direct_url == results[0].direct_url
+        results[0].downloaded = DownloadErrorCode.DOWNLOADED
+        assert results[1].downloaded is DownloadErrorCode.NOT_DOWNLOADED
+
+        gwa.extractor_reports = [results[0].report]
+    # memo is only used during the run
+    assert base._extraction_memo is None
+
+    with open(os.path.join(tmpdir, "_reports",
+                           f"report_{time.strftime('%Y-%m-%dT%Hh%Mm')}.html"), "r") as f:
+        assert "<li>RE-USED: 2</li>" in f.read()
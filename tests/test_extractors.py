@@ -12,7 +12,7 @@ import gwaripper.config as config
 
 from gwaripper.download import DownloadErrorCode
 from gwaripper.reddit import reddit_praw
-from gwaripper.extractors import find_extractor, AVAILABLE_EXTRACTORS
+from gwaripper.extractors import find_extractor, canonical_url, AVAILABLE_EXTRACTORS
 from gwaripper.extractors.base import (
         BaseExtractor, title_has_banned_tag, ExtractorReport, ExtractorErrorCode
     )
@@ -102,6 +102,61 @@ def test_find_extractor_and_init(url, expected, attr_val):
         assert getattr(e, k) == v
 
 
+
+@pytest.mark.parametrize('url', [
+    'https://soundgasm.net/u/test-1234/title',
+    'HTTPS://WWW.SOUNDGASM.NET/u/test-1234/',
+    'www.i.imgur.com/c0T9oSy.mp4',
+    'https://m.imgur.com/gallery/WUgRi',
+    'https://old.reddit.com/r/gonewildaudio/comments/5oeedy/title/',
+    'https://np.reddit.com/r/gonewildaudio/comments/5oeedy/title/',
+    'soundgasm.net.evil.com/u/test/title',
+    'https://example.com/u/test-1234/title',
+    'soundgasm.net',
+    '',
+])
+def test_find_extractor_same_as_linear_scan(url):
+    expected = None
+    for extractor in AVAILABLE_EXTRACTORS:
+        if extractor.is_compatible(url):
+            expected = extractor
+            break
+    assert find_extractor(url) is expected
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://soundgasm.net/u/test-1234/Title-F4M', 'soundgasm.net/u/test-1234/Title-F4M'),
+    ('http://www.soundgasm.net/user/test-1234/Title-F4M/',
+     'soundgasm.net/u/test-1234/Title-F4M'),
+    ('soundgasm.net/u/test-1234/Title-F4M?ref=x', 'soundgasm.net/u/test-1234/Title-F4M'),
+    ('HTTPS://WWW.SOUNDGASM.NET/user/test-1234/', 'soundgasm.net/u/test-1234'),
+    ('https://www.reddit.com/r/gonewildaudio/comments/5oeedy/title/',
+     'reddit.com/comments/5oeedy'),
+    ('https://old.reddit.com/user/foo/comments/5OEEDY/', 'reddit.com/comments/5oeedy'),
+    ('https://m.imgur.com/gallery/WUgRi', 'imgur.com/a/WUgRi'),
+    ('https://imgur.com/a/WUgRi/', 'imgur.com/a/WUgRi'),
+    # no compatible extractor
+    ('https://Media.Soundgasm.net/sounds/abc.m4a#t=1', 'media.soundgasm.net/sounds/abc.m4a'),
+    ('https://www.erocast.me/track/1234/title/?lang=en', 'erocast.me/track/1234/title?lang=en'),
+])
+def test_canonical_url(url, expected):
+    assert canonical_url(url) == expected
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://soundcloud.com/user/track', True),
+    ('youtu.be/32ksdf83', True),
+    ('https://www.YouTube.com/watch?v=32ksdf83', True),
+    ('https://newgrounds.com/audio/listen/1', True),
+    ('https://newgrounds.com/portal/view/1', False),
+    ('https://skittykat.cc/exclusive/', True),
+    ('https://skittykat.cc/exclusive/title', False),
+    ('https://soundgasm.net/u/test/title', False),
+])
+def test_is_unsupported_audio_url(url, expected):
+    assert BaseExtractor.is_unsupported_audio_url(url) is expected
+    assert any(r.match(url) for r in BaseExtractor.FILTER_URLS_RE) is expected
+
 sgasm_usr_audio_urls = [
     "https://soundgasm.net/u/DDCherryB/Youve-got-another-girl-somewhere-"
     "beastmaybe-DDLGno-age-rapecrying-l-bombsimpreg-surprise-lube-sounds-"
@@ -4,16 +4,25 @@ import time
 import sqlite3
 import logging
 import datetime
+import socket
+import hashlib
+
+from unittest.mock import ANY
 
 import urllib.error
 
 import gwaripper.config as cfg
 
 from gwaripper.gwaripper import GWARipper, report_preamble, Status
-from gwaripper.db import load_or_create_sql_db, export_to_sql, db_to_sql_insert_only
+from gwaripper.db import (
+    load_or_create_sql_db, export_to_sql, db_to_sql_insert_only, backfill_content_hashes,
+    audio_file_path
+)
 from gwaripper import exceptions
+from gwaripper.utils import KeyedRateLimiter
 from gwaripper.info import FileInfo, RedditInfo, FileCollection, DELETED_USR_FOLDER, UNKNOWN_USR_FOLDER
-from gwaripper.download import DownloadErrorCode
+from gwaripper.download import DownloadErrorCode, DeadlineExceeded, ContentDigest
+from gwaripper.extractors import canonical_url
 from gwaripper.extractors.base import ExtractorReport, ExtractorErrorCode
 from gwaripper.extractors.soundgasm import SoundgasmExtractor
 from gwaripper.extractors.erocast import ErocastExtractor
@@ -176,6 +185,10 @@ def test_set_missing_reddit(setup_db_2col_5audio_without_reddit) -> None:
          'https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4M',
          # alias_id, rating, fav
          4, None, 0,
+         # sha256, file_size
+         None, None,
+         # url_key
+         'soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4M',
          # alias_name, alias_artist_id, artist_name
          'skitty', 1, 'sassmastah77',
          # fcol_id
@@ -299,6 +312,8 @@ def test_add_to_db(setup_db_2col_5audio):
                   "https://soundgsgasgagasm.net/28429SGSAG24sa324.m4a", None,
                   "Best title [SFW]",
                   "This is another description", "alias_added_with_artist_id")
+    fi.sha256 = hashlib.sha256(b"content").hexdigest()
+    fi.file_size = 7
     ri = RedditInfo(object, "add/set_missing:should-use-r_post_url",
                     "26iw32o", "Best title on reddit [SFW]", "skitty-gwa",
                     "pillowtalkaudio", "/r/pillowtalkaudio/comments/26iw32o/foo-bar-baz",
@@ -324,7 +339,10 @@ def test_add_to_db(setup_db_2col_5audio):
              "generated [file] [name].mp3",
              "Best title [SFW]", "https://soundgasm.net/testy_user/Best-title-SFW",
              # 6 = alias_id which was added
-             6, None, 0, 'alias_added_with_artist_id', 1, 1, 'skitty-gwa']
+             6, None, 0, fi.sha256, fi.file_size,
+             # url_key
+             "soundgasm.net/testy_user/Best-title-SFW",
+             'alias_added_with_artist_id', 1, 1, 'skitty-gwa']
             )
 
     with GWARipper() as gwa:
@@ -352,7 +370,8 @@ def test_add_to_db(setup_db_2col_5audio):
             [8, 2, time.strftime("%Y-%m-%d"), "This is another description",
              "generated [file] [name].mp3",
              "Best title [SFW]", fi.page_url,
-             7, None, 0, fi.author, None, None, None]
+             7, None, 0, fi.sha256, fi.file_size,
+             canonical_url(fi.page_url), fi.author, None, None, None]
             )
 
     assert get_all_rowtuples_db(
@@ -374,7 +393,8 @@ def test_add_to_db(setup_db_2col_5audio):
             [9, None, time.strftime("%Y-%m-%d"), "This is another description",
              "filename name ... [file] [name].mp3",
              "Best title [SFW]", fi.page_url,
-             8, None, 0, fi.author, None, None, None]
+             8, None, 0, fi.sha256, fi.file_size,
+             canonical_url(fi.page_url), fi.author, None, None, None]
             )
 
     assert get_all_rowtuples_db(
@@ -397,7 +417,8 @@ def test_add_to_db(setup_db_2col_5audio):
             [10, None, time.strftime("%Y-%m-%d"), "This is another description",
              "filename name ... [file] [name].mp3",
              "Best title [SFW]", fi.page_url,
-             5, None, 0, fi.author, 2, 2, fi.author]
+             5, None, 0, fi.sha256, fi.file_size,
+             canonical_url(fi.page_url), fi.author, 2, 2, fi.author]
             )
 
     assert get_all_rowtuples_db(
@@ -448,7 +469,10 @@ def test_add_to_db_ri(setup_db_2col_5audio):
     expected = [
             [3, "https://www.reddit.com/r/subr/comments/r3dd1t1d/foo-bar-baz",
              #                            v-ri_id  v-alias_id
-             ri.id, ri.title, ri.subpath, 3, None, 6, ri.created_utc,
+             ri.id, ri.title, ri.subpath, 3, None, 6,
+             # url_key
+             "reddit.com/comments/r3dd1t1d",
+             ri.created_utc,
              1, 1337, ri.selftext,
              ri.author, 3, 3, ri.author]
     ]
@@ -487,7 +511,8 @@ def test_add_to_db_ri(setup_db_2col_5audio):
     expected.append(
         [4, 'https://www.reddit.com' + ri.permalink,
          #                subpath
-         ri.id, ri.title, ri.title[:70], 4, None, 5, ri.created_utc,
+         ri.id, ri.title, ri.title[:70], 4, None, 5,
+         canonical_url('https://www.reddit.com' + ri.permalink), ri.created_utc,
          1, 1337, ri.selftext,
          ri.author, 2, 2, ri.author]
     )
@@ -511,7 +536,8 @@ def test_add_to_db_ri(setup_db_2col_5audio):
 
     expected.append(
         [5, 'https://www.reddit.com' + ri.permalink,
-         ri.id, ri.title, "", 5, None, 1, ri.created_utc,
+         ri.id, ri.title, "", 5, None, 1,
+         canonical_url('https://www.reddit.com' + ri.permalink), ri.created_utc,
          1, 1337, ri.selftext,
          DELETED_USR_FOLDER, None, None, None]
     )
@@ -603,8 +629,9 @@ def test_already_downloaded(monkeypatch, setup_db_2col_5audio):
                    "https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4M",
                    *([None] * 5))
 
-    db_con.execute("UPDATE AudioFile SET url = ? WHERE id = 2",
-                   ('direct_url_used_for_already_downloaded',))
+    db_con.execute("UPDATE AudioFile SET url = ?, url_key = ? WHERE id = 2",
+                   ('direct_url_used_for_already_downloaded',
+                    'direct_url_used_for_already_downloaded'))
     fi2 = FileInfo(object, True, "m4a", None,  # url none
                    # both url and direct_url should be used for checking in db
                    'direct_url_used_for_already_downloaded',
@@ -790,13 +817,15 @@ def test_download_file(monkeypatch, caplog, setup_db_2col_5audio):
         'already_downloaded': ((fi,), {}),
         'generate_filename': ((None, 2), {}),
         'pad_filename': (
-            (abs_subpath, generate_filename_ret[1], generate_filename_ret[2]), {}),
+            (abs_subpath, generate_filename_ret[1], generate_filename_ret[2], set()), {}),
         # is_audio -> using context manager to commit or rollback
         'db_con__enter__': True,
         'db_con__exit__': True,
         'add_to_db': ((fi, None, fn), {}),
         'download_in_chunks': (
-            (fi.direct_url, os.path.join(abs_subpath, fn)), {'headers': {}, 'prog_bar': True}),
+            (fi.direct_url, os.path.join(abs_subpath, fn)),
+            {'headers': {}, 'prog_bar': True, 'digest': ANY,
+             'before_request': ANY}),
     }
 
     # download logging call using dl_idx and dl_max
@@ -828,9 +857,11 @@ def test_download_file(monkeypatch, caplog, setup_db_2col_5audio):
         'already_downloaded': ((fi,), {}),
         'generate_filename': ((None, 2), {}),
         'pad_filename': (
-            (abs_subpath, generate_filename_ret[1], generate_filename_ret[2]), {}),
+            (abs_subpath, generate_filename_ret[1], generate_filename_ret[2], set()), {}),
         'download_in_chunks': (
-            (fi.direct_url, os.path.join(abs_subpath, fn)), {'headers': {}, 'prog_bar': True}),
+            (fi.direct_url, os.path.join(abs_subpath, fn)),
+            {'headers': {}, 'prog_bar': True, 'digest': ANY,
+             'before_request': ANY}),
     }
 
     # download logging call using dl_idx and dl_max
@@ -861,13 +892,15 @@ def test_download_file(monkeypatch, caplog, setup_db_2col_5audio):
         'already_downloaded': ((fi,), {}),
         'generate_filename': ((None, 2), {}),
         'pad_filename': (
-            (abs_subpath, generate_filename_ret[1], generate_filename_ret[2]), {}),
+            (abs_subpath, generate_filename_ret[1], generate_filename_ret[2], set()), {}),
         # is_audio -> using context manager to commit or rollback
         'db_con__enter__': True,
         'db_con__exit__': True,
         'add_to_db': ((fi, None, fn), {}),
         'download_in_chunks': (
-            (fi.direct_url, os.path.join(abs_subpath, fn)), {'headers': {}, 'prog_bar': True}),
+            (fi.direct_url, os.path.join(abs_subpath, fn)),
+            {'headers': {}, 'prog_bar': True, 'digest': ANY,
+             'before_request': ANY}),
     }
 
     # download logging call using dl_idx and dl_max
@@ -891,13 +924,12 @@ def test_download_file(monkeypatch, caplog, setup_db_2col_5audio):
         'already_downloaded': ((fi,), {}),
         'generate_filename': ((None, 2), {}),
         'pad_filename': (
-            (abs_subpath, generate_filename_ret[1], generate_filename_ret[2]), {}),
-        # is_audio -> using context manager to commit or rollback
-        'db_con__enter__': True,
-        'db_con__exit__': True,
-        'add_to_db': ((fi, None, fn), {}),
+            (abs_subpath, generate_filename_ret[1], generate_filename_ret[2], set()), {}),
+        # failed download -> file is never added to the DB
         'download_in_chunks': (
-            (fi.direct_url, os.path.join(abs_subpath, fn)), {'headers': {}, 'prog_bar': True}),
+            (fi.direct_url, os.path.join(abs_subpath, fn)),
+            {'headers': {}, 'prog_bar': True, 'digest': ANY,
+             'before_request': ANY}),
     }
 
     #
@@ -998,6 +1030,34 @@ def test_download_file(monkeypatch, caplog, setup_db_2col_5audio):
     assert (f"URL Error for {fi.direct_url}: Reason for error!\nExtractor "
             f"{fi.extractor} is probably broken!") in caplog.records[1].message
 
+    called_with.clear()
+    caplog.clear()
+
+    #
+    # timeouts
+    #
+    download_sould_raise = urllib.error.URLError(socket.timeout("timed out"))
+    assert gwa._download_file(fi, author_name='author_name', top_collection=None,
+                              file_index=2, dl_idx=7, dl_max=120) is None
+    assert fi.downloaded is DownloadErrorCode.TIMED_OUT
+    assert called_with == exc_tests_called_with
+    assert caplog.records[1].message == f"Timed out while connecting to {fi.direct_url}"
+
+    called_with.clear()
+    caplog.clear()
+
+    download_sould_raise = DeadlineExceeded("Exceeded the deadline")
+    assert gwa._download_file(fi, author_name='author_name', top_collection=None,
+                              file_index=2, dl_idx=7, dl_max=120) is None
+    assert fi.id_in_db is None
+    assert fi.downloaded is DownloadErrorCode.TIMED_OUT
+    assert called_with == exc_tests_called_with
+    assert caplog.records[1].message == (
+        f"Timed out while downloading {fi.direct_url}: Exceeded the deadline")
+
+    called_with.clear()
+    caplog.clear()
+
     #
     # ExternalError
     #
@@ -1455,6 +1515,304 @@ def test_extract_and_download(setup_tmpdir, monkeypatch, caplog):
                 f"Skipping URL '{urls[4]}' due to broken extractor: Eraudica")
 
 
+def test_download_file_same_url_concurrently(setup_tmpdir, monkeypatch):
+    import threading
+
+    tmpdir = setup_tmpdir
+    downloads = []
+
+    def patched_dl(self, info, mypath, filename):
+        downloads.append(info)
+        open(os.path.join(mypath, filename), "w").close()
+
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._download_file_http', patched_dl)
+    monkeypatch.setattr('gwaripper.gwaripper.update_meta_tags', lambda *args: None)
+
+    already_downloaded = GWARipper.already_downloaded
+
+    def slow_already_downloaded(self, info):
+        result = already_downloaded(self, info)
+        # the first worker finishes its download in the meantime
+        if info.page_url.startswith("http:"):
+            time.sleep(0.2)
+        return result
+
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper.already_downloaded',
+                        slow_already_downloaded)
+
+    # same post with different url variants
+    infos = [FileInfo(SoundgasmExtractor, True, "m4a", url, url + ".m4a", None,
+                      "title", None, "author")
+             for url in ("http://soundgasm.net/u/author/title",
+                         "https://www.soundgasm.net/u/author/title")]
+    with GWARipper(max_workers=2) as gwa:
+        threads = [threading.Thread(target=gwa._download_file, args=(fi, fi.author, None))
+                   for fi in infos]
+        for t in threads:
+            t.start()
+            time.sleep(0.05)
+        for t in threads:
+            t.join()
+
+    assert len(downloads) == 1
+    assert [fi.downloaded for fi in infos] == [
+        DownloadErrorCode.DOWNLOADED, DownloadErrorCode.SKIPPED_DUPLICATE]
+    assert get_all_rowtuples_db(
+        os.path.join(tmpdir, "gwarip_db.sqlite"),
+        "SELECT count(*) FROM AudioFile WHERE url_key = 'soundgasm.net/u/author/title'") == [
+            (1,)]
+
+
+def test_download_all_concurrent(setup_tmpdir, monkeypatch):
+    import threading
+    from gwaripper.extractors.whyp import WhypExtractor
+
+    urls = [f"https://soundgasm.net/u/user/title-{i}" for i in range(6)] + [
+            f"https://whyp.it/tracks/{i}/title" for i in range(6)]
+
+    def patched_extract(cls, url, **kwargs):
+        extractor = SoundgasmExtractor if "soundgasm" in url else WhypExtractor
+        fi = FileInfo(extractor, True, "m4a", url, url + "/file.m4a", None,
+                      url.rsplit("-", 1)[-1], None, "author")
+        report = ExtractorReport(url, ExtractorErrorCode.NO_ERRORS)
+        fi.report = report
+        return fi, report
+
+    monkeypatch.setattr('gwaripper.extractors.base.BaseExtractor.extract',
+                        classmethod(patched_extract))
+
+    lock = threading.Lock()
+    active = {}
+    max_active = {}
+
+    def patched_dl(self, info, mypath, filename):
+        with lock:
+            active[info.extractor] = active.get(info.extractor, 0) + 1
+            max_active[info.extractor] = max(
+                max_active.get(info.extractor, 0), active[info.extractor])
+        time.sleep(0.05)
+        with lock:
+            active[info.extractor] -= 1
+        open(os.path.join(mypath, filename), "w").close()
+
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._download_file_http', patched_dl)
+    monkeypatch.setattr('gwaripper.gwaripper.update_meta_tags', lambda *args: None)
+    # only test the concurrency limit
+    monkeypatch.setattr('gwaripper.extractors.base._rate_limiter', KeyedRateLimiter())
+
+    with GWARipper(max_workers=6, max_workers_per_host=2) as gwa:
+        # don't dedup so we can check the order
+        gwa.urls = urls
+        gwa.nr_urls = len(urls)
+        gwa.download_all()
+
+        # reports in the same order as the urls
+        assert [r.url for r in gwa.extractor_reports] == urls
+        assert all(r.download_error_code is DownloadErrorCode.DOWNLOADED
+                   for r in gwa.extractor_reports)
+        assert max_active[SoundgasmExtractor] == 2
+        assert max_active[WhypExtractor] == 2
+
+        # every file was added to the db in its own transaction
+        rows = gwa.db_con.execute("SELECT url FROM AudioFile ORDER BY url").fetchall()
+        assert sorted(r[0] for r in rows) == sorted(urls)
+
+
+def test_download_all_pipeline(setup_tmpdir, monkeypatch):
+    import threading
+
+    urls = [f"https://soundgasm.net/u/user/title-{i}" for i in range(6)]
+    urls.insert(2, "https://soundgasm.net/u/user/broken")
+    urls.insert(4, "https://soundgasm.net/u/collector/collection")
+
+    lock = threading.Lock()
+    extract_done = []
+    downloads = []
+
+    def patched_extract(cls, url, **kwargs):
+        time.sleep(0.05)
+        report = ExtractorReport(url, ExtractorErrorCode.NO_ERRORS)
+        if url.endswith("broken"):
+            report.err_code = ExtractorErrorCode.BROKEN_EXTRACTOR
+            result = None
+        elif url.endswith("collection"):
+            result = FileCollection(SoundgasmExtractor, url, None, "collection", "collector")
+            for i in range(3):
+                result.add_file(FileInfo(
+                    SoundgasmExtractor, True, "m4a", f"{url}/part-{i}",
+                    f"{url}/part-{i}/file.m4a", None, f"part-{i}", None, f"part_author{i}"))
+        else:
+            result = FileInfo(SoundgasmExtractor, True, "m4a", url, url + "/file.m4a", None,
+                              url.rsplit("-", 1)[-1], None, "author")
+        if result is not None:
+            result.report = report
+        with lock:
+            extract_done.append(time.monotonic())
+        return result, report
+
+    def patched_dl(self, info, mypath, filename):
+        with lock:
+            downloads.append((info.page_url, mypath, threading.current_thread().name,
+                              time.monotonic()))
+        time.sleep(0.05)
+        open(os.path.join(mypath, filename), "w").close()
+
+    monkeypatch.setattr('gwaripper.extractors.base.BaseExtractor.extract',
+                        classmethod(patched_extract))
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._download_file_http', patched_dl)
+    monkeypatch.setattr('gwaripper.gwaripper.update_meta_tags', lambda *args: None)
+    monkeypatch.setattr('gwaripper.extractors.base._rate_limiter', KeyedRateLimiter())
+
+    with GWARipper(max_workers=2, extract_workers=2) as gwa:
+        gwa.urls = urls
+        gwa.nr_urls = len(urls)
+        gwa.download_all()
+
+        # reports in the same order as the urls
+        assert [r.url for r in gwa.extractor_reports] == urls
+        assert gwa.extractor_reports[2].err_code is ExtractorErrorCode.BROKEN_EXTRACTOR
+        assert gwa.extractor_reports[2].download_error_code is DownloadErrorCode.NOT_DOWNLOADED
+        assert all(r.download_error_code in (DownloadErrorCode.DOWNLOADED,
+                                             DownloadErrorCode.NO_ERRORS)
+                   for i, r in enumerate(gwa.extractor_reports) if i != 2)
+
+    # first download started before the extraction stage was finished
+    assert min(started for *_, started in downloads) < max(extract_done)
+    # 6 files + 3 in the collection
+    assert len(downloads) == 9
+
+    # collection was downloaded as a unit by one worker into the collection author's folder
+    col_dls = [dl for dl in downloads if "/part-" in dl[0]]
+    assert len(col_dls) == 3
+    assert len({thread for _, _, thread, _ in col_dls}) == 1
+    assert {mypath for _, mypath, _, _ in col_dls} == {
+        os.path.join(setup_tmpdir, "collector", "collection")}
+
+
+def test_download_file_content_duplicates(setup_db_2col_5audio, monkeypatch):
+    tmpdir, test_db_fn = setup_db_2col_5audio
+    contents = {}
+
+    def patched_dl(self, info, mypath, filename):
+        with open(os.path.join(mypath, filename), "wb") as f:
+            f.write(contents[info.page_url])
+        digest = ContentDigest()
+        digest.update(contents[info.page_url])
+        info.sha256, info.file_size = digest.hexdigest(), digest.size
+
+    tagged = []
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._download_file_http', patched_dl)
+    monkeypatch.setattr('gwaripper.gwaripper.update_meta_tags',
+                        lambda path, *args: tagged.append(path))
+
+    def file_info(url, author):
+        fi = FileInfo(object, True, "m4a", url, url + ".m4a", None, url.rsplit("/", 1)[-1],
+                      None, author)
+        contents[url] = b"mirrored audio" if "mirror" in url else b"other audio"
+        return fi
+
+    original = file_info("https://soundgasm.net/u/author/mirror", "author")
+    mirror = file_info("https://whyp.it/tracks/1/mirror", "whyp_author")
+    other = file_info("https://whyp.it/tracks/2/other", "whyp_author")
+
+    with GWARipper() as gwa:
+        for fi in (original, mirror, other):
+            assert gwa._download_file(fi, fi.author, None) == ""
+            assert fi.downloaded is DownloadErrorCode.DOWNLOADED
+
+    original_path = os.path.join(tmpdir, "author", "mirror.m4a")
+    mirror_path = os.path.join(tmpdir, "whyp_author", "mirror.m4a")
+    # same content -> hardlinked and tags of the original are kept
+    assert os.path.samefile(original_path, mirror_path)
+    assert not os.path.samefile(mirror_path, os.path.join(tmpdir, "whyp_author", "other.m4a"))
+    assert mirror_path not in tagged
+    assert len(tagged) == 2
+
+    rows = get_all_rowtuples_db(
+        test_db_fn, "SELECT url, sha256, file_size FROM AudioFile WHERE id > 6 ORDER BY id")
+    assert rows == [(fi.page_url, fi.sha256, fi.file_size) for fi in (original, mirror, other)]
+    assert rows[0][1:] == rows[1][1:] == (
+        hashlib.sha256(b"mirrored audio").hexdigest(), len(b"mirrored audio"))
+
+    # duplicate is found using the DB in later runs
+    monkeypatch.setitem(cfg.config["Settings"], "content_duplicates", "skip")
+    skipped = file_info("https://soundgasm.net/u/other_author/mirror", "other_author")
+    with GWARipper() as gwa:
+        assert gwa._download_file(skipped, skipped.author, None) is None
+    assert skipped.downloaded is DownloadErrorCode.SKIPPED_DUPLICATE
+    assert not os.path.exists(os.path.join(tmpdir, "other_author", "mirror.m4a"))
+    # url is recorded with a row that points to the kept file
+    db_con, _ = load_or_create_sql_db(test_db_fn)
+    row = db_con.execute("SELECT * FROM v_audio_and_collection_combined WHERE url = ?",
+                         (skipped.page_url,)).fetchone()
+    db_con.close()
+    assert audio_file_path(tmpdir, row) == original_path
+
+    downloads = []
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._download_file_http',
+                        lambda self, info, *args: downloads.append(info))
+    again = file_info("https://soundgasm.net/u/other_author/mirror", "other_author")
+    with GWARipper() as gwa:
+        assert gwa._download_file(again, again.author, None) is None
+    assert again.downloaded is DownloadErrorCode.SKIPPED_DUPLICATE
+    assert not downloads
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._download_file_http', patched_dl)
+
+    # duplicate of a file of this run that only gets added to its collection afterwards
+    in_col = file_info("https://soundgasm.net/u/col_author/col_file", "col_author")
+    col_dup = file_info("https://whyp.it/tracks/3/col_file", "whyp_author")
+    contents[in_col.page_url] = contents[col_dup.page_url] = b"collection audio"
+    col = FileCollection(object, "https://imgur.com/a/dedupcol", "dedupcol", "Collection",
+                         "col_author", children=[in_col])
+    in_col.parent = col
+    with GWARipper() as gwa:
+        gwa._download_file(in_col, "col_author", col)
+        assert gwa._download_file(col_dup, col_dup.author, None) is None
+        with gwa._db_lock, gwa.db_con:
+            gwa._add_to_db_collection(col, "col_author")
+    db_con, _ = load_or_create_sql_db(test_db_fn)
+    rows = db_con.execute("SELECT * FROM v_audio_and_collection_combined WHERE url IN (?, ?) "
+                          "ORDER BY id", (in_col.page_url, col_dup.page_url)).fetchall()
+    db_con.close()
+    assert rows[0]["collection_id"] == rows[1]["collection_id"] == col.id_in_db
+    assert audio_file_path(tmpdir, rows[0]) == audio_file_path(tmpdir, rows[1])
+    assert os.path.isfile(audio_file_path(tmpdir, rows[1]))
+
+    monkeypatch.setitem(cfg.config["Settings"], "content_duplicates", "keep")
+    kept = file_info("https://soundgasm.net/u/other_author/kept_mirror", "other_author")
+    with GWARipper() as gwa:
+        assert gwa._download_file(kept, kept.author, None) == ""
+    assert not os.path.samefile(os.path.join(tmpdir, "other_author", "kept_mirror.m4a"),
+                                original_path)
+
+
+def test_backfill_content_hashes(setup_db_2col_5audio):
+    tmpdir, test_db_fn = setup_db_2col_5audio
+
+    db_con, _ = load_or_create_sql_db(test_db_fn)
+    rows = db_con.execute(
+        "SELECT * FROM v_audio_and_collection_combined WHERE id IN (1, 4) ORDER BY id"
+    ).fetchall()
+    # file in a collection's subpath and a single file
+    assert audio_file_path(tmpdir, rows[1]) == os.path.join(
+        tmpdir, "skitty", "Lonely Kitty.mp3")
+    for row in rows:
+        path = audio_file_path(tmpdir, row)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(row["filename"].encode("utf-8"))
+
+    assert backfill_content_hashes(db_con, tmpdir, batch_size=1) == (2, 4)
+    # only rows without a hash are considered
+    assert backfill_content_hashes(db_con, tmpdir) == (0, 4)
+    db_con.close()
+
+    assert get_all_rowtuples_db(
+        test_db_fn, "SELECT id, sha256, file_size FROM AudioFile WHERE sha256 IS NOT NULL"
+    ) == [(row["id"], hashlib.sha256(row["filename"].encode("utf-8")).hexdigest(),
+           len(row["filename"].encode("utf-8"))) for row in rows]
+
+
 class DummySub:
     permalink = 'permalink'
 
@@ -1674,3 +2032,141 @@ def test_write_report(setup_tmpdir):
                          f"report_{time.strftime('%Y-%m-%dT%Hh%Mm')}.html"),
             "r") as f:
         assert expected_str == f.read()
+
+
+def test_download_all_streams_submissions(setup_tmpdir, monkeypatch):
+    import threading
+    from types import SimpleNamespace
+
+    lock = threading.Lock()
+    events = []
+
+    def listing(nr):
+        for i in range(nr):
+            if i % 5 == 0:
+                # next listing page
+                time.sleep(0.02)
+            with lock:
+                events.append(("pulled", i))
+            yield SimpleNamespace(id=f"sub{i}",
+                                  permalink=f"/r/gonewildaudio/comments/sub{i}/title/")
+
+    def patched_extract_sub(self, sub, reddit_url="https://www.reddit.com"):
+        url = f"{reddit_url}{sub.permalink}"
+        report = ExtractorReport(url, ExtractorErrorCode.NO_ERRORS)
+        fi = FileInfo(SoundgasmExtractor, True, "m4a", url, url + "file.m4a", None,
+                      sub.id, None, "author")
+        fi.report = report
+        return url, fi, report
+
+    def patched_dl(self, info, mypath, filename):
+        with lock:
+            events.append(("download", info.title))
+        time.sleep(0.02)
+        open(os.path.join(mypath, filename), "w").close()
+
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._extract_submission',
+                        patched_extract_sub)
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._download_file_http', patched_dl)
+    monkeypatch.setattr('gwaripper.gwaripper.update_meta_tags', lambda *args: None)
+
+    nr_subs = 40
+    with GWARipper(max_workers=2, extract_workers=2) as gwa:
+        gwa.download_all(listing(nr_subs))
+        assert [r.url for r in gwa.extractor_reports] == [
+            f"https://www.reddit.com/r/gonewildaudio/comments/sub{i}/title/"
+            for i in range(nr_subs)]
+
+    kinds = [kind for kind, _ in events]
+    assert kinds.count("download") == nr_subs
+    # downloads started before the listing was consumed
+    assert kinds.index("download") < max(i for i, kind in enumerate(kinds) if kind == "pulled")
+    # the listing never gets far ahead of the downloads:
+    # 2 * extract_workers pending + 2 * max_workers queued + max_workers downloading
+    pulled = downloaded = 0
+    for kind, _ in events:
+        if kind == "pulled":
+            pulled += 1
+            assert pulled - downloaded <= 4 + 4 + 2 + 1
+        else:
+            downloaded += 1
+
+
+def test_collection_extractor_skips_known_urls(setup_db_2col_5audio, monkeypatch):
+    from gwaripper.extractors.soundgasm import SoundgasmUserExtractor
+    known = ["https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4M",
+             "https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4F"]
+    new = "https://soundgasm.net/u/skitty/New-Audio"
+    user_page = "".join(f'<div class="sound-details"><a href="{url}">t</a></div>'
+                        for url in (known[0], new, known[1]))
+    with open(os.path.join(TESTS_DIR, "all_test_files", "html", "soundgasm_file.html"),
+              "r", encoding="utf-8") as f:
+        file_page = f.read()
+    fetched = []
+
+    def get_html(cls, url, additional_headers=None):
+        fetched.append(url)
+        return (user_page if url.endswith("/skitty") else file_page), None
+
+    monkeypatch.setattr(SoundgasmUserExtractor, "get_html", classmethod(get_html))
+    monkeypatch.setattr(SoundgasmExtractor, "get_html", classmethod(get_html))
+
+    with GWARipper() as gwa:
+        assert gwa.is_known_url(known[0])
+        assert not gwa.is_known_url(new)
+        fcol, report = SoundgasmUserExtractor.extract("https://soundgasm.net/u/skitty")
+
+    # only the user page and the page of the new file were requested
+    assert fetched == ["https://soundgasm.net/u/skitty", new]
+    assert [fi.page_url for fi in fcol.children] == [new]
+    # skipped files still count, so the same sub-directory is used as before
+    assert fcol.nr_files == 3
+    assert report.err_code is ExtractorErrorCode.NO_ERRORS
+    assert {(r.url, r.download_error_code) for r in report.children} == {
+        (known[0], DownloadErrorCode.SKIPPED_DUPLICATE),
+        (known[1], DownloadErrorCode.SKIPPED_DUPLICATE),
+        (new, DownloadErrorCode.NOT_DOWNLOADED)}
+
+    # check is removed once the GWARipper exits
+    fetched.clear()
+    fcol, report = SoundgasmUserExtractor.extract("https://soundgasm.net/u/skitty")
+    assert len(fetched) == 4
+    assert fcol.nr_files == 3
+
+
+def test_already_downloaded_uses_index(setup_db_2col_5audio, monkeypatch):
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._download_file_http',
+                        lambda self, info, mypath, filename: open(
+                            os.path.join(mypath, filename), "w").close())
+    monkeypatch.setattr('gwaripper.gwaripper.update_meta_tags', lambda *args: None)
+    known = "https://soundgasm.net/u/skitty/Motherly-Moth-Girl-Keeps-You-Warm-F4M"
+    new = "https://soundgasm.net/u/skitty/New-Audio"
+
+    with GWARipper() as gwa:
+        # 6 audio files and 2 collections
+        assert len(gwa.known_urls) == 8
+        queries = []
+        gwa.db_con.set_trace_callback(queries.append)
+
+        def file_info(url):
+            return FileInfo(SoundgasmExtractor, True, "m4a", url, url + ".m4a", None,
+                            "title", None, "skitty")
+
+        assert not gwa.already_downloaded(file_info(new))
+        assert not gwa.is_known_url(new)
+        assert queries == []
+        assert gwa.already_downloaded(file_info(known))
+        assert gwa.is_known_url(known)
+        assert len(queries) == 2
+        # differently spelled urls of the same page are found as well
+        variant = known.replace("https://soundgasm", "http://www.soundgasm").replace(
+            "/u/", "/user/") + "/"
+        assert gwa.already_downloaded(file_info(variant))
+        assert gwa.is_known_url(variant)
+        assert len(queries) == 4
+
+        # new downloads are added once they're committed
+        gwa.download(file_info(new))
+        assert gwa.known_urls.might_contain(canonical_url(new))
+        assert gwa.already_downloaded(file_info(new))
+        gwa.db_con.set_trace_callback(None)
@@ -0,0 +1,144 @@
+import pytest
+import os
+
+import bs4
+
+import gwaripper.config as cfg
+
+from gwaripper import html_parse
+from gwaripper.html_parse import find_links, text_content, get_parser
+from gwaripper.extractors.soundgasm import SoundgasmExtractor, SoundgasmUserExtractor
+from utils import TESTS_DIR
+
+HTML_DIR = os.path.join(TESTS_DIR, "all_test_files", "html")
+# pages saved from the live sites using dev_tools/bench_html_parse.py record
+RECORDED_DIR = os.path.join(HTML_DIR, "recorded")
+
+
+def read_page(name):
+    path = os.path.join(RECORDED_DIR, name)
+    if not os.path.isfile(path):
+        path = os.path.join(HTML_DIR, name)
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def soundgasm_fields_bs4(page):
+    soup = bs4.BeautifulSoup(page, "html.parser")
+    return (soup.select_one("div.jp-title").text,
+            soup.select_one("div.jp-description > p").text)
+
+
+def soundgasm_user_files_bs4(page):
+    soup = bs4.BeautifulSoup(page, "html.parser")
+    return [a["href"] for a in soup.select("div.sound-details > a")]
+
+
+def test_get_parser(monkeypatch):
+    monkeypatch.setattr(html_parse, "LXML_AVAILABLE", False)
+    assert get_parser() == "html.parser"
+    monkeypatch.setitem(cfg.config["Settings"], "html_parser", "lxml")
+    # not installed
+    assert get_parser() == "html.parser"
+
+    monkeypatch.setattr(html_parse, "LXML_AVAILABLE", True)
+    assert get_parser() == "lxml"
+    monkeypatch.setitem(cfg.config["Settings"], "html_parser", "auto")
+    assert get_parser() == "lxml"
+    monkeypatch.setitem(cfg.config["Settings"], "html_parser", "html.parser")
+    assert get_parser() == "html.parser"
+
+
+def test_text_content():
+    assert text_content("a <em>b</em> &amp; c<br/>&lt;3") == "a b & c<3"
+
+
+def test_find_links_same_as_bs4():
+    selftext = read_page("reddit_selftext.html")
+    soup = bs4.BeautifulSoup(selftext, "html.parser")
+    expected = [(a["href"], a.text) for a in soup.select("a[href]")]
+    assert len(expected) > 10
+    assert find_links(selftext) == expected
+
+    assert find_links("<p><a href='single'>quotes</a> <A HREF=\"up\">per</A></p>") == [
+        ("single", "quotes"), ("up", "per")]
+    # unquoted href or missing closing tag -> fall back to bs4
+    assert find_links('<a href=unquoted>link</a>') is None
+    assert find_links('<a href="https://soundgasm.net">link') is None
+
+
+def test_soundgasm_fast_paths_same_as_bs4():
+    page = read_page("soundgasm_file.html")
+    expected = soundgasm_fields_bs4(page)
+    assert SoundgasmExtractor.parse_title_descr_fast(page) == expected
+    assert expected[0] and expected[1]
+
+    page = read_page("soundgasm_user.html")
+    expected = soundgasm_user_files_bs4(page)
+    assert expected
+    assert SoundgasmUserExtractor.parse_user_files_fast(page) == expected
+
+
+def test_soundgasm_fast_paths_validated():
+    page = read_page("soundgasm_file.html")
+    # a second title container -> unclear which one the selector would use
+    assert SoundgasmExtractor.parse_title_descr_fast(
+        page.replace('<div class="jp-title"', '<div class="jp-title"></div>\n'
+                     '<div class="jp-title extra"', 1)) is None
+
+    page = read_page("soundgasm_user.html")
+    # markup of only some of the files changed -> regex misses them
+    changed = page.replace('<div class="sound-details"><a ',
+                           '<div class="sound-details"><span></span><a ', 3)
+    assert changed != page
+    assert SoundgasmUserExtractor.parse_user_files_fast(changed) is None
+    assert soundgasm_user_files_bs4(changed) == soundgasm_user_files_bs4(page)
+    # empty user page
+    assert SoundgasmUserExtractor.parse_user_files_fast("<html></html>") == []
+
+
+def test_soundgasm_user_extract_falls_back_to_bs4(monkeypatch):
+    page = read_page("soundgasm_user.html")
+    changed = page.replace('<div class="sound-details"><a ',
+                           '<div class="sound-details"><span></span><a ', 3)
+    monkeypatch.setattr(SoundgasmUserExtractor, "get_html",
+                        classmethod(lambda cls, url, hdrs=None: (changed, 200)))
+    extracted = []
+    monkeypatch.setattr(SoundgasmUserExtractor, "skip_known_urls",
+                        lambda self, urls, fcol, report: extracted.extend(urls) or [])
+    SoundgasmUserExtractor("https://soundgasm.net/u/testuser")._extract()
+    assert extracted == soundgasm_user_files_bs4(page)
+
+
+@pytest.mark.sgasm
+def test_soundgasm_fast_paths_live_pages():
+    # make sure the fast paths still match the markup of the real site
+    for url, bs4_version, fast_path in (
+            ("https://soundgasm.net/u/kinkyshibby/F4M-Queen-of-the-Black-Coast-Pirate-Queen-"
+             "Barbarian-Warrior-Seduction-Erotic-Dance-Sultry-Seriously-Extremely-Sultry-"
+             "Exhibitionism-Mild-Fdom-Creampie-Script-Fill",
+             soundgasm_fields_bs4, SoundgasmExtractor.parse_title_descr_fast),
+            ("https://soundgasm.net/u/DDCherryB",
+             soundgasm_user_files_bs4, SoundgasmUserExtractor.parse_user_files_fast)):
+        page, _ = SoundgasmExtractor.get_html(url)
+        assert page
+        assert fast_path(page) == bs4_version(page)
+
+
+def test_soundgasm_extract_falls_back_to_bs4(monkeypatch):
+    page = read_page("soundgasm_file.html")
+    # markup changed so the regex doesn't match anymore, but the selector still does
+    changed = page.replace('<div class="jp-title"', '<div class="jp-title new-class"', 1)
+    changed = changed.replace('<div class="jp-description"',
+                              '<div class="jp-description">\n<span></span', 1)
+    assert SoundgasmExtractor.parse_title_descr_fast(changed) is None
+
+    url = "https://soundgasm.net/u/testuser/Sleepy-cuddles"
+    results = []
+    for html in (page, changed):
+        monkeypatch.setattr(SoundgasmExtractor, "get_html",
+                            classmethod(lambda cls, url, hdrs=None: (html, 200)))
+        fi, _ = SoundgasmExtractor(url)._extract()
+        results.append((fi.title, fi.descr, fi.direct_url))
+    assert results[0] == results[1]
+    assert results[0][2].endswith(".m4a")
@@ -0,0 +1,113 @@
+import pytest
+import os
+import time
+
+import gwaripper.config as cfg
+
+from gwaripper.http_cache import HTTPCache, get_cache
+from gwaripper.download import download_text
+from gwaripper.utils import KeyedRateLimiter
+from gwaripper.extractors.soundgasm import SoundgasmExtractor
+from utils import setup_tmpdir, local_http_server
+
+
+def test_download_text_cache(setup_tmpdir, local_http_server):
+    server = local_http_server
+    server.files["/page"] = "<html>cached ü</html>".encode("utf-8")
+    server.etags["/page"] = '"v1"'
+    cache = HTTPCache(os.path.join(setup_tmpdir, "_cache"))
+    url = server.url("/page")
+    requests_sent = []
+
+    def fetch(ttl):
+        return download_text({"User-Agent": "test"}, url, cache=cache, cache_ttl=ttl,
+                             before_request=lambda: requests_sent.append(1))
+
+    assert fetch(60) == ("<html>cached ü</html>", None)
+    assert len(server.requests) == 1
+    # fresh -> served from the cache without a request
+    assert fetch(60) == ("<html>cached ü</html>", None)
+    assert len(server.requests) == 1
+    assert len(requests_sent) == 1
+
+    # expired -> revalidated using the etag
+    assert fetch(0) == ("<html>cached ü</html>", None)
+    assert len(server.requests) == 2
+    assert server.requests[-1][2]["If-None-Match"] == '"v1"'
+    assert len(requests_sent) == 2
+    # revalidation made the response fresh again
+    assert fetch(60) == ("<html>cached ü</html>", None)
+    assert len(server.requests) == 2
+
+    # changed on the server
+    server.files["/page"] = b"<html>new</html>"
+    server.etags["/page"] = '"v2"'
+    assert fetch(0) == ("<html>new</html>", None)
+    assert fetch(60) == ("<html>new</html>", None)
+    assert len(server.requests) == 3
+
+    # different headers are cached separately
+    assert download_text({"User-Agent": "other"}, url, cache=cache, cache_ttl=60) == (
+        "<html>new</html>", None)
+    assert len(server.requests) == 4
+
+    assert cache.stats == {"hits": 3, "revalidated": 1, "misses": 2, "evicted": 0}
+
+    # errors are not cached
+    assert download_text({}, server.url("/missing"), cache=cache, cache_ttl=60) == (None, 404)
+    assert download_text({}, server.url("/missing"), cache=cache, cache_ttl=60) == (None, 404)
+    assert len(server.requests) == 6
+
+
+def test_cache_lru_eviction(setup_tmpdir):
+    cache_dir = os.path.join(setup_tmpdir, "_cache")
+    cache = HTTPCache(cache_dir, max_size=3 * 1024)
+
+    for i in range(3):
+        cache.store(f"url{i}", {}, b"x" * 900, None, None, None)
+        # mtime resolution
+        time.sleep(0.01)
+    # url0 is used most recently -> url1 gets evicted first
+    cache.mark_used(cache.lookup("url0", {}))
+    cache.store("url3", {}, b"x" * 900, None, None, None)
+
+    assert cache.lookup("url1", {}) is None
+    assert cache.lookup("url0", {}).body == b"x" * 900
+    assert cache.stats["evicted"] == 1
+    assert len(os.listdir(cache_dir)) == 3
+
+    # index is rebuilt from the mtimes of the files
+    cache = HTTPCache(cache_dir, max_size=2 * 1024)
+    cache.store("url4", {}, b"x" * 900, None, None, None)
+    assert cache.lookup("url2", {}) is None
+    assert cache.lookup("url0", {}) is None
+    assert sorted(os.listdir(cache_dir)) == sorted(
+        [HTTPCache.make_key(url, {}) for url in ("url3", "url4")])
+
+
+def test_get_html_uses_cache(setup_tmpdir, local_http_server, monkeypatch):
+    server = local_http_server
+    server.files["/u/user/title"] = b"<html></html>"
+    monkeypatch.setattr('gwaripper.extractors.base._rate_limiter', KeyedRateLimiter())
+
+    # disabled by default
+    assert get_cache() is None
+    SoundgasmExtractor.get_html(server.url("/u/user/title"))
+    SoundgasmExtractor.get_html(server.url("/u/user/title"))
+    assert len(server.requests) == 2
+
+    monkeypatch.setitem(cfg.config["Settings"], "http_cache", "True")
+    cache = get_cache()
+    assert cache.cache_dir == os.path.join(setup_tmpdir, "_cache")
+    for _ in range(3):
+        assert SoundgasmExtractor.get_html(server.url("/u/user/title")) == ("<html></html>", None)
+    assert len(server.requests) == 3
+    assert cache.stats["hits"] == 2
+
+    # caching disabled for the extractor in the config
+    cfg.config["CacheTTL"] = {"soundgasm": "None"}
+    try:
+        SoundgasmExtractor.get_html(server.url("/u/user/title"))
+    finally:
+        cfg.config.remove_section("CacheTTL")
+    assert len(server.requests) == 4
@@ -0,0 +1,106 @@
+import pytest
+import socket
+import urllib.error
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+from gwaripper.http_session import Session
+from utils import local_http_server
+
+
+def test_session_reuses_connections(local_http_server):
+    server = local_http_server
+    server.files["/page"] = b"x" * 10_000
+    session = Session()
+
+    for _ in range(5):
+        with session.urlopen(server.url("/page")) as resp:
+            assert resp.read() == server.files["/page"]
+
+    assert session.stats == {"requests": 5, "connections_opened": 1,
+                             "connections_reused": 4}
+    # keep-alive is not disabled
+    assert all(headers.get("Connection") != "close" for _, _, headers in server.requests)
+    session.close()
+
+
+def test_session_chunked_reads_and_errors(local_http_server):
+    server = local_http_server
+    server.files["/page"] = b"x" * 10_000
+    session = Session()
+
+    with session.urlopen(server.url("/page")) as resp:
+        while resp.read(1024):
+            pass
+    # error responses with an empty body don't spoil the connection
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        session.urlopen(server.url("/missing"))
+    exc.value.close()
+    req = urllib.request.Request(server.url("/page"), method="HEAD")
+    with session.urlopen(req) as resp:
+        assert resp.headers["Content-Length"] == "10000"
+    with session.urlopen(server.url("/page")) as resp:
+        resp.read()
+
+    assert session.stats["connections_opened"] == 1
+    assert session.stats["connections_reused"] == 3
+    session.close()
+
+
+def test_session_discards_unusable_connections(local_http_server):
+    server = local_http_server
+    server.files["/page"] = b"x" * 10_000
+    session = Session()
+
+    # closed before the body was read completely
+    with session.urlopen(server.url("/page")) as resp:
+        resp.read(100)
+    # server closes the connection
+    server.httpd.truncate_at["/page"] = 10_000
+    with session.urlopen(server.url("/page")) as resp:
+        resp.read()
+    with session.urlopen(server.url("/page")) as resp:
+        resp.read()
+
+    assert session.stats["connections_opened"] == 3
+    assert session.stats["connections_reused"] == 0
+    session.close()
+
+
+def test_session_reconnects_after_idle_close(local_http_server):
+    server = local_http_server
+    server.files["/page"] = b"data"
+    session = Session()
+
+    with session.urlopen(server.url("/page")) as resp:
+        resp.read()
+    # simulate the server closing the idle connection
+    for conns in session.pool._idle.values():
+        for conn in conns:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+
+    with session.urlopen(server.url("/page")) as resp:
+        assert resp.read() == b"data"
+    assert session.stats == {"requests": 2, "connections_opened": 2,
+                             "connections_reused": 0}
+    session.close()
+
+
+def test_session_concurrent(local_http_server):
+    server = local_http_server
+    server.files["/page"] = b"x" * 50_000
+    session = Session(max_idle_per_host=4)
+
+    def fetch(_):
+        with session.urlopen(server.url("/page")) as resp:
+            return resp.read()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(fetch, range(40)))
+
+    assert all(r == server.files["/page"] for r in results)
+    stats = session.stats
+    assert stats["requests"] == 40
+    assert stats["connections_opened"] <= 8
+    session.close()
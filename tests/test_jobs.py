@@ -0,0 +1,114 @@
+import pytest
+import os
+import threading
+
+from gwaripper.db import load_or_create_sql_db
+from gwaripper.jobs import JobJournal, JobState, get_resumable_urls, count_jobs
+from gwaripper.gwaripper import GWARipper
+from gwaripper.info import FileInfo
+from gwaripper.download import DownloadErrorCode
+from gwaripper.extractors.base import ExtractorReport, ExtractorErrorCode
+from gwaripper.extractors.soundgasm import SoundgasmExtractor
+from gwaripper.utils import KeyedRateLimiter
+from utils import setup_tmpdir
+
+
+def job_states(db_con):
+    return {url: state for url, state in db_con.execute("SELECT url, state FROM Job")}
+
+
+def test_journal_batches_writes(setup_tmpdir):
+    db_con, _ = load_or_create_sql_db(os.path.join(setup_tmpdir, "gwarip_db.sqlite"))
+    journal = JobJournal(db_con, threading.RLock(), batch_size=3, flush_interval=60)
+
+    urls = [f"url{i}" for i in range(4)]
+    journal.add(urls)
+    # queued jobs are written immediately
+    assert job_states(db_con) == {url: "queued" for url in urls}
+
+    journal.set_state("url0", JobState.EXTRACTING)
+    journal.set_state("url0", JobState.DONE)
+    journal.set_state("url1", JobState.FAILED)
+    # not added by the journal -> ignored
+    journal.set_state("other", JobState.DONE)
+    assert set(job_states(db_con).values()) == {"queued"}
+
+    # third pending change -> batch is written
+    journal.set_state("url2", JobState.DOWNLOADING)
+    assert job_states(db_con) == {"url0": "done", "url1": "failed", "url2": "downloading",
+                                  "url3": "queued"}
+
+    journal.set_state("url3", JobState.EXTRACTED)
+    journal.flush()
+    assert job_states(db_con)["url3"] == "extracted"
+
+    assert get_resumable_urls(db_con) == ["url2", "url3"]
+    assert get_resumable_urls(db_con, include_failed=True) == ["url1", "url2", "url3"]
+    assert count_jobs(db_con)[JobState.DONE] == 1
+
+    journal.clear_done()
+    assert "url0" not in job_states(db_con)
+
+    # re-added jobs start over
+    journal.add(["url1"])
+    assert job_states(db_con)["url1"] == "queued"
+    db_con.close()
+
+
+def test_download_all_journal(setup_tmpdir, monkeypatch):
+    urls = [f"https://soundgasm.net/u/user/title-{i}" for i in range(4)]
+
+    def patched_extract(cls, url, **kwargs):
+        if url.endswith("2"):
+            # process gets killed
+            raise KeyboardInterrupt
+        report = ExtractorReport(url, ExtractorErrorCode.NO_ERRORS)
+        if url.endswith("1"):
+            report.err_code = ExtractorErrorCode.BROKEN_EXTRACTOR
+            return None, report
+        fi = FileInfo(SoundgasmExtractor, True, "m4a", url, url + "/file.m4a", None,
+                      url.rsplit("-", 1)[-1], None, "author")
+        fi.report = report
+        return fi, report
+
+    def patched_dl(self, info, mypath, filename):
+        open(os.path.join(mypath, filename), "w").close()
+
+    monkeypatch.setattr('gwaripper.extractors.base.BaseExtractor.extract',
+                        classmethod(patched_extract))
+    monkeypatch.setattr('gwaripper.gwaripper.GWARipper._download_file_http', patched_dl)
+    monkeypatch.setattr('gwaripper.gwaripper.update_meta_tags', lambda *args: None)
+    monkeypatch.setattr('gwaripper.extractors.base._rate_limiter', KeyedRateLimiter())
+
+    with pytest.raises(KeyboardInterrupt):
+        with GWARipper() as gwa:
+            gwa.urls = urls
+            gwa.nr_urls = len(urls)
+            gwa.download_all()
+
+    db_con, _ = load_or_create_sql_db(os.path.join(setup_tmpdir, "gwarip_db.sqlite"))
+    # buffered states were written on exit
+    assert job_states(db_con) == {urls[0]: "done", urls[1]: "failed", urls[2]: "extracting",
+                                  urls[3]: "queued"}
+    assert get_resumable_urls(db_con) == urls[2:]
+    db_con.close()
+
+    def patched_extract_resumed(cls, url, **kwargs):
+        fi = FileInfo(SoundgasmExtractor, True, "m4a", url, url + "/file.m4a", None,
+                      url.rsplit("-", 1)[-1], None, "author")
+        fi.report = ExtractorReport(url, ExtractorErrorCode.NO_ERRORS)
+        return fi, fi.report
+
+    monkeypatch.setattr('gwaripper.extractors.base.BaseExtractor.extract',
+                        classmethod(patched_extract_resumed))
+    with GWARipper() as gwa:
+        gwa.set_urls(urls[2:])
+        gwa.download_all()
+        assert all(r.download_error_code is DownloadErrorCode.DOWNLOADED
+                   for r in gwa.extractor_reports)
+
+    db_con, _ = load_or_create_sql_db(os.path.join(setup_tmpdir, "gwarip_db.sqlite"))
+    # finished jobs are removed, failed ones are kept
+    assert job_states(db_con) == {urls[1]: "failed"}
+    assert get_resumable_urls(db_con) == []
+    db_con.close()
@@ -0,0 +1,19 @@
+import pytest
+
+from gwaripper.known_urls import KnownUrlIndex
+
+
+def test_known_url_index():
+    index = KnownUrlIndex([f"https://soundgasm.net/u/user/{i}" for i in range(100)] +
+                          ["https://soundgasm.net/u/user/0"])
+    assert len(index) == 101
+    assert index.might_contain("https://soundgasm.net/u/user/42")
+    assert not index.might_contain("https://soundgasm.net/u/user/100")
+    assert not index.might_contain(None)
+
+    index.add("https://soundgasm.net/u/user/100")
+    index.add("https://soundgasm.net/u/user/100")
+    assert len(index) == 102
+    assert index.might_contain("https://soundgasm.net/u/user/100")
+    assert (index.lookups, index.misses) == (3, 1)
+    assert index.memory_usage < 102 * 8 + 200
@@ -0,0 +1,81 @@
+import pytest
+import time
+import asyncio
+import threading
+
+import gwaripper.config as cfg
+from gwaripper.utils import TokenBucket, KeyedRateLimiter
+
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(10, capacity=2)
+
+    b4 = time.monotonic()
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    # bucket is empty -> next token after 1/rate seconds
+    assert 0.08 < bucket.acquire() <= 0.1
+    assert time.monotonic() - b4 >= 0.08
+
+    stats = bucket.stats
+    assert stats["requests"] == 3
+    assert stats["delayed"] == 1
+    assert stats["total_wait"] == stats["max_wait"]
+
+
+def test_token_bucket_threads():
+    bucket = TokenBucket(20, capacity=1)
+
+    b4 = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # first one is free, the other 7 have to wait for a token each
+    assert time.monotonic() - b4 >= 7 / 20 - 0.02
+    assert bucket.stats["requests"] == 8
+    assert bucket.stats["delayed"] == 7
+
+
+def test_token_bucket_async():
+    bucket = TokenBucket(20, capacity=1)
+
+    async def main():
+        return await asyncio.gather(*(bucket.acquire_async() for _ in range(3)))
+
+    b4 = time.monotonic()
+    waits = asyncio.run(main())
+    assert time.monotonic() - b4 >= 2 / 20 - 0.02
+    assert waits[0] == 0
+    assert sorted(waits) == waits
+
+
+def test_keyed_rate_limiter():
+    limiter = KeyedRateLimiter({"slow.com": 20, "free.com": 0}, default_rate=1000)
+
+    for _ in range(5):
+        assert limiter.acquire(None) == 0
+        assert limiter.acquire("free.com") == 0
+
+    # burst is as big as the rate
+    for _ in range(20):
+        assert limiter.acquire("slow.com") == 0
+    assert limiter.acquire("slow.com") > 0
+    limiter.acquire("other.com")
+
+    stats = limiter.stats
+    assert set(stats) == {"slow.com", "other.com"}
+    assert stats["slow.com"]["requests"] == 21
+    assert stats["slow.com"]["delayed"] == 1
+    assert stats["other.com"]["delayed"] == 0
+
+
+def test_get_rate_limits(monkeypatch):
+    monkeypatch.setattr(cfg, "config", cfg.configparser.ConfigParser())
+    assert cfg.get_rate_limits() == (4.0, {})
+
+    cfg.config.read_dict({"RateLimits": {
+        "default": "2", "soundgasm.net": "0.5", "whyp.it": "fast"}})
+    assert cfg.get_rate_limits() == (2.0, {"soundgasm.net": 0.5})
@@ -0,0 +1,155 @@
+import pytest
+import time
+import threading
+
+import gwaripper.reddit
+from gwaripper.reddit import (
+    fetch_submissions, redirect_xpost, reddit_praw, get_request_stats
+)
+from gwaripper.gwaripper import GWARipper
+from gwaripper.extractors.base import ExtractorErrorCode
+from gwaripper.extractors.reddit import RedditExtractor
+from utils import setup_tmpdir, local_reddit_api
+
+
+def info_requests(api):
+    return [path for method, path in api.requests if path.startswith("/api/info")]
+
+
+def test_fetch_submissions_batches(local_reddit_api):
+    api = local_reddit_api
+    ids = [f"id{i}" for i in range(250)]
+    for sub_id in ids:
+        api.add_submission(sub_id, title=f"title {sub_id}")
+
+    # deleted submissions are missing in the response; duplicates are only requested once
+    subs = fetch_submissions(ids + ["ID0", "deleted"])
+    assert list(subs) == ids
+    assert subs["id42"].title == "title id42"
+    assert len(info_requests(api)) == 3
+
+    # already fetched -> no further requests
+    assert subs["id42"].permalink == "/r/gonewildaudio/comments/id42/title_id42/"
+    assert all(not path.startswith("/comments/") for _, path in api.requests)
+
+
+def test_redirect_xpost_uses_embedded_parent(local_reddit_api):
+    api = local_reddit_api
+    parent = api.add_submission("parent", title="[F4M] Original",
+                                url="https://soundgasm.net/u/author/original")
+    api.add_submission("xpost", title="[F4M] Crosspost", crosspost_parent="t3_parent",
+                       crosspost_parent_list=[parent])
+    api.add_submission("normal", title="[F4M] Normal")
+
+    subs = fetch_submissions(["xpost", "normal"])
+    assert redirect_xpost(subs["normal"]) is subs["normal"]
+    redirected = redirect_xpost(subs["xpost"])
+    assert redirected.id == "parent"
+    assert redirected.url == "https://soundgasm.net/u/author/original"
+    assert redirected.subreddit.display_name == "gonewildaudio"
+    # neither the parent nor the non-crosspost had to be fetched
+    assert len(api.requests) == 2  # token + info
+
+    # without embedded data the parent is fetched by id
+    api.submissions["xpost"]["crosspost_parent_list"] = []
+    sub = fetch_submissions(["xpost"])["xpost"]
+    assert redirect_xpost(sub).title == "[F4M] Original"
+    assert api.requests[-1][1].startswith("/comments/parent/")
+
+
+def test_download_all_prefetches_reddit(setup_tmpdir, local_reddit_api, monkeypatch):
+    api = local_reddit_api
+    monkeypatch.setattr(RedditExtractor, "is_broken", False)
+    urls = []
+    for i in range(5):
+        sub = api.add_submission(f"sub{i}", title=f"[F4M] Title {i}",
+                                 selftext_html="<div class=\"md\"><p>no links</p></div>")
+        urls.append(f"https://www.reddit.com{sub['permalink']}")
+    urls.append("https://www.reddit.com/r/gonewildaudio/comments/deleted/title/")
+
+    with GWARipper() as gwa:
+        gwa.urls = urls
+        gwa.nr_urls = len(urls)
+        gwa.download_all()
+
+        assert [r.url for r in gwa.extractor_reports] == urls
+        assert all(r.err_code is not ExtractorErrorCode.BROKEN_EXTRACTOR
+                   for r in gwa.extractor_reports)
+
+    # one batch request and a single fallback request for the deleted submission
+    assert len(info_requests(api)) == 1
+    assert [path.split("?")[0] for _, path in api.requests
+            if path.startswith("/comments/")] == ["/comments/deleted/"]
+
+
+def test_reddit_praw_shared(monkeypatch):
+    monkeypatch.setattr(gwaripper.reddit, "reddit_instance", None)
+    created = []
+
+    def create_reddit(**settings):
+        # make a race more likely
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+
+    monkeypatch.setattr(gwaripper.reddit, "create_reddit", create_reddit)
+    instances = []
+    threads = [threading.Thread(target=lambda: instances.append(reddit_praw()))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(created) == 1
+    assert all(inst is created[0] for inst in instances)
+    assert reddit_praw() is created[0]
+
+
+def test_requests_serialized_and_paced(local_reddit_api, monkeypatch):
+    api = local_reddit_api
+    for i in range(6):
+        api.add_submission(f"id{i}")
+
+    # token refreshes and prawcore's rate limit state aren't thread-safe
+    # -> requests of concurrent threads are sent one at a time
+    requestor = gwaripper.reddit.reddit_instance._core._requestor
+    send = requestor.request
+    active = []
+    overlapping = []
+
+    def request(*args, **kwargs):
+        active.append(None)
+        overlapping.append(len(active) > 1)
+        # make an overlap more likely
+        time.sleep(0.02)
+        try:
+            return send(*args, **kwargs)
+        finally:
+            active.pop()
+
+    monkeypatch.setattr(requestor, "request", request)
+    threads = [threading.Thread(target=fetch_submissions, args=([f"id{i}"],))
+               for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # token + 4 info requests
+    assert len(overlapping) == 5
+    assert not any(overlapping)
+    assert get_request_stats()["delayed"] == 0
+
+    # rate limit used up -> prawcore waits till the window resets (1s)
+    api.response_headers.update({"x-ratelimit-remaining": "0", "x-ratelimit-reset": "1",
+                                 "x-ratelimit-used": "600"})
+    fetch_submissions(["id4"])
+    b4 = time.monotonic()
+    fetch_submissions(["id5"])
+    assert time.monotonic() - b4 >= 0.5
+
+    stats = get_request_stats()
+    # token request doesn't go through praw.Reddit.request
+    assert stats["requests"] == 6
+    assert stats["delayed"] == 1
+    assert 0 < stats["total_wait"] <= 1
@@ -0,0 +1,115 @@
+import pytest
+import os
+import argparse
+
+from types import SimpleNamespace
+
+from gwaripper import cli
+from gwaripper.db import load_or_create_sql_db
+from gwaripper.sync import ListingSync, get_watermark, set_watermark, subreddit_source
+from gwaripper.extractors.reddit import RedditExtractor
+from utils import setup_tmpdir, local_reddit_api
+
+
+def listing(created, pulled, data=None):
+    for i, created_utc in enumerate(created):
+        pulled.append(i)
+        yield SimpleNamespace(id=f"id{i}", created_utc=created_utc,
+                              **(data or {}).get(i, {}))
+
+
+def test_watermark_only_moves_forward(setup_tmpdir):
+    db_con, _ = load_or_create_sql_db(os.path.join(setup_tmpdir, "gwarip_db.sqlite"))
+    assert get_watermark(db_con, "subreddit:gonewildaudio") is None
+    set_watermark(db_con, "subreddit:gonewildaudio", 200.0, "b")
+    set_watermark(db_con, "subreddit:gonewildaudio", 100.0, "a")
+    set_watermark(db_con, "redditor:user", 50.0, "c")
+    assert get_watermark(db_con, "subreddit:gonewildaudio") == 200.0
+    set_watermark(db_con, "subreddit:gonewildaudio", 300.0, "d")
+    assert get_watermark(db_con, "subreddit:gonewildaudio") == 300.0
+    assert get_watermark(db_con, "redditor:user") == 50.0
+    db_con.close()
+
+
+def test_listing_sync_stops_at_watermark(setup_tmpdir):
+    db_con, _ = load_or_create_sql_db(os.path.join(setup_tmpdir, "gwarip_db.sqlite"))
+    pulled = []
+    # stickied posts are listed first no matter how old they are
+    sync = ListingSync("subreddit:gwa", 100.0, chronological=True, limit=100, after=100.0)
+    subs = list(sync.filter(listing([50, 130, 120, 100, 90, 80], pulled,
+                                    {0: {"stickied": True}})))
+    assert [sub.id for sub in subs] == ["id1", "id2"]
+    # stopped without consuming the rest of the listing
+    assert pulled == [0, 1, 2, 3]
+    assert sync.reached_watermark
+    sync.save(db_con)
+    assert get_watermark(db_con, "subreddit:gwa") == 130.0
+
+    # not chronological -> older ones are skipped but the listing isn't stopped
+    # and the watermark isn't updated
+    pulled.clear()
+    sync = ListingSync("subreddit:gwa", 130.0, chronological=False, limit=100, after=130.0)
+    subs = list(sync.filter(listing([90, 150, 80], pulled)))
+    assert [sub.id for sub in subs] == ["id1"]
+    assert pulled == [0, 1, 2]
+    assert sync.nr_skipped == 2
+    sync.save(db_con)
+    assert get_watermark(db_con, "subreddit:gwa") == 130.0
+
+    # limit was reached before the watermark -> there might be a gap
+    sync = ListingSync("subreddit:gwa", 130.0, chronological=True, limit=2)
+    assert len(list(sync.filter(listing([200, 190], pulled)))) == 2
+    sync.save(db_con)
+    assert get_watermark(db_con, "subreddit:gwa") == 130.0
+    # listing ended before the limit -> all newer ones were seen
+    sync = ListingSync("subreddit:gwa", 130.0, chronological=True, limit=3)
+    assert len(list(sync.filter(listing([200, 190], pulled)))) == 2
+    sync.save(db_con)
+    assert get_watermark(db_con, "subreddit:gwa") == 200.0
+    db_con.close()
+
+
+def test_cl_sub_only_newer(setup_tmpdir, local_reddit_api, monkeypatch):
+    api = local_reddit_api
+    monkeypatch.setattr(RedditExtractor, "is_broken", False)
+    processed = []
+    monkeypatch.setattr("gwaripper.gwaripper.GWARipper._extract_submission",
+                        lambda self, sub: processed.append(sub.id) or (sub.permalink, None,
+                                                                        None))
+    monkeypatch.setattr("gwaripper.gwaripper.GWARipper._download_extracted",
+                        lambda self, url, info, report: report)
+    monkeypatch.setattr("gwaripper.gwaripper.GWARipper.write_report", lambda *args: None)
+    for i in range(250):
+        api.add_submission(f"old{i}", created_utc=1600000000.0 + i)
+
+    def run(*argv):
+        args = argparse.Namespace(
+            sub="gonewildaudio", sort="new", limit=1000, timefilter="all",
+            download_duplicates=False, skip_non_audio=False, dont_write_selftext=False,
+            only_newer=False)
+        for opt, val in zip(argv[::2], argv[1::2]):
+            setattr(args, opt, val)
+        api.requests.clear()
+        processed.clear()
+        cli._cl_sub(args)
+        return [path for _, path in api.requests if path.startswith("/r/")]
+
+    # first run walks the whole listing and stores the newest submission
+    assert len(run()) == 3
+    assert len(processed) == 250
+    db_con, _ = load_or_create_sql_db(os.path.join(setup_tmpdir, "gwarip_db.sqlite"))
+    assert get_watermark(db_con, subreddit_source("gonewildaudio")) == 1600000249.0
+    db_con.close()
+
+    for i in range(3):
+        api.add_submission(f"new{i}", created_utc=1700000000.0 + i)
+    # steady state: only a single listing page is requested
+    assert len(run("only_newer", True)) == 1
+    assert processed == ["new2", "new1", "new0"]
+    # nothing new
+    assert len(run("only_newer", True)) == 1
+    assert processed == []
+
+    # explicit timestamp
+    run("only_newer", 1600000247.0)
+    assert processed == ["new2", "new1", "new0", "old249", "old248"]
@@ -5,6 +5,11 @@ import time
 import hashlib
 import random
 import sqlite3
+import threading
+import http.server
+import json
+import re
+import urllib.parse
 
 import gwaripper.config as config
 from gwaripper.logging_setup import configure_logging
@@ -143,3 +148,288 @@ def load_db(db_fn, row_fac=False):
     if row_fac:
         db_con.row_factory = sqlite3.Row
     return db_con
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the bytes in server.files[path] and supports (single) Range requests
+    if server.accept_ranges is True
+    Every request is recorded in server.requests as (method, path, headers)
+    Status codes in server.fail_with[path] are returned (one per request) before
+    the file is served
+    server.stall[path] seconds are waited after sending the headers to simulate a
+    stalled host
+    server.etags[path] is sent as ETag and a matching If-None-Match is answered
+    with 304 Not Modified
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _record(self):
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+
+    def do_HEAD(self):
+        self.do_GET(head_only=True)
+
+    def do_GET(self, head_only=False):
+        self._record()
+        fail_with = self.server.fail_with.get(self.path)
+        if fail_with:
+            # either a status code or (status code, headers)
+            status = fail_with.pop(0)
+            headers = {}
+            if isinstance(status, tuple):
+                status, headers = status
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            data = self.server.files[self.path]
+        except KeyError:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = self.server.etags.get(self.path)
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        rng = self.headers.get("Range")
+        status = 200
+        start, end = 0, len(data) - 1
+        if rng and self.server.accept_ranges:
+            first, last = rng.split("=", 1)[1].split("-")
+            start = int(first)
+            end = int(last) if last else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        body = data[start:end + 1]
+        # simulate a dropped connection by sending less than Content-Length
+        # either for the next request of path or for the next range request
+        # starting at start using (path, start) as key
+        truncate_at = self.server.truncate_at.pop(self.path, None)
+        if truncate_at is None and status == 206:
+            truncate_at = self.server.truncate_at.pop((self.path, start), None)
+
+        self.send_response(status)
+        if self.server.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if truncate_at is not None:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        if head_only:
+            return
+        stall = self.server.stall.get(self.path)
+        if stall:
+            time.sleep(stall)
+        if truncate_at is not None:
+            body = body[:truncate_at]
+        self.wfile.write(body)
+
+
+class LocalHTTPServer:
+    def __init__(self, accept_ranges=True):
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.files = {}
+        self.httpd.requests = []
+        self.httpd.truncate_at = {}
+        self.httpd.fail_with = {}
+        self.httpd.stall = {}
+        self.httpd.etags = {}
+        self.httpd.accept_ranges = accept_ranges
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def files(self):
+        return self.httpd.files
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def etags(self):
+        return self.httpd.etags
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def local_http_server():
+    with LocalHTTPServer() as server:
+        yield server
+
+
+class RedditAPIHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the parts of the Reddit API that are used through praw:
+    the token endpoint, /api/info, /comments/<id> and /r/<subreddit>/new
+    Submissions are served from server.submissions (id -> data of a t3 thing)
+    Every request is recorded in server.requests as (method, path)
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in self.server.response_headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _listing(things, after=None):
+        return {"kind": "Listing", "data": {
+            "after": after, "before": None, "dist": len(things),
+            "children": [{"kind": "t3", "data": data} for data in things]}}
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path))
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path.startswith("/api/v1/access_token"):
+            self._send_json({"access_token": "token", "token_type": "bearer",
+                             "expires_in": 3600, "scope": "*"})
+        else:
+            self._send_json({}, status=404)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+        parsed = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        subs = self.server.submissions
+        if parsed.path.rstrip("/") == "/api/info":
+            fullnames = query.get("id", [""])[0].split(",")
+            if len(fullnames) > 100:
+                self._send_json({}, status=400)
+                return
+            self._send_json(self._listing(
+                [subs[fn[3:]] for fn in fullnames if fn[3:] in subs]))
+        elif parsed.path.startswith("/comments/"):
+            sub_id = parsed.path.split("/")[2]
+            if sub_id not in subs:
+                self._send_json({}, status=404)
+                return
+            self._send_json([self._listing([subs[sub_id]]), self._listing([])])
+        elif re.match(r"^/r/[^/]+/new/?$", parsed.path):
+            subreddit = parsed.path.split("/")[2].lower()
+            newest_first = sorted(
+                (data for data in subs.values() if data["subreddit"].lower() == subreddit),
+                key=lambda data: data["created_utc"], reverse=True)
+            after = query.get("after", [None])[0]
+            if after is not None:
+                idx = next(i for i, data in enumerate(newest_first) if data["name"] == after)
+                newest_first = newest_first[idx + 1:]
+            # reddit returns at most 100 things per page
+            limit = min(100, int(query.get("limit", ["25"])[0]))
+            page = newest_first[:limit]
+            self._send_json(self._listing(
+                page, page[-1]["name"] if len(newest_first) > limit else None))
+        else:
+            self._send_json({}, status=404)
+
+
+class LocalRedditAPI:
+    def __init__(self):
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RedditAPIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.submissions = {}
+        self.httpd.requests = []
+        self.httpd.response_headers = {}
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def submissions(self):
+        return self.httpd.submissions
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def response_headers(self):
+        return self.httpd.response_headers
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def add_submission(self, sub_id, title="title", url=None, selftext_html=None,
+                       author="author", subreddit="gonewildaudio", **data):
+        slug = re.sub(r"\W+", "_", title.lower()).strip("_")
+        permalink = f"/r/{subreddit}/comments/{sub_id}/{slug}/"
+        submission = {
+            "id": sub_id, "name": f"t3_{sub_id}", "title": title,
+            "permalink": permalink,
+            "url": url or f"https://www.reddit.com{permalink}",
+            "is_self": url is None, "selftext": "",
+            "selftext_html": selftext_html, "author": author,
+            "subreddit": subreddit, "created_utc": 1600000000.0,
+            "link_flair_text": None, "score": 1,
+        }
+        submission.update(data)
+        self.submissions[sub_id] = submission
+        return submission
+
+    def praw(self):
+        from gwaripper.reddit import create_reddit
+        return create_reddit(client_id="test", client_secret=None,
+                             user_agent="gwaripper tests",
+                             oauth_url=self.base_url, reddit_url=self.base_url,
+                             short_url=self.base_url, check_for_updates=False,
+                             check_for_async=False)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def local_reddit_api(monkeypatch):
+    """Makes reddit_praw use a praw.Reddit instance connected to a LocalRedditAPI"""
+    with LocalRedditAPI() as api:
+        monkeypatch.setattr("gwaripper.reddit.reddit_instance", api.praw())
+        yield api